@@ -0,0 +1,220 @@
+"""
+Nightly batch precomputation of per-user AI health summaries.
+
+/analyze used to ask Gemini for a fresh paragraph on every dashboard load, although
+its inputs (mean, trend, std) barely move within a day. This job:
+  1. finds users with readings in the last --active-days days,
+  2. computes their statistics in bulk (health_stats.compute_stats, grouped SQL),
+  3. regenerates the summary only for users whose statistics moved more than
+     --threshold (relative) since the stored one, with at most --concurrency
+     model calls in flight,
+  4. stores each summary with its generation timestamp and input hash.
+
+/analyze then serves the stored summary and only generates on demand when a user
+has none yet.
+
+Usage, from desktop_app/:
+
+    python ai_summaries.py                          # Gemini, needs GEMINI_API_KEY
+    python ai_summaries.py --stub                   # local stand-in model, no network
+    python ai_summaries.py --threshold 0.05 --concurrency 4 --active-days 30 [--force]
+
+GEMINI_API_ENDPOINT (e.g. http://127.0.0.1:8089, see benchmarks/gemini_stub.py) points
+the Gemini client at another server, here and in the app.
+
+Schedule it nightly, e.g. with cron:  0 3 * * *  cd /app/desktop_app && python ai_summaries.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from health_stats import compute_stats, build_analysis_prompt
+from models import AISummary
+from services import touch_user_data
+
+AI_MODEL_NAME = 'gemini-flash-latest'
+DEFAULT_THRESHOLD = 0.05
+
+# (section, key) of every numeric statistic that feeds the prompt
+_NUMERIC_STATS = [
+    ("weight", "mean"),
+    ("blood_pressure", "sys_mean"),
+    ("blood_pressure", "dia_mean"),
+    ("glucose", "mean"),
+    ("glucose", "std"),
+]
+
+
+class StubModel:
+    """Offline stand-in for genai.GenerativeModel with a fixed per-call latency."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+        return SimpleNamespace(text=f"Resumen de prueba ({digest}): mantén tus hábitos y consulta a tu médico ante cambios.")
+
+
+def stats_hash(stats):
+    """Hash of the statistics as the prompt sees them (rounded like the prompt)."""
+    rounded = {
+        "weight": {"mean": round(stats["weight"]["mean"], 1), "trend": stats["weight"]["trend"]},
+        "blood_pressure": {"sys_mean": round(stats["blood_pressure"]["sys_mean"]),
+                           "dia_mean": round(stats["blood_pressure"]["dia_mean"])},
+        "glucose": {"mean": round(stats["glucose"]["mean"], 1), "std": round(stats["glucose"]["std"], 1)},
+    }
+    return hashlib.sha256(json.dumps(rounded, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def stats_changed(old_stats, new_stats, threshold=DEFAULT_THRESHOLD):
+    """True when the trend flipped or any statistic moved more than `threshold` (relative)."""
+    if old_stats is None:
+        return True
+    if old_stats["weight"]["trend"] != new_stats["weight"]["trend"]:
+        return True
+    for section, key in _NUMERIC_STATS:
+        old, new = old_stats[section][key], new_stats[section][key]
+        if old == 0:
+            if new != 0:
+                return True
+        elif abs(new - old) / abs(old) > threshold:
+            return True
+    return False
+
+
+def active_user_ids(conn, since):
+    """Users with any reading dated on or after `since` (YYYY-MM-DD)."""
+    query = text("""
+        SELECT user_id FROM weight_records WHERE date >= :since
+        UNION SELECT user_id FROM blood_pressure_records WHERE date >= :since
+        UNION SELECT user_id FROM glucose_records WHERE date >= :since
+        UNION SELECT user_id FROM food_records WHERE date >= :since
+    """)
+    return sorted(row[0] for row in conn.execute(query, {"since": since}))
+
+
+def configure_gemini(api_key):
+    """genai.configure, against GEMINI_API_ENDPOINT over REST when that is set."""
+    import google.generativeai as genai
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+    else:
+        genai.configure(api_key=api_key)
+
+
+def generate_summary(model, stats):
+    return model.generate_content(build_analysis_prompt(stats)).text
+
+
+def store_summary(db: Session, user_id, summary_text, stats, model_name, bump_version=True):
+    """Insert or replace the user's stored summary (caller commits)."""
+    stored = db.get(AISummary, user_id)
+    if stored is None:
+        stored = AISummary(user_id=user_id)
+        db.add(stored)
+    stored.summary = summary_text
+    stored.stats_json = json.dumps(stats)
+    stored.input_hash = stats_hash(stats)
+    stored.model = model_name
+    stored.generated_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    if bump_version:
+        # The summary is part of /analyze's response, so cached copies must revalidate
+        touch_user_data(db, user_id)
+    return stored
+
+
+def run_batch(db: Session, model, model_name=AI_MODEL_NAME, threshold=DEFAULT_THRESHOLD,
+              concurrency=4, active_days=30, force=False, log=print):
+    """Regenerate summaries for active users whose statistics changed. Returns a report dict."""
+    since = (datetime.utcnow() - timedelta(days=active_days)).strftime('%Y-%m-%d')
+    conn = db.connection()
+    user_ids = active_user_ids(conn, since)
+    report = {"active_users": len(user_ids), "generated": 0, "unchanged": 0, "failed": 0}
+    if not user_ids:
+        return report
+
+    all_stats = compute_stats(conn, user_ids)
+    stored = {summary.user_id: summary for summary in db.query(AISummary).filter(AISummary.user_id.in_(user_ids))}
+
+    pending = []
+    for user_id in user_ids:
+        previous = stored.get(user_id)
+        if not force and previous is not None:
+            if previous.input_hash == stats_hash(all_stats[user_id]):
+                report["unchanged"] += 1
+                continue
+            old_stats = json.loads(previous.stats_json) if previous.stats_json else None
+            if not stats_changed(old_stats, all_stats[user_id], threshold):
+                report["unchanged"] += 1
+                continue
+        pending.append(user_id)
+
+    # Bounded concurrency against the model; results are written from this thread only
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(generate_summary, model, all_stats[user_id]): user_id for user_id in pending}
+        for future in as_completed(futures):
+            user_id = futures[future]
+            try:
+                summary_text = future.result()
+            except Exception as e:
+                report["failed"] += 1
+                log(f"user {user_id}: generation failed: {e}")
+                continue
+            store_summary(db, user_id, summary_text, all_stats[user_id], model_name)
+            report["generated"] += 1
+            if report["generated"] % 50 == 0:
+                db.commit()
+    db.commit()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute AI health summaries for active users.")
+    parser.add_argument("--stub", action="store_true", help="use a local stand-in model instead of Gemini")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="seconds per stub call")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change in any statistic that triggers regeneration")
+    parser.add_argument("--concurrency", type=int, default=4, help="max model calls in flight")
+    parser.add_argument("--active-days", type=int, default=30, help="only users with readings this recent")
+    parser.add_argument("--force", action="store_true", help="regenerate every active user's summary")
+    args = parser.parse_args()
+
+    if args.stub:
+        model, model_name = StubModel(args.stub_latency), "stub"
+    else:
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            parser.error("GEMINI_API_KEY is not configured (use --stub to run without it)")
+        configure_gemini(api_key)
+        model, model_name = genai.GenerativeModel(AI_MODEL_NAME), AI_MODEL_NAME
+
+    from database import SessionLocal, engine
+    from migrations import check_schema
+    check_schema(engine)
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        report = run_batch(db, model, model_name, args.threshold, args.concurrency, args.active_days, args.force)
+    finally:
+        db.close()
+    print(f"{report['active_users']} active users: {report['generated']} generated, "
+          f"{report['unchanged']} unchanged, {report['failed']} failed in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
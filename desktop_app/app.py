@@ -1,24 +1,47 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, make_response
 from datetime import datetime
+from functools import wraps
+import zlib
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from dotenv import load_dotenv
 import os
 import google.generativeai as genai
 import json
 from database import SessionLocal, engine
-from models import Base, User, HealthRecord, WeightRecord, BloodPressureRecord, GlucoseRecord, FoodRecord, ExerciseRecord
+from models import User, HealthRecord, WeightRecord, BloodPressureRecord, GlucoseRecord, FoodRecord, ExerciseRecord, AISummary
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from services import get_or_create_user, create_health_record
+from services import (
+    get_or_create_user, create_health_record, get_data_version, sync_device_records, get_sync_cursor,
+    create_weight_record, create_blood_pressure_record, create_glucose_record, create_food_record, create_exercise_record
+)
+from migrations import check_schema
+from write_behind import get_writer, WriterOverloaded
+from summaries import get_user_summary, summary_to_dict, verify_summaries
+from health_stats import compute_user_stats, format_basic_analysis
+from ai_summaries import AI_MODEL_NAME, configure_gemini, generate_summary, store_summary
+from glucose_metrics import parse_window, compute_glucose_metrics
+from archive import get_watermarks, read_records
+from charts import parse_chart_params, load_chart_frames, render_plots, ChartTimeout
+from compression import init_compression, etag_variants
+from device_tokens import (
+    SYNC_ALLOW_EMAIL, InvalidToken, bearer_token, authenticate_token, issue_token, list_tokens, revoke_token, token_to_dict,
+    warn_legacy_sync
+)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Chart pool workers (spawn, see charts.py) re-import the script that started the server
+# as __mp_main__. They only run chart code, so startup side effects are skipped there.
+IS_CHART_WORKER = __name__ == "__mp_main__"
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "supersecretkey") # Change this in production!
 
+# Compress large JSON payloads (charts, history) for clients that accept it
+init_compression(app)
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -35,10 +58,75 @@ def load_user(user_id):
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini if API key is available
+# Initialize Gemini if API key is available (GEMINI_API_ENDPOINT overrides the server)
 gemini_api_key = os.getenv("GEMINI_API_KEY")
-if gemini_api_key:
-    genai.configure(api_key=gemini_api_key)
+if gemini_api_key and not IS_CHART_WORKER:
+    configure_gemini(gemini_api_key)
+
+def conditional_on_data_version(view=None, *, vary_on=None):
+    """
+    Serve strong ETag / Last-Modified headers derived from the user's data version.
+    A matching If-None-Match (or If-Modified-Since) short-circuits to 304 before
+    the view runs any SQL or pandas work.
+
+    vary_on(request.args) returns what else the body depends on (e.g. a window that
+    defaults to "the last N days", which moves with the date). It goes into the ETag,
+    and Last-Modified is not used since it only tracks writes. If it raises ValueError
+    the view runs unconditionally and reports the bad input itself.
+    """
+    if view is None:
+        return lambda view: conditional_on_data_version(view, vary_on=vary_on)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        extra = ''
+        if vary_on is not None:
+            try:
+                extra = f"-{vary_on(request.args)}"
+            except ValueError:
+                return view(*args, **kwargs)
+
+        db = SessionLocal()
+        try:
+            version, last_modified = get_data_version(db, current_user.id)
+        finally:
+            db.close()
+        if vary_on is not None:
+            last_modified = None
+
+        # The query string is part of the representation, so it is part of the tag
+        path_hash = zlib.crc32(request.full_path.encode('utf-8'))
+        etag = f"u{current_user.id}-v{version}-{path_hash:08x}{extra}"
+
+        if request.if_none_match:
+            # Compressed bodies carry an encoding-suffixed tag, see compression.py
+            not_modified = any(request.if_none_match.contains(tag) for tag in etag_variants(etag))
+        else:
+            not_modified = bool(
+                request.if_modified_since and last_modified
+                and last_modified <= request.if_modified_since.replace(tzinfo=None)
+            )
+
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            # no-store: the view answered something that does not belong under this version
+            if response.status_code != 200 or response.cache_control.no_store:
+                return response
+
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        # Browsers must revalidate, but may keep the cached body for the 304 case
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+def resolved_glucose_window(args):
+    """The /glucose_metrics window as dates, so the default "last 14 days" varies the ETag."""
+    start, end = parse_window(args)
+    return f"{start:%Y%m%d}-{end:%Y%m%d}"
 
 @app.route('/')
 @login_required
@@ -111,36 +199,148 @@ def service_worker():
 
 # Database initialization
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # One version query; schema changes are applied with `python migrations.py upgrade`
+    check_schema(engine)
 
 # Initialize database
-init_db()
+if not IS_CHART_WORKER:
+    init_db()
+
+def device_auth_error(message):
+    response = jsonify({"status": "error", "message": message})
+    response.status_code = 401
+    response.headers['WWW-Authenticate'] = 'Bearer'
+    return response
 
 @app.route("/sync_data", methods=["POST"])
 def sync_data():
-    # This endpoint might be used by external devices, so we might need API token auth later.
-    # For now, we'll leave it as is but it won't be linked to the web session.
-    # Ideally, the device sends a user identifier.
+    """
+    Upload records from an external device.
+    Devices authenticate with `Authorization: Bearer <device token>` (see /device_tokens);
+    the token fixes both the user and the device id. Only with the deprecated opt-in
+    SYNC_ALLOW_EMAIL=1 are the legacy body fields (email, name, device_id) accepted without one.
+    """
     data = request.json
     db = SessionLocal()
     
     try:
-        # Create or get user
-        user = get_or_create_user(db, data["email"], data["name"], data.get("phone"))
-        
-        # Add health records
-        source_device = data.get("device_id", "unknown")
+        token = bearer_token(request)
+        if token:
+            try:
+                identity = authenticate_token(db, token)
+            except InvalidToken as e:
+                return device_auth_error(str(e))
+            user_id, source_device = identity.user_id, identity.device_id
+        elif SYNC_ALLOW_EMAIL:
+            warn_legacy_sync(data["email"], data.get("device_id", "unknown"))
+            # Create or get user
+            user = get_or_create_user(db, data["email"], data["name"], data.get("phone"))
+            user_id, source_device = user.id, data.get("device_id", "unknown")
+        else:
+            return device_auth_error("a device token is required")
         
-        for record in data["records"]:
-            create_health_record(db, user.id, record, source_device)
+        # Add health records in one transaction; records with a known client_id are skipped
+        result = sync_device_records(db, user_id, data["records"], source_device)
         
-        return jsonify({"status": "success", "user_id": user.id})
+        return jsonify({"status": "success", "user_id": user_id, **result})
     except Exception as e:
         db.rollback()
         return jsonify({"status": "error", "message": str(e)}), 400
     finally:
         db.close()
 
+@app.route("/sync_cursor", methods=["GET"])
+def sync_cursor():
+    """Tell a device what the server already acknowledged, so it uploads only newer records."""
+    db = SessionLocal()
+    try:
+        token = bearer_token(request)
+        if token:
+            try:
+                identity = authenticate_token(db, token)
+            except InvalidToken as e:
+                return device_auth_error(str(e))
+            return jsonify({"status": "success", "cursor": get_sync_cursor(db, identity.user_id, identity.device_id)})
+        if not SYNC_ALLOW_EMAIL:
+            return device_auth_error("a device token is required")
+
+        email = request.args.get("email")
+        if not email:
+            return jsonify({"status": "error", "message": "email is required"}), 400
+        user = db.query(User).filter(User.email == email).first()
+        source_device = request.args.get("device_id", "unknown")
+        warn_legacy_sync(email, source_device)
+        if not user:
+            cursor = {"device_id": source_device, "last_record_date": None, "records_acknowledged": 0, "updated_at": None}
+        else:
+            cursor = get_sync_cursor(db, user.id, source_device)
+        return jsonify({"status": "success", "cursor": cursor})
+    finally:
+        db.close()
+
+@app.route("/device_tokens", methods=["GET", "POST"])
+@login_required
+def device_tokens():
+    """List the current user's device tokens, or issue a new one (the token is only returned here)."""
+    db = SessionLocal()
+    try:
+        if request.method == "GET":
+            return jsonify({"status": "success", "tokens": list_tokens(db, current_user.id)})
+
+        data = request.get_json(silent=True) or {}
+        device_id = (data.get("device_id") or "").strip()
+        if not device_id:
+            return jsonify({"status": "error", "message": "device_id is required"}), 400
+        device_token, token = issue_token(db, current_user.id, device_id, data.get("name"))
+        return jsonify({"status": "success", "token": token, "device_token": token_to_dict(device_token)}), 201
+    except Exception as e:
+        db.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        db.close()
+
+@app.route("/device_tokens/<int:token_id>", methods=["DELETE"])
+@login_required
+def delete_device_token(token_id):
+    """Revoke a device token; every worker stops accepting it within DEVICE_TOKEN_STAMP_CHECK seconds."""
+    db = SessionLocal()
+    try:
+        if not revoke_token(db, current_user.id, token_id):
+            return jsonify({"status": "error", "message": "token not found"}), 404
+        return jsonify({"status": "success"})
+    except Exception as e:
+        db.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        db.close()
+
+# Direct (non write-behind) save path per record type
+WEB_RECORD_CREATORS = {
+    'record': create_health_record,
+    'weight': create_weight_record,
+    'pressure': create_blood_pressure_record,
+    'glucose': create_glucose_record,
+    'food': create_food_record,
+    'exercise': create_exercise_record,
+}
+
+def save_web_record(db, record_type, record_data):
+    """
+    Save one record for the current user. With WRITE_BEHIND=1 the write is handed to
+    the per-process group-commit writer and this blocks until it is committed.
+    """
+    writer = get_writer()
+    if writer:
+        writer.submit(current_user.id, record_type, record_data, 'web_pwa')
+    else:
+        WEB_RECORD_CREATORS[record_type](db, current_user.id, record_data, 'web_pwa')
+
+def writer_overloaded_response():
+    response = jsonify({"status": "error", "message": "Servidor ocupado, intenta de nuevo"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @app.route('/add_record', methods=['GET', 'POST'])
 @login_required
 def add_record():
@@ -152,9 +352,11 @@ def add_record():
         db = SessionLocal()
         try:
             # Use current_user
-            create_health_record(db, current_user.id, data, 'web_pwa')
+            save_web_record(db, 'record', data)
             
             return jsonify({"status": "success"})
+        except WriterOverloaded:
+            return writer_overloaded_response()
         except Exception as e:
             db.rollback()
             return jsonify({"status": "error", "message": str(e)}), 400
@@ -171,9 +373,10 @@ def add_weight():
         data = request.json
         db = SessionLocal()
         try:
-            from services import create_weight_record
-            create_weight_record(db, current_user.id, data, 'web_pwa')
+            save_web_record(db, 'weight', data)
             return jsonify({"status": "success"})
+        except WriterOverloaded:
+            return writer_overloaded_response()
         except Exception as e:
             db.rollback()
             return jsonify({"status": "error", "message": str(e)}), 400
@@ -190,9 +393,10 @@ def add_pressure():
         data = request.json
         db = SessionLocal()
         try:
-            from services import create_blood_pressure_record
-            create_blood_pressure_record(db, current_user.id, data, 'web_pwa')
+            save_web_record(db, 'pressure', data)
             return jsonify({"status": "success"})
+        except WriterOverloaded:
+            return writer_overloaded_response()
         except Exception as e:
             db.rollback()
             return jsonify({"status": "error", "message": str(e)}), 400
@@ -209,9 +413,10 @@ def add_glucose():
         data = request.json
         db = SessionLocal()
         try:
-            from services import create_glucose_record
-            create_glucose_record(db, current_user.id, data, 'web_pwa')
+            save_web_record(db, 'glucose', data)
             return jsonify({"status": "success"})
+        except WriterOverloaded:
+            return writer_overloaded_response()
         except Exception as e:
             db.rollback()
             return jsonify({"status": "error", "message": str(e)}), 400
@@ -244,15 +449,49 @@ def add_food():
         data = request.json
         db = SessionLocal()
         try:
-            from services import create_food_record
-            create_food_record(db, current_user.id, data, 'web_pwa')
+            save_web_record(db, 'food', data)
             return jsonify({"status": "success"})
+        except WriterOverloaded:
+            return writer_overloaded_response()
         except Exception as e:
             db.rollback()
             return jsonify({"status": "error", "message": str(e)}), 400
         finally:
             db.close()
 
+@app.route('/add/batch', methods=['POST'])
+@login_required
+def add_batch():
+    """
+    Commit a batch of queued writes in a single transaction.
+    Used by the service worker to flush records saved while offline.
+    Body: {"records": [{"type": "weight" | "pressure" | "glucose" | "food" | "exercise" | "record", "data": {...}}]}
+    """
+    data = request.json or {}
+    entries = data.get("records")
+    if not isinstance(entries, list):
+        return jsonify({"status": "error", "message": "'records' must be a list"}), 400
+
+    # Exercise entries arrive exactly as the /add/exercise form posts them
+    entries = [
+        {"type": "exercise", "data": exercise_form_to_record(entry.get("data") or {})}
+        if isinstance(entry, dict) and entry.get("type") == "exercise" else entry
+        for entry in entries
+    ]
+    if not all(isinstance(entry, dict) for entry in entries):
+        return jsonify({"status": "error", "message": "Each record must be an object"}), 400
+
+    db = SessionLocal()
+    try:
+        from services import create_records_batch
+        created = create_records_batch(db, current_user.id, entries, 'web_pwa')
+        return jsonify({"status": "success", "created": created})
+    except Exception as e:
+        db.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    finally:
+        db.close()
+
 @app.route('/analyze_food', methods=['POST'])
 @login_required
 def analyze_food():
@@ -329,6 +568,19 @@ def analyze_exercise():
         print(f"Error analyzing exercise: {e}")
         return jsonify({"error": str(e)}), 500
 
+def exercise_form_to_record(data):
+    """Map the (Spanish) exercise form fields to ExerciseRecord fields."""
+    return {
+        "date": data.get("date"),
+        "exercise_type": data.get("tipo_ejercicio"),
+        "duration_minutes": data.get("duracion_minutos"),
+        "calories_burned": data.get("calorias_quemadas"),
+        "intensity": data.get("intensidad"),
+        "notes": data.get("otros_datos_de_interes"),
+        "sync_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "client_id": data.get("client_id")
+    }
+
 @app.route('/add/exercise', methods=['GET', 'POST'])
 @login_required
 def add_exercise():
@@ -339,20 +591,10 @@ def add_exercise():
         data = request.json
         db = SessionLocal()
         try:
-            from services import create_exercise_record
-            
-            record_data = {
-                "date": data.get("date"),
-                "exercise_type": data.get("tipo_ejercicio"),
-                "duration_minutes": data.get("duracion_minutos"),
-                "calories_burned": data.get("calorias_quemadas"),
-                "intensity": data.get("intensidad"),
-                "notes": data.get("otros_datos_de_interes"),
-                "sync_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            create_exercise_record(db, current_user.id, record_data, 'web_pwa')
+            save_web_record(db, 'exercise', exercise_form_to_record(data))
             return jsonify({"status": "success"})
+        except WriterOverloaded:
+            return writer_overloaded_response()
         except Exception as e:
             db.rollback()
             return jsonify({"status": "error", "message": str(e)}), 400
@@ -361,140 +603,30 @@ def add_exercise():
 
 @app.route("/generate_plots")
 @login_required
+@conditional_on_data_version
 def generate_plots():
+    """
+    Plotly figures for the dashboard.
+    Optional query args: from / to (YYYY-MM-DD, inclusive) and granularity (raw, day, week, month).
+    """
     user_id = current_user.id
-    plots = {}
-    
+
+    try:
+        start, end, granularity = parse_chart_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     try:
         with engine.connect() as conn:
-            # 1. Weight Data
-            weight_query = text("SELECT date, weight FROM weight_records WHERE user_id = :user_id ORDER BY date")
-            weight_data = pd.read_sql_query(weight_query, conn, params={"user_id": user_id})
-            
-            if not weight_data.empty:
-                weight_data['date'] = pd.to_datetime(weight_data['date'])
-                weight_data['weight'] = pd.to_numeric(weight_data['weight'], errors='coerce')
-                weight_data = weight_data.dropna(subset=['weight'])
-                weight_data = weight_data[weight_data['weight'] > 0].sort_values('date')
-                
-                if not weight_data.empty:
-                    weight_data['date_only'] = weight_data['date'].dt.date.astype(str)
-                    daily_weight = weight_data.groupby('date_only', as_index=False).agg({'weight': 'last'})
-                    
-                    # Calculate range
-                    min_w = daily_weight['weight'].min()
-                    max_w = daily_weight['weight'].max()
-                    padding = max(1.0, (max_w - min_w) * 0.1)
-                    
-                    fig_weight = px.bar(daily_weight, x='date_only', y='weight', title='Weight Over Time')
-                    fig_weight.update_traces(
-                        marker=dict(color='#4CAF50', line=dict(width=1, color='white'))
-                    )
-                    fig_weight.update_layout(
-                        yaxis_title='Peso (kg)',
-                        xaxis_title='Fecha',
-                        yaxis=dict(range=[min_w - padding, max_w + padding]),
-                        plot_bgcolor='white'
-                    )
-                    plots['weight'] = fig_weight.to_json()
-
-            # 2. Blood Pressure Data
-            bp_query = text("SELECT date, systolic as blood_pressure_sys, diastolic as blood_pressure_dia FROM blood_pressure_records WHERE user_id = :user_id ORDER BY date")
-            bp_data = pd.read_sql_query(bp_query, conn, params={"user_id": user_id})
-            
-            if not bp_data.empty:
-                bp_data['date'] = pd.to_datetime(bp_data['date'])
-                bp_data['blood_pressure_sys'] = pd.to_numeric(bp_data['blood_pressure_sys'], errors='coerce')
-                bp_data['blood_pressure_dia'] = pd.to_numeric(bp_data['blood_pressure_dia'], errors='coerce')
-                bp_data = bp_data.dropna(subset=['blood_pressure_sys', 'blood_pressure_dia'])
-                bp_data = bp_data[(bp_data['blood_pressure_sys'] > 0) & (bp_data['blood_pressure_dia'] > 0)].sort_values('date')
-
-                if not bp_data.empty:
-                    fig_bp = go.Figure()
-                    fig_bp.add_trace(go.Scatter(x=bp_data["date"], y=bp_data["blood_pressure_sys"], name="Sistólica", mode='lines+markers'))
-                    fig_bp.add_trace(go.Scatter(x=bp_data["date"], y=bp_data["blood_pressure_dia"], name="Diastólica", mode='lines+markers'))
-                    fig_bp.update_layout(title="Blood Pressure Over Time", yaxis_title='Presión (mmHg)')
-                    plots["blood_pressure"] = fig_bp.to_json()
-
-            # 3. Glucose Data
-            glucose_query = text("SELECT date, glucose_level FROM glucose_records WHERE user_id = :user_id ORDER BY date")
-            glucose_data = pd.read_sql_query(glucose_query, conn, params={"user_id": user_id})
-            
-            if not glucose_data.empty:
-                glucose_data['date'] = pd.to_datetime(glucose_data['date'])
-                glucose_data['glucose_level'] = pd.to_numeric(glucose_data['glucose_level'], errors='coerce')
-                glucose_data = glucose_data.dropna(subset=['glucose_level'])
-                glucose_data = glucose_data[glucose_data['glucose_level'] > 0].sort_values('date')
-                
-                if not glucose_data.empty:
-                    fig_glucose = px.line(glucose_data, x="date", y="glucose_level", title="Glucose Levels Over Time")
-                    fig_glucose.update_traces(mode='lines+markers')
-                    fig_glucose.update_layout(yaxis_title='Glucosa (mg/dL)')
-                    plots["glucose"] = fig_glucose.to_json()
-
-            # 4. Food Data
-            food_query = text("SELECT date, meals FROM food_records WHERE user_id = :user_id ORDER BY date")
-            food_data = pd.read_sql_query(food_query, conn, params={"user_id": user_id})
-            
-            if not food_data.empty:
-                # Filter to keep only the last record per day
-                food_data['date_obj'] = pd.to_datetime(food_data['date'])
-                food_data['date_only'] = food_data['date_obj'].dt.date.astype(str)
-                # Sort by date just in case, then group by date_only and take last
-                food_data = food_data.sort_values('date').groupby('date_only').last().reset_index()
-
-                meal_rows = []
-                macro_rows = {}
-                
-                for idx, row in food_data.iterrows():
-                    date_str = row['date_only']
-                    meals_cell = row.get('meals')
-                    
-                    if not meals_cell:
-                        continue
-                        
-                    try:
-                        meals = json.loads(meals_cell) if isinstance(meals_cell, str) else meals_cell
-                    except Exception:
-                        continue
-                        
-                    if date_str not in macro_rows:
-                        macro_rows[date_str] = {'date': date_str, 'protein': 0, 'carbs': 0, 'fat': 0}
-                        
-                    if isinstance(meals, dict):
-                        for meal_name, meal_data in meals.items():
-                            if isinstance(meal_data, dict):
-                                p = float(meal_data.get('protein', 0) or 0)
-                                c = float(meal_data.get('carbs', 0) or 0)
-                                f = float(meal_data.get('fat', 0) or 0)
-                                total_grams = p + c + f
-                                
-                                meal_rows.append({
-                                    'date': date_str, 
-                                    'meal': meal_name, 
-                                    'grams': total_grams
-                                })
-                                
-                                macro_rows[date_str]['protein'] += p
-                                macro_rows[date_str]['carbs'] += c
-                                macro_rows[date_str]['fat'] += f
-                
-                if meal_rows:
-                    meals_df = pd.DataFrame(meal_rows)
-                    fig_meals = px.bar(meals_df, x='date', y='grams', color='meal', title='Por día / Comida (g totales)')
-                    plots['meals_by_day'] = fig_meals.to_json()
-                    
-                if macro_rows:
-                    macro_df = pd.DataFrame(list(macro_rows.values())).sort_values('date')
-                    fig_macros = go.Figure()
-                    fig_macros.add_trace(go.Bar(x=macro_df['date'], y=macro_df['protein'], name='Proteínas (g)'))
-                    fig_macros.add_trace(go.Bar(x=macro_df['date'], y=macro_df['carbs'], name='Carbohidratos (g)'))
-                    fig_macros.add_trace(go.Bar(x=macro_df['date'], y=macro_df['fat'], name='Grasas (g)'))
-                    fig_macros.update_layout(barmode='stack', title='Macronutrientes por día (g)')
-                    plots['macros_by_day'] = fig_macros.to_json()
+            frames = load_chart_frames(conn, user_id, start, end)
 
-        return jsonify(plots)
+        return jsonify(render_plots(frames, granularity))
 
+    except ChartTimeout as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '2'
+        return response
     except Exception as e:
         print(f"Error generating plots: {e}")
         return jsonify({"error": str(e)}), 500
@@ -555,80 +687,48 @@ def save_local_report(data):
 
 @app.route("/analyze")
 @login_required
+@conditional_on_data_version
 def analyze_health_data():
     user_id = current_user.id
     try:
-        stats = {
-            "weight": {"mean": 0, "trend": "insufficient data"},
-            "blood_pressure": {"sys_mean": 0, "dia_mean": 0},
-            "glucose": {"mean": 0, "std": 0}
-        }
-        
         with engine.connect() as conn:
-            # Weight Analysis
-            w_query = text("SELECT weight FROM weight_records WHERE user_id = :user_id ORDER BY date")
-            w_data = pd.read_sql_query(w_query, conn, params={"user_id": user_id})
-            if not w_data.empty:
-                w_data['weight'] = pd.to_numeric(w_data['weight'], errors='coerce')
-                w_data = w_data[w_data['weight'] > 0]
-                if not w_data.empty:
-                    stats["weight"]["mean"] = w_data["weight"].mean()
-                    if len(w_data) > 1:
-                        stats["weight"]["trend"] = "increasing" if w_data["weight"].diff().mean() > 0 else "decreasing"
-
-            # BP Analysis
-            bp_query = text("SELECT systolic, diastolic FROM blood_pressure_records WHERE user_id = :user_id")
-            bp_data = pd.read_sql_query(bp_query, conn, params={"user_id": user_id})
-            if not bp_data.empty:
-                bp_data['systolic'] = pd.to_numeric(bp_data['systolic'], errors='coerce')
-                bp_data['diastolic'] = pd.to_numeric(bp_data['diastolic'], errors='coerce')
-                bp_data = bp_data[(bp_data['systolic'] > 0) & (bp_data['diastolic'] > 0)]
-                if not bp_data.empty:
-                    stats["blood_pressure"]["sys_mean"] = bp_data["systolic"].mean()
-                    stats["blood_pressure"]["dia_mean"] = bp_data["diastolic"].mean()
-
-            # Glucose Analysis
-            g_query = text("SELECT glucose_level FROM glucose_records WHERE user_id = :user_id")
-            g_data = pd.read_sql_query(g_query, conn, params={"user_id": user_id})
-            if not g_data.empty:
-                g_data['glucose_level'] = pd.to_numeric(g_data['glucose_level'], errors='coerce')
-                g_data = g_data[g_data['glucose_level'] > 0]
-                if not g_data.empty:
-                    stats["glucose"]["mean"] = g_data["glucose_level"].mean()
-                    stats["glucose"]["std"] = g_data["glucose_level"].std() if len(g_data) > 1 else 0
+            stats = compute_user_stats(conn, user_id)
 
-        analysis = f"""
-        Análisis básico de salud:
-        - Peso promedio: {stats['weight']['mean']:.1f}kg (Tendencia: {stats['weight']['trend']})
-        - Presión arterial promedio: {stats['blood_pressure']['sys_mean']:.0f}/{stats['blood_pressure']['dia_mean']:.0f}
-        - Glucosa promedio: {stats['glucose']['mean']:.1f} (Desviación estándar: {stats['glucose']['std']:.1f})
-        """
-        
         analysis_result = {
             "statistics": stats,
-            "analysis": analysis
+            "analysis": format_basic_analysis(stats)
         }
         
-        # AI Analysis if enabled
-        if gemini_api_key:
-            try:
-                analysis_prompt = f"""
-                Analiza las siguientes metricas de salud:
-                Peso: Media {stats['weight']['mean']:.1f}kg, Tendencia: {stats['weight']['trend']}
-                Presión arterial: Media {stats['blood_pressure']['sys_mean']:.0f}/{stats['blood_pressure']['dia_mean']:.0f}
-                Glucosa: Media {stats['glucose']['mean']:.1f}, Desviación estándar {stats['glucose']['std']:.1f}
-                
-                Provee un breve análisis de salud y recomendaciones.
-                No presentes cuadros o tablas, realiza el análisis en un solo párrafo.
-                """
-                
-                model = genai.GenerativeModel('gemini-flash-latest')
-                response = model.generate_content(analysis_prompt)
-                analysis_result['ai_analysis'] = response.text
-            except Exception as e:
-                analysis_result['ai_analysis'] = f"Análisis AI no disponible: {str(e)}"
+        # AI analysis: precomputed by the nightly batch (ai_summaries.py), on demand only if missing
+        ai_failed = False
+        db = SessionLocal()
+        try:
+            stored = db.get(AISummary, user_id)
+            if stored:
+                analysis_result['ai_analysis'] = stored.summary
+                analysis_result['ai_generated_at'] = stored.generated_at
+            elif gemini_api_key:
+                try:
+                    model = genai.GenerativeModel(AI_MODEL_NAME)
+                    summary_text = generate_summary(model, stats)
+                    stored = store_summary(db, user_id, summary_text, stats, AI_MODEL_NAME, bump_version=False)
+                    generated_at = stored.generated_at
+                    db.commit()
+                    # Same body as later requests serving the stored summary under this ETag
+                    analysis_result['ai_analysis'] = summary_text
+                    analysis_result['ai_generated_at'] = generated_at
+                except Exception as e:
+                    db.rollback()
+                    ai_failed = True
+                    analysis_result['ai_analysis'] = f"Análisis AI no disponible: {str(e)}"
+        finally:
+            db.close()
         
-        return jsonify(analysis_result)
+        response = jsonify(analysis_result)
+        if ai_failed:
+            # A retry may succeed without any new data: never cache (or ETag) the failure
+            response.headers['Cache-Control'] = 'no-store'
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -636,21 +736,72 @@ def send_report(data):
     """Guarda el reporte localmente ya que WhatsApp no está configurado"""
     return save_local_report(data)
 
+@app.route('/summary', methods=['GET'])
+@login_required
+@conditional_on_data_version
+def get_summary():
+    """
+    Latest and average values for the dashboard stat cards, from the per-user snapshot.
+    ?verify=1 also reports the fields that disagree with the raw tables (report only;
+    repairs go through `python summaries.py verify --fix`).
+    """
+    db = SessionLocal()
+    try:
+        summary = get_user_summary(db, current_user.id)
+        result = {'status': 'success', 'summary': summary_to_dict(summary)}
+        if request.args.get('verify') == '1':
+            result['drifted'] = verify_summaries(db, [current_user.id]).get(current_user.id, [])
+        return jsonify(result)
+    except Exception as e:
+        db.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        db.close()
+
+@app.route('/glucose_metrics', methods=['GET'])
+@login_required
+@conditional_on_data_version(vary_on=resolved_glucose_window)
+def get_glucose_metrics():
+    """
+    Glucose variability (time in range, CV, GMI, MAGE, daily and hourly profiles).
+    Optional query args: from / to (YYYY-MM-DD, inclusive), the last 14 days by default.
+    """
+    try:
+        start, end = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    db = SessionLocal()
+    try:
+        metrics = compute_glucose_metrics(db, current_user.id, start, end)
+        return jsonify({'status': 'success', 'metrics': metrics})
+    except Exception as e:
+        db.rollback()
+        print(f"Error computing glucose metrics: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        db.close()
+
 @app.route('/health_data', methods=['GET'])
 @login_required
+@conditional_on_data_version
 def get_health_data():
     try:
         user_id = current_user.id
         all_data = []
         
         with engine.connect() as conn:
+            # Hot tables, plus archive files for users with archived readings
+            watermarks = get_watermarks(conn, user_id)
+
+            def read(table, columns):
+                return read_records(conn, table, user_id, columns, watermarks=watermarks).to_dict("records")
+
             # 1. Weight
-            w_query = text("SELECT date, weight FROM weight_records WHERE user_id = :user_id")
-            w_rows = conn.execute(w_query, {"user_id": user_id}).fetchall()
-            for row in w_rows:
+            for row in read("weight_records", ["date", "weight"]):
                 all_data.append({
-                    "date": row.date,
-                    "weight": row.weight,
+                    "date": row["date"],
+                    "weight": row["weight"],
                     "blood_pressure_sys": None,
                     "blood_pressure_dia": None,
                     "glucose_level": None,
@@ -658,44 +809,38 @@ def get_health_data():
                 })
                 
             # 2. BP
-            bp_query = text("SELECT date, systolic, diastolic FROM blood_pressure_records WHERE user_id = :user_id")
-            bp_rows = conn.execute(bp_query, {"user_id": user_id}).fetchall()
-            for row in bp_rows:
+            for row in read("blood_pressure_records", ["date", "systolic", "diastolic"]):
                 all_data.append({
-                    "date": row.date,
+                    "date": row["date"],
                     "weight": None,
-                    "blood_pressure_sys": row.systolic,
-                    "blood_pressure_dia": row.diastolic,
+                    "blood_pressure_sys": row["systolic"],
+                    "blood_pressure_dia": row["diastolic"],
                     "glucose_level": None,
                     "meals": None
                 })
                 
             # 3. Glucose
-            g_query = text("SELECT date, glucose_level FROM glucose_records WHERE user_id = :user_id")
-            g_rows = conn.execute(g_query, {"user_id": user_id}).fetchall()
-            for row in g_rows:
+            for row in read("glucose_records", ["date", "glucose_level"]):
                 all_data.append({
-                    "date": row.date,
+                    "date": row["date"],
                     "weight": None,
                     "blood_pressure_sys": None,
                     "blood_pressure_dia": None,
-                    "glucose_level": row.glucose_level,
+                    "glucose_level": row["glucose_level"],
                     "meals": None
                 })
                 
             # 4. Food
-            f_query = text("SELECT date, meals FROM food_records WHERE user_id = :user_id")
-            f_rows = conn.execute(f_query, {"user_id": user_id}).fetchall()
-            for row in f_rows:
+            for row in read("food_records", ["date", "meals"]):
                 meals_parsed = None
                 try:
-                    if row.meals:
-                        meals_parsed = json.loads(row.meals) if isinstance(row.meals, str) else row.meals
+                    if row["meals"]:
+                        meals_parsed = json.loads(row["meals"]) if isinstance(row["meals"], str) else row["meals"]
                 except:
                     pass
                     
                 all_data.append({
-                    "date": row.date,
+                    "date": row["date"],
                     "weight": None,
                     "blood_pressure_sys": None,
                     "blood_pressure_dia": None,
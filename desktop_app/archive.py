@@ -0,0 +1,352 @@
+"""
+Hot/cold storage for old readings.
+
+An archive run moves readings older than a cutoff out of the SQLite record tables into
+per-user, per-year Parquet files (zstd-compressed, every column kept), so the hot
+database stays small while the full history remains queryable:
+
+    ARCHIVE_DIR/<table>/user_<id>/<year>.parquet
+
+For every (user, table) an ArchiveWatermark row records the newest cutoff used plus
+aggregates of the archived readings, so the dashboard summary and the statistics can
+include them without opening the files. Reads go through read_records(), which only
+opens archive files when the requested date range starts before the watermark and
+merges them with the hot rows in date order.
+
+A run writes the year files first (atomically, merged with what is already there and
+de-duplicated by ROW_KEY), then deletes the hot rows and updates the watermark in
+one transaction. If it is interrupted in between, rows can exist in both tiers until
+the next run; readers keep the hot copy (without_hot_copies).
+
+Record ids alone do not identify a reading across the tiers: a SQLite table without
+AUTOINCREMENT hands the highest deleted rowid to the next insert. Rows are matched on
+ROW_KEY instead, and a run refuses to archive such a table (migrations.py upgrade
+rebuilds it with AUTOINCREMENT).
+
+Writing or reading archive files needs the optional `pyarrow` package.
+
+Usage, from desktop_app/:
+
+    python archive.py run --older-than-days 365 [--user-id 3] [--dry-run]
+    python archive.py status
+
+Tunables (environment variables):
+    ARCHIVE_DIR  - where archive files are kept, default desktop_app/archive
+"""
+import argparse
+import os
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+try:
+    import pyarrow
+except ImportError:  # pyarrow is optional, only needed once something is archived
+    pyarrow = None
+
+from models import ArchiveWatermark
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+# Record table -> value columns folded into the watermark aggregates (value, value2)
+ARCHIVE_TABLES = {
+    "weight_records": ("weight", None),
+    "blood_pressure_records": ("systolic", "diastolic"),
+    "glucose_records": ("glucose_level", None),
+    "food_records": (None, None),
+    "exercise_records": (None, None),
+}
+DELETE_BATCH = 500
+
+# Identifies one reading in both tiers (see the module docstring)
+ROW_KEY = ["id", "date", "client_id"]
+
+
+class ArchiveUnavailable(RuntimeError):
+    """Archiving cannot run: the optional pyarrow package is missing, or ids could be reused."""
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ArchiveUnavailable("archived readings need the optional 'pyarrow' package (pip install pyarrow)")
+
+
+def _user_dir(table, user_id):
+    return os.path.join(ARCHIVE_DIR, table, f"user_{user_id}")
+
+
+def archive_files(table, user_id, first_year=None, last_year=None):
+    """Paths of one user's year files for a table, oldest first."""
+    directory = _user_dir(table, user_id)
+    if not os.path.isdir(directory):
+        return []
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        year, extension = os.path.splitext(name)
+        if extension != ".parquet" or not year.isdigit():
+            continue
+        if (first_year and int(year) < first_year) or (last_year and int(year) > last_year):
+            continue
+        paths.append(os.path.join(directory, name))
+    return paths
+
+
+def archived_user_ids(table):
+    """Users with archive files for a table."""
+    table_dir = os.path.join(ARCHIVE_DIR, table)
+    if not os.path.isdir(table_dir):
+        return []
+    return sorted(int(name[5:]) for name in os.listdir(table_dir)
+                  if name.startswith("user_") and name[5:].isdigit())
+
+
+def read_archive(table, user_id, columns, start=None, end=None):
+    """Archived rows of a user's table with `columns`, dated in [start, end) (YYYY-MM-DD or None)."""
+    paths = archive_files(table, user_id,
+                          int(start[:4]) if start else None,
+                          int(end[:4]) if end else None)
+    if not paths:
+        return pd.DataFrame(columns=columns)
+    _require_pyarrow()
+    frame = pd.concat([pd.read_parquet(path, columns=columns) for path in paths], ignore_index=True)
+    dates = frame["date"].astype(str)
+    keep = pd.Series(True, index=frame.index)
+    if start:
+        keep &= dates >= start
+    if end:
+        keep &= dates < end
+    return frame[keep]
+
+
+def get_watermarks(conn, user_id):
+    """{table: archived_before} for the user's archived tables."""
+    rows = conn.execute(
+        text("SELECT table_name, archived_before FROM archive_watermarks WHERE user_id = :user_id"),
+        {"user_id": user_id})
+    return {row.table_name: row.archived_before for row in rows}
+
+
+def archived_aggregates(conn, table, user_ids=None):
+    """{user_id: watermark row} with the archived-reading aggregates of one table."""
+    query = "SELECT * FROM archive_watermarks WHERE table_name = :table"
+    params = {"table": table}
+    if user_ids is not None:
+        query = text(query + " AND user_id IN :user_ids").bindparams(bindparam("user_ids", expanding=True))
+        params["user_ids"] = list(user_ids)
+    else:
+        query = text(query)
+    return {row.user_id: row for row in conn.execute(query, params)}
+
+
+def _row_keys(frame):
+    keys = frame[ROW_KEY]
+    # The tiers disagree on dtypes (None vs NaN client ids, object vs string dates)
+    return pd.MultiIndex.from_frame(keys.astype(str).where(keys.notna(), ""))
+
+
+def without_hot_copies(conn, table, user_id, archived, hot=None):
+    """
+    Drop archived rows (with ROW_KEY columns) whose hot copy still exists, as left by a run
+    interrupted between writing files and deleting rows. `hot` defaults to a lookup of the
+    user's hot rows up to the newest archived date.
+    """
+    if archived.empty:
+        return archived
+    if hot is None:
+        hot = pd.read_sql_query(
+            text(f"SELECT {', '.join(ROW_KEY)} FROM {table} WHERE user_id = :user_id AND date <= :last"),
+            conn, params={"user_id": user_id, "last": str(archived["date"].max())})
+    if hot.empty:
+        return archived
+    return archived[~_row_keys(archived).isin(_row_keys(hot))]
+
+
+def read_records(conn, table, user_id, columns, start=None, end=None, watermarks=None):
+    """
+    The user's rows of a record table with `columns` (including 'date'), dated in
+    [start, end) (YYYY-MM-DD strings, None for open ends), ordered by date. Archive
+    files are read only when the range reaches before the table's watermark.
+    Pass `watermarks` (from get_watermarks) to share one lookup across tables.
+    """
+    if watermarks is None:
+        watermarks = get_watermarks(conn, user_id)
+    archived_before = watermarks.get(table)
+    use_archive = archived_before is not None and (start is None or start < archived_before)
+
+    select = list(columns) + ([key for key in ROW_KEY if key not in columns] if use_archive else [])
+    # Dates are stored as ISO-like strings, so the range is a plain string comparison
+    sql = f"SELECT {', '.join(select)} FROM {table} WHERE user_id = :user_id"
+    params = {"user_id": user_id}
+    if start:
+        sql += " AND date >= :start"
+        params["start"] = start
+    if end:
+        sql += " AND date < :end"
+        params["end"] = end
+    hot = pd.read_sql_query(text(sql + " ORDER BY date"), conn, params=params)
+    if not use_archive:
+        return hot
+
+    archived = without_hot_copies(conn, table, user_id, read_archive(table, user_id, select, start, end), hot)
+    if archived.empty:
+        return hot[list(columns)]
+    merged = pd.concat([archived, hot], ignore_index=True) if not hot.empty else archived
+    return merged.sort_values("date", kind="stable")[list(columns)].reset_index(drop=True)
+
+
+def _value_aggregates(frame, value, value2):
+    """Aggregates over archived rows with positive readings, as the dashboard counts them."""
+    if value is None:
+        return None
+    values = pd.to_numeric(frame[value], errors="coerce")
+    keep = values > 0
+    values2 = None
+    if value2:
+        values2 = pd.to_numeric(frame[value2], errors="coerce")
+        keep &= values2 > 0
+    kept = frame[keep].assign(_value=values[keep], _value2=values2[keep] if value2 else None)
+    if kept.empty:
+        return None
+    kept = kept.sort_values(["date", "id"], kind="stable")
+    first, last = kept.iloc[0], kept.iloc[-1]
+    return {
+        "value_count": len(kept),
+        "value_sum": float(kept["_value"].sum()),
+        "value_sumsq": float((kept["_value"] ** 2).sum()),
+        "value2_sum": float(kept["_value2"].sum()) if value2 else 0.0,
+        "first": (str(first["date"]), int(first["id"]), float(first["_value"])),
+        "last": (str(last["date"]), int(last["id"]), float(last["_value"]),
+                 float(last["_value2"]) if value2 else None),
+    }
+
+
+def _update_watermark(db: Session, user_id, table, cutoff, moved):
+    watermark = db.get(ArchiveWatermark, (user_id, table))
+    if watermark is None:
+        watermark = ArchiveWatermark(user_id=user_id, table_name=table, archived_before=cutoff, row_count=0,
+                                     value_count=0, value_sum=0, value_sumsq=0, value2_sum=0)
+        db.add(watermark)
+    watermark.archived_before = max(watermark.archived_before, cutoff)
+    watermark.row_count += len(moved)
+
+    aggregates = _value_aggregates(moved, *ARCHIVE_TABLES[table])
+    if aggregates:
+        watermark.value_count += aggregates["value_count"]
+        watermark.value_sum += aggregates["value_sum"]
+        watermark.value_sumsq += aggregates["value_sumsq"]
+        watermark.value2_sum += aggregates["value2_sum"]
+        first_date, first_id, first_value = aggregates["first"]
+        if watermark.first_date is None or (first_date, first_id) < (watermark.first_date, watermark.first_id):
+            watermark.first_date, watermark.first_id, watermark.first_value = first_date, first_id, first_value
+        last_date, last_id, last_value, last_value2 = aggregates["last"]
+        if watermark.last_date is None or (last_date, last_id) > (watermark.last_date, watermark.last_id):
+            watermark.last_date, watermark.last_id = last_date, last_id
+            watermark.last_value, watermark.last_value2 = last_value, last_value2
+    watermark.updated_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _ids_never_reused(db: Session, table):
+    """Whether the table's ids are never handed out again (SQLite needs AUTOINCREMENT for that)."""
+    if db.get_bind().dialect.name != "sqlite":
+        return True
+    sql = db.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                     {"name": table}).scalar()
+    return sql is not None and "AUTOINCREMENT" in sql.upper()
+
+
+def archive_user_table(db: Session, table, user_id, cutoff, dry_run=False):
+    """Move one user's rows of `table` dated before `cutoff` (YYYY-MM-DD) to the archive. Returns the row count."""
+    if not dry_run and not _ids_never_reused(db, table):
+        raise ArchiveUnavailable(f"{table} can reuse the ids of archived rows: run `python migrations.py upgrade` first")
+    moved = pd.read_sql_query(
+        text(f"SELECT * FROM {table} WHERE user_id = :user_id AND date < :cutoff ORDER BY date, id"),
+        db.connection(), params={"user_id": user_id, "cutoff": cutoff})
+    years = moved["date"].astype(str).str[:4]
+    # Rows without a usable date stay in the hot table
+    usable = years.str.isdigit()
+    moved, years = moved[usable], years[usable]
+    if moved.empty or dry_run:
+        return len(moved)
+
+    _require_pyarrow()
+    directory = _user_dir(table, user_id)
+    os.makedirs(directory, exist_ok=True)
+    for year, rows in moved.groupby(years):
+        path = os.path.join(directory, f"{year}.parquet")
+        if os.path.exists(path):
+            existing = pd.read_parquet(path)
+            rows = pd.concat([existing[~_row_keys(existing).isin(_row_keys(rows))], rows], ignore_index=True)
+        tmp_path = path + ".tmp"
+        rows.sort_values(["date", "id"], kind="stable").to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, path)
+
+    delete = text(f"DELETE FROM {table} WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+    ids = moved["id"].tolist()
+    for offset in range(0, len(ids), DELETE_BATCH):
+        db.execute(delete, {"ids": ids[offset:offset + DELETE_BATCH]})
+    _update_watermark(db, user_id, table, cutoff, moved)
+    db.commit()
+    return len(moved)
+
+
+def run_archive(db: Session, older_than_days, user_ids=None, dry_run=False, log=print):
+    """Archive every table's readings older than `older_than_days`. Returns {table: rows moved}."""
+    cutoff = (date.today() - timedelta(days=older_than_days)).isoformat()
+    report = {}
+    for table in ARCHIVE_TABLES:
+        candidates = [row[0] for row in db.execute(
+            text(f"SELECT DISTINCT user_id FROM {table} WHERE date < :cutoff"), {"cutoff": cutoff})]
+        if user_ids is not None:
+            candidates = [user_id for user_id in candidates if user_id in user_ids]
+        moved = 0
+        for user_id in candidates:
+            try:
+                moved += archive_user_table(db, table, user_id, cutoff, dry_run)
+            except ArchiveUnavailable:
+                raise
+            except Exception as e:
+                db.rollback()
+                log(f"{table}, user {user_id}: archive failed: {e}")
+        report[table] = moved
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old readings to per-user Parquet archive files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run", help="archive readings older than --older-than-days")
+    run.add_argument("--older-than-days", type=int, default=365, help="age (days) after which readings are archived")
+    run.add_argument("--user-id", type=int, action="append", help="limit to these users (repeatable)")
+    run.add_argument("--dry-run", action="store_true", help="only count the rows that would move")
+    subparsers.add_parser("status", help="show archive watermarks")
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+    from migrations import check_schema
+    check_schema(engine)
+
+    db = SessionLocal()
+    try:
+        if args.command == "status":
+            watermarks = db.query(ArchiveWatermark).order_by(ArchiveWatermark.user_id, ArchiveWatermark.table_name).all()
+            if not watermarks:
+                print("Nothing archived yet.")
+            for watermark in watermarks:
+                print(f"user {watermark.user_id} {watermark.table_name}: {watermark.row_count} rows "
+                      f"before {watermark.archived_before}")
+            return
+        report = run_archive(db, args.older_than_days, args.user_id, args.dry_run)
+    except ArchiveUnavailable as e:
+        parser.error(str(e))
+    finally:
+        db.close()
+
+    verb = "would move" if args.dry_run else "moved"
+    for table, moved in report.items():
+        print(f"{table}: {verb} {moved} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark: latency of light routes while heavy /generate_plots requests run concurrently,
+with charts built inline (request thread) versus in the chart process pool.
+
+Seeds a scratch SQLite database with one "heavy" user (long BP / glucose / food history)
+and one light user, then for each mode runs --heavy threads requesting the heavy user's
+/generate_plots in a loop while --light threads time the light user's /summary and
+/sync_cursor. Usage, from desktop_app/:
+
+    python benchmarks/bench_chart_executor.py --heavy 4 --light 4 --seconds 10
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_charts_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+os.environ.pop("GEMINI_API_KEY", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app checks the schema version at import, so migrate the scratch database first
+from database import engine  # noqa: E402
+from migrations import upgrade  # noqa: E402
+upgrade(engine, log=lambda message: None)
+
+import charts  # noqa: E402
+from app import app  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from device_tokens import issue_token  # noqa: E402
+from models import User  # noqa: E402
+from services import create_records_batch  # noqa: E402
+
+
+def seed(readings):
+    db = SessionLocal()
+    for email in ("heavy@example.com", "light@example.com"):
+        user = User(name=email.split("@")[0], email=email)
+        user.set_password("bench")
+        db.add(user)
+    db.commit()
+    heavy_id = db.query(User.id).filter(User.email == "heavy@example.com").scalar()
+    light_id = db.query(User.id).filter(User.email == "light@example.com").scalar()
+
+    start = datetime(2022, 1, 1)
+    entries = []
+    for i in range(readings):
+        when = (start + timedelta(minutes=37 * i)).strftime("%Y-%m-%d %H:%M:%S")
+        entries.append({"type": "pressure", "data": {"date": when, "blood_pressure_sys": random.randint(105, 150),
+                                                     "blood_pressure_dia": random.randint(65, 95)}})
+        entries.append({"type": "glucose", "data": {"date": when, "glucose_level": random.uniform(70, 200)}})
+        if i % 20 == 0:
+            entries.append({"type": "weight", "data": {"date": when, "weight": random.uniform(70, 80)}})
+            entries.append({"type": "food", "data": {"date": when, "meals": {
+                "breakfast": {"protein": 20, "carbs": 50, "fat": 10},
+                "lunch": {"protein": 35, "carbs": 60, "fat": 20},
+                "dinner": {"protein": 30, "carbs": 40, "fat": 15}}}})
+    create_records_batch(db, heavy_id, entries, "bench")
+    create_records_batch(db, light_id, [{"type": "weight", "data": {"date": "2024-01-01", "weight": 70}}], "bench")
+    _, token = issue_token(db, light_id, "bench")
+    db.close()
+    return token
+
+
+def logged_in_client(email):
+    client = app.test_client()
+    client.post("/login", data={"email": email, "password": "bench"})
+    return client
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] * 1000
+
+
+def run(mode, heavy, light, seconds, token):
+    charts.CHART_EXECUTOR = mode
+    stop = threading.Event()
+    light_latencies, heavy_latencies, errors = [], [], []
+    lock = threading.Lock()
+
+    def heavy_worker():
+        client = logged_in_client("heavy@example.com")
+        while not stop.is_set():
+            started = time.perf_counter()
+            # A unique query string defeats the ETag short-circuit so every request builds charts
+            response = client.get(f"/generate_plots?nocache={random.random()}")
+            with lock:
+                (heavy_latencies if response.status_code == 200 else errors).append(time.perf_counter() - started)
+
+    def light_worker():
+        client = logged_in_client("light@example.com")
+        requests = [("/summary", {}), ("/sync_cursor", {"Authorization": f"Bearer {token}"})]
+        while not stop.is_set():
+            started = time.perf_counter()
+            path, headers = random.choice(requests)
+            response = client.get(path, headers=headers)
+            with lock:
+                (light_latencies if response.status_code == 200 else errors).append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    if mode == "process":
+        # Warm the pool so worker start-up is not counted
+        for _ in range(charts.CHART_POOL_WORKERS):
+            logged_in_client("light@example.com").get(f"/generate_plots?warm={random.random()}")
+
+    threads = [threading.Thread(target=heavy_worker) for _ in range(heavy)]
+    threads += [threading.Thread(target=light_worker) for _ in range(light)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f"{mode:<8} light: {len(light_latencies):>6} req  p50 {percentile(light_latencies, 50):8.1f} ms  "
+          f"p95 {percentile(light_latencies, 95):8.1f} ms  p99 {percentile(light_latencies, 99):8.1f} ms   "
+          f"heavy: {len(heavy_latencies):>4} req  p50 {percentile(heavy_latencies, 50):8.1f} ms   errors {len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--heavy", type=int, default=4, help="threads requesting heavy charts")
+    parser.add_argument("--light", type=int, default=4, help="threads timing light routes")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readings", type=int, default=20000, help="BP and glucose readings for the heavy user")
+    args = parser.parse_args()
+
+    token = seed(args.readings)
+    print(f"{args.heavy} heavy + {args.light} light threads, {args.seconds:.0f}s per mode, "
+          f"pool workers: {charts.CHART_POOL_WORKERS}\n")
+    for mode in ("inline", "process"):
+        run(mode, args.heavy, args.light, args.seconds, token)
+    charts.shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: single-record writes per second with and without write-behind (group commit).
+
+Runs N threads that each save M weight records against a throw-away SQLite database,
+first through services.create_weight_record (one commit per record), then through
+WriteBehindWriter. Usage, from desktop_app/:
+
+    python benchmarks/bench_write_behind.py --threads 16 --writes 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# The database module reads its path at import time, so point it at a scratch file first
+_tmp_dir = tempfile.mkdtemp(prefix="bench_write_behind_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, engine  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from models import User  # noqa: E402
+from services import create_weight_record  # noqa: E402
+from write_behind import WriteBehindWriter  # noqa: E402
+
+
+def _record(i):
+    return {"date": f"2024-01-01 08:{i % 60:02d}:00", "weight": 70 + (i % 10) / 10}
+
+
+def run(label, threads, writes, write_one):
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(user_id):
+        for i in range(writes):
+            started = time.perf_counter()
+            try:
+                write_one(user_id, _record(i))
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=worker, args=(uid,)) for uid in range(1, threads + 1)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+    print(f"{label:<16} {len(latencies) / elapsed:>10.0f} writes/s   p50 {p50:7.2f} ms   p99 {p99:7.2f} ms   errors {len(errors)}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=50, help="writes per thread")
+    parser.add_argument("--window-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    upgrade(engine, log=lambda message: None)
+    db = SessionLocal()
+    db.add_all([User(id=uid, name=f"bench{uid}", email=f"bench{uid}@example.com") for uid in range(1, args.threads + 1)])
+    db.commit()
+    db.close()
+
+    total = args.threads * args.writes
+    print(f"{args.threads} threads x {args.writes} writes = {total} records\n")
+
+    def direct(user_id, data):
+        session = SessionLocal()
+        try:
+            create_weight_record(session, user_id, data, "bench")
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    elapsed = run("direct commit", args.threads, args.writes, direct)
+    print(f"{'':<16} {total / elapsed:>10.0f} commits/s")
+
+    writer = WriteBehindWriter(SessionLocal, window_ms=args.window_ms, max_queue=max(1000, total)).start()
+    run("write-behind", args.threads, args.writes,
+        lambda user_id, data: writer.submit(user_id, "weight", data, "bench"))
+    writer.shutdown()
+    print(f"{'':<16} {writer.commits:>10} commits for {writer.records_written} records "
+          f"({writer.records_written / max(writer.commits, 1):.1f} records/commit)")
+
+
+if __name__ == "__main__":
+    main()
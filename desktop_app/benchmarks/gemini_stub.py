@@ -0,0 +1,164 @@
+"""
+Local stand-in for the Gemini REST API (models/*:generateContent), for load tests.
+
+Answers each call after a latency drawn from a configurable distribution, with the
+JSON the app expects: macronutrients for /analyze_food prompts, exercise details for
+/analyze_exercise prompts, a short paragraph otherwise. Point the app at it with
+
+    GEMINI_API_KEY=stub GEMINI_API_ENDPOINT=http://127.0.0.1:8089 python app.py
+
+Usage, from desktop_app/:
+
+    python benchmarks/gemini_stub.py --port 8089 --latency lognormal:900,0.4 [--error-rate 0.01]
+
+Latency distributions (milliseconds):
+    fixed:MS                 - every call takes MS
+    uniform:LO,HI            - uniform between LO and HI
+    lognormal:MEDIAN,SIGMA   - log-normal with that median and log-space sigma (long tail)
+    file:PATH                - resample latencies measured in production, one per line
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_GENERATE_PATH = re.compile(r"^/v1(?:beta)?/models/[^/:]+:generateContent")
+
+
+def parse_latency(spec):
+    """Turn a distribution spec (see module docstring) into a function returning seconds."""
+    kind, _, params = spec.partition(":")
+    try:
+        if kind == "fixed":
+            ms = float(params)
+            return lambda: ms / 1000
+        if kind == "uniform":
+            low, high = (float(value) for value in params.split(","))
+            return lambda: random.uniform(low, high) / 1000
+        if kind == "lognormal":
+            median, sigma = (float(value) for value in params.split(","))
+            return lambda: random.lognormvariate(math.log(median), sigma) / 1000
+        if kind == "file":
+            with open(params) as f:
+                samples = [float(line) for line in f if line.strip()]
+            if samples:
+                return lambda: random.choice(samples) / 1000
+    except ValueError:
+        pass
+    raise ValueError(f"invalid latency distribution '{spec}'")
+
+
+def _prompt_text(body):
+    return " ".join(
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def _answer(prompt):
+    if "macronutrients" in prompt:
+        protein, carbs, fat = random.randint(5, 60), random.randint(10, 120), random.randint(3, 50)
+        return json.dumps({"protein": protein, "carbs": carbs, "fat": fat,
+                           "calories": protein * 4 + carbs * 4 + fat * 9})
+    if "exercise" in prompt:
+        return json.dumps({"tipo_ejercicio": "Caminata", "duracion_minutos": 30, "calorias_quemadas": 150,
+                           "intensidad": "media", "otros_datos_de_interes": ""})
+    return ("Tus indicadores se mantienen estables. Continúa con tus registros diarios "
+            "y consulta a tu médico ante cualquier cambio.")
+
+
+class GeminiStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency, error_rate=0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors,
+                    "mean_latency_ms": self.latency_total / self.calls * 1000 if self.calls else 0.0}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not _GENERATE_PATH.match(self.path):
+            self._send(404, {"error": {"code": 404, "message": f"unknown path {self.path}", "status": "NOT_FOUND"}})
+            return
+
+        delay = self.server.latency()
+        time.sleep(delay)
+        failed = random.random() < self.server.error_rate
+        with self.server._lock:
+            self.server.calls += 1
+            self.server.errors += failed
+            self.server.latency_total += delay
+        if failed:
+            self._send(503, {"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}})
+            return
+
+        text = _answer(_prompt_text(json.loads(body or b"{}")))
+        self._send(200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": len(body) // 4, "candidatesTokenCount": len(text) // 4,
+                              "totalTokenCount": (len(body) + len(text)) // 4},
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(latency_spec, error_rate=0.0, host="127.0.0.1", port=0):
+    """Serve the stub from a background thread; port 0 picks a free one. Returns the server."""
+    server = GeminiStub((host, port), parse_latency(latency_spec), error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:900,0.4", help="latency distribution, see above")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with 503")
+    args = parser.parse_args()
+
+    try:
+        server = GeminiStub((args.host, args.port), parse_latency(args.latency), args.error_rate)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Gemini stub on {server.url} ({args.latency}, error rate {args.error_rate:.1%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {server.stats()['calls']} calls")
+
+
+if __name__ == "__main__":
+    main()
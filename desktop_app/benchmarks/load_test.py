@@ -0,0 +1,357 @@
+"""
+Load test: how many concurrent users one app server handles, entirely on this machine.
+
+Starts the Gemini stub (gemini_stub.py) and the app on a scratch SQLite database, as
+the container does (migrations first, then the threaded Werkzeug server), registers
+--users users with a device token and --history readings each, then runs one virtual
+user per registered user for --seconds. Every virtual user loops over the journey
+
+    login -> dashboard: /health_data, /generate_plots, /analyze
+          -> /analyze_food, then /add/food with the estimate
+          -> --sync-bursts back-to-back POST /sync_data of --sync-records readings (device token)
+
+keeping its ETags between journeys like a browser does, with --think seconds between
+steps. The report gives throughput, p50/p95/p99 latency and error rate per route, and
+DB lock errors (responses mentioning a locked database). Usage, from desktop_app/:
+
+    python benchmarks/load_test.py --users 20 --seconds 60 --gemini-latency lognormal:900,0.4
+    python benchmarks/load_test.py --users 50 --ramp-up 10 --json report.json
+
+Server settings (WRITE_BEHIND, CHART_EXECUTOR, ...) are read from this environment by
+the spawned app. To load a server you started yourself, pass --url; it must already
+use a Gemini stub (python benchmarks/gemini_stub.py) and a database that can be filled
+with test users.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import requests
+
+from gemini_stub import start_stub
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCK_ERROR = re.compile(r"database is locked|database table is locked|deadlock detected|could not obtain lock",
+                        re.IGNORECASE)
+PASSWORD = "load-test"
+FOODS = ["dos huevos revueltos con pan integral", "arroz con pollo y ensalada", "avena con plátano y nueces",
+         "pescado a la plancha con verduras", "lentejas con arroz"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted seconds, in milliseconds."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, -(-len(values) * pct // 100) - 1))] * 1000
+
+
+class RouteStats:
+    """Latencies, errors and lock errors per route, shared by all virtual users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, elapsed, status, ok, locked):
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            self.statuses[route][status] += 1
+            if not ok:
+                self.errors[route] += 1
+            if locked:
+                self.lock_errors[route] += 1
+
+    def report(self, seconds):
+        rows = []
+        for route in sorted(self.latencies):
+            latencies = sorted(self.latencies[route])
+            rows.append({
+                "route": route,
+                "requests": len(latencies),
+                "rps": len(latencies) / seconds,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "max_ms": latencies[-1] * 1000,
+                "errors": self.errors[route],
+                "error_rate": self.errors[route] / len(latencies),
+                "lock_errors": self.lock_errors[route],
+                "statuses": {str(status): count for status, count in sorted(self.statuses[route].items())},
+            })
+        return rows
+
+
+class VirtualUser:
+    def __init__(self, base_url, email, token, args, stats):
+        self.base_url = base_url
+        self.email = email
+        self.token = token
+        self.args = args
+        self.stats = stats
+        self.etags = {}  # path -> ETag, the browser cache
+        self.session = None
+        self.journeys = 0
+
+    def request(self, route, method, path, expect=(200,), **kwargs):
+        headers = kwargs.pop("headers", {})
+        if method == "GET" and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, headers=headers,
+                                            timeout=self.args.timeout, allow_redirects=False, **kwargs)
+            status, body = response.status_code, response.text
+        except requests.RequestException as e:
+            response, status, body = None, 0, str(e)
+        elapsed = time.perf_counter() - started
+
+        ok = status in expect or (status == 304 and method == "GET")
+        self.stats.record(route, elapsed, status, ok, bool(LOCK_ERROR.search(body)))
+        if ok and response is not None and response.headers.get("ETag"):
+            self.etags[path] = response.headers["ETag"]
+        return response if ok else None
+
+    def think(self):
+        if self.args.think:
+            time.sleep(random.uniform(0.5, 1.5) * self.args.think)
+
+    def journey(self):
+        self.session = requests.Session()
+        try:
+            if self.request("POST /login", "POST", "/login", expect=(302,),
+                            data={"email": self.email, "password": PASSWORD}) is None:
+                return
+            self.think()
+            self.request("GET /health_data", "GET", "/health_data")
+            self.request("GET /generate_plots", "GET", "/generate_plots")
+            self.request("GET /analyze", "GET", "/analyze")
+            self.think()
+
+            estimate = self.request("POST /analyze_food", "POST", "/analyze_food",
+                                    json={"description": random.choice(FOODS)})
+            macros = estimate.json() if estimate is not None else {"protein": 20, "carbs": 50, "fat": 10}
+            meal = {key: macros.get(key, 0) for key in ("protein", "carbs", "fat")}
+            self.think()
+            self.request("POST /add/food", "POST", "/add/food", json={
+                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "meals": {random.choice(["breakfast", "lunch", "dinner"]): meal},
+                "client_id": str(uuid.uuid4()),
+            })
+            self.think()
+
+            for _ in range(self.args.sync_bursts):
+                self.request("POST /sync_data", "POST", "/sync_data",
+                             headers={"Authorization": f"Bearer {self.token}"},
+                             json={"records": sync_records(self.args.sync_records)})
+            self.journeys += 1
+        finally:
+            self.session.close()
+
+    def run(self, stop):
+        while not stop.is_set():
+            self.journey()
+            self.think()
+
+
+def sync_records(count):
+    now = datetime.now()
+    records = []
+    for _ in range(count):
+        when = now - timedelta(minutes=random.randint(0, 24 * 60))
+        records.append({
+            "date": when.strftime("%Y-%m-%d %H:%M:%S"),
+            "blood_pressure_sys": random.randint(105, 150),
+            "blood_pressure_dia": random.randint(65, 95),
+            "glucose_level": round(random.uniform(70, 200), 1),
+            "client_id": str(uuid.uuid4()),
+        })
+    return records
+
+
+def history_entries(count):
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / max(count, 1)
+    entries = []
+    for i in range(count):
+        when = (start + step * i).strftime("%Y-%m-%d %H:%M:%S")
+        entries.append({"type": "pressure", "data": {"date": when, "blood_pressure_sys": random.randint(105, 150),
+                                                     "blood_pressure_dia": random.randint(65, 95)}})
+        entries.append({"type": "glucose", "data": {"date": when, "glucose_level": random.uniform(70, 200)}})
+        if i % 10 == 0:
+            entries.append({"type": "weight", "data": {"date": when, "weight": random.uniform(60, 95)}})
+    return entries
+
+
+def register_users(base_url, count, history, run_id):
+    """Create the test users over HTTP. Returns [(email, device token)]."""
+    users = []
+    for i in range(count):
+        email = f"load-{run_id}-{i}@example.com"
+        with requests.Session() as session:
+            response = session.post(f"{base_url}/register", allow_redirects=False,
+                                    data={"name": f"Load {i}", "email": email, "password": PASSWORD})
+            if response.status_code != 302 or "/register" in response.headers.get("Location", ""):
+                raise RuntimeError(f"could not register {email}: HTTP {response.status_code}")
+            response = session.post(f"{base_url}/device_tokens", json={"device_id": f"load-{i}", "name": "load test"})
+            response.raise_for_status()
+            token = response.json()["token"]
+            entries = history_entries(history)
+            for chunk in range(0, len(entries), 500):
+                session.post(f"{base_url}/add/batch", json={"records": entries[chunk:chunk + 500]}).raise_for_status()
+        users.append((email, token))
+    return users
+
+
+def start_app(tmp_dir, gemini_url):
+    """Migrate a scratch database and start the app on a free port. Returns (process, base URL, log path)."""
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp_dir, 'load.db')}",
+               GEMINI_API_KEY="load-test", GEMINI_API_ENDPOINT=gemini_url, PYTHONUNBUFFERED="1")
+    subprocess.run([sys.executable, "migrations.py", "upgrade"], cwd=APP_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    log_path = os.path.join(tmp_dir, "server.log")
+    log = open(log_path, "w")
+    # Same server as `python app.py`, without the debug reloader
+    process = subprocess.Popen(
+        [sys.executable, "-c", f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the app exited with code {process.returncode}, see {log_path}")
+        try:
+            requests.get(f"{base_url}/login", timeout=1)
+            return process, base_url, log_path
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"the app did not start within 60s, see {log_path}")
+
+
+def print_report(report):
+    print(f"\n{report['users']} virtual users, {report['seconds']:.1f}s: {report['journeys']} journeys "
+          f"({report['journeys_per_second']:.2f}/s), {report['requests']} requests "
+          f"({report['requests_per_second']:.1f}/s), error rate {report['error_rate']:.2%}, "
+          f"DB lock errors {report['lock_errors']}\n")
+    print(f"{'route':<22}{'req':>7}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'errors':>9}{'locks':>7}")
+    for row in report["routes"]:
+        print(f"{row['route']:<22}{row['requests']:>7}{row['rps']:>8.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}{row['error_rate']:>9.1%}{row['lock_errors']:>7}")
+    for row in report["routes"]:
+        failed = {status: count for status, count in row["statuses"].items() if status not in ("200", "302", "304")}
+        if failed:
+            print(f"  {row['route']}: {', '.join(f'HTTP {status} x{count}' for status, count in failed.items())}")
+    if report.get("gemini"):
+        gemini = report["gemini"]
+        print(f"\nGemini stub: {gemini['calls']} calls, {gemini['errors']} errors, "
+              f"mean latency {gemini['mean_latency_ms']:.0f} ms")
+    if report.get("server_log_lock_errors") is not None:
+        print(f"Server log: {report['server_log_lock_errors']} lines mentioning a locked database")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--seconds", type=float, default=60, help="measured duration")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which virtual users start")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between journey steps (0 = none)")
+    parser.add_argument("--history", type=int, default=2000, help="BP and glucose readings seeded per user")
+    parser.add_argument("--sync-bursts", type=int, default=3, help="POST /sync_data calls per journey")
+    parser.add_argument("--sync-records", type=int, default=50, help="readings per /sync_data call")
+    parser.add_argument("--gemini-latency", default="lognormal:900,0.4",
+                        help="stub latency distribution (see gemini_stub.py)")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="share of stub calls answered with 503")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request client timeout in seconds")
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="load_test_")
+    stub, process, log_path = None, None, None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            try:
+                stub = start_stub(args.gemini_latency, args.gemini_error_rate)
+            except ValueError as e:
+                parser.error(str(e))
+            process, base_url, log_path = start_app(tmp_dir, stub.url)
+            print(f"App on {base_url} (log: {log_path}), Gemini stub on {stub.url} ({args.gemini_latency})")
+
+        print(f"Registering {args.users} users with {args.history} readings each...")
+        users = register_users(base_url, args.users, args.history, uuid.uuid4().hex[:8])
+
+        stats = RouteStats()
+        stop = threading.Event()
+        virtual_users = [VirtualUser(base_url, email, token, args, stats) for email, token in users]
+        threads = [threading.Thread(target=vu.run, args=(stop,), daemon=True) for vu in virtual_users]
+        print(f"Running {args.users} virtual users for {args.seconds:.0f}s (ramp-up {args.ramp_up:.0f}s)...")
+        started = time.perf_counter()
+        for i, thread in enumerate(threads):
+            thread.start()
+            if args.ramp_up and i < len(threads) - 1:
+                time.sleep(args.ramp_up / len(threads))
+        stop.wait(max(0.0, args.seconds - (time.perf_counter() - started)))
+        stop.set()
+        for thread in threads:
+            thread.join()
+        # In-flight journeys finish after the stop, so throughput uses the real elapsed time
+        elapsed = time.perf_counter() - started
+
+        routes = stats.report(elapsed)
+        requests_total = sum(row["requests"] for row in routes)
+        report = {
+            "users": args.users,
+            "seconds": elapsed,
+            "journeys": sum(vu.journeys for vu in virtual_users),
+            "journeys_per_second": sum(vu.journeys for vu in virtual_users) / elapsed,
+            "requests": requests_total,
+            "requests_per_second": requests_total / elapsed,
+            "error_rate": sum(row["errors"] for row in routes) / requests_total if requests_total else 0.0,
+            "lock_errors": sum(row["lock_errors"] for row in routes),
+            "routes": routes,
+            "gemini": stub.stats() if stub else None,
+        }
+        if log_path:
+            with open(log_path, errors="replace") as f:
+                report["server_log_lock_errors"] = sum(1 for line in f if LOCK_ERROR.search(line))
+
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\nReport written to {args.json}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        if stub:
+            stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
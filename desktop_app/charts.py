@@ -0,0 +1,360 @@
+"""
+Chart data loading and Plotly figure building for /generate_plots.
+
+Charts accept a date range and a granularity:
+    raw   - every reading (weight: last value per day), the historical behaviour
+    day / week / month - readings resampled into buckets; blood pressure and glucose
+            are drawn as the bucket mean with a min-max band, food macros are summed
+
+so a multi-year range renders a few hundred points instead of tens of thousands.
+
+Building figures and serializing them is CPU-bound pure Python that holds the GIL.
+With CHART_EXECUTOR=process the request thread only fetches compact column arrays
+and a bounded process pool builds and serializes the figures. Tunables:
+    CHART_POOL_WORKERS      - worker processes, default min(4, CPUs)
+    CHART_POOL_MAX_PENDING  - chart jobs queued or running at once, default 2 x workers
+    CHART_POOL_TIMEOUT      - seconds to wait for a slot and for the result, default 20
+If the pool is unavailable (broken worker, cannot start) the charts are built inline.
+"""
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from archive import get_watermarks, read_records
+
+# pandas resample rules per granularity. "W-MON" buckets are anchored on Mondays but
+# pandas closes and labels them on the right (Tue-Mon, labeled with the closing Monday),
+# so RESAMPLE_BINS is passed to every resample: weeks run Monday-Sunday, labeled by their Monday
+GRANULARITIES = {"raw": None, "day": "D", "week": "W-MON", "month": "MS"}
+RESAMPLE_BINS = {"closed": "left", "label": "left"}
+
+MACROS = ["protein", "carbs", "fat"]
+
+# Separator used to flatten {meal: {macro: value}} with json_normalize
+_KEY_SEP = "\x1f"
+
+
+def parse_chart_params(args):
+    """
+    Read `from`, `to` (YYYY-MM-DD, inclusive) and `granularity` from request args.
+    Returns (start, end_exclusive, granularity); raises ValueError on bad input.
+    """
+    granularity = args.get("granularity", "raw")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+
+    def parse_date(name):
+        value = args.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format")
+
+    start = parse_date("from")
+    end = parse_date("to")
+    if start and end and end < start:
+        raise ValueError("'to' must not be before 'from'")
+    end_exclusive = end + timedelta(days=1) if end else None
+    return start, end_exclusive, granularity
+
+
+def load_chart_frames(conn, user_id, start=None, end=None):
+    """Fetch the raw rows each chart needs, limited to [start, end), from the hot tables and the archive."""
+    start = start.strftime("%Y-%m-%d") if start else None
+    end = end.strftime("%Y-%m-%d") if end else None
+    watermarks = get_watermarks(conn, user_id)
+
+    def read(table, columns):
+        return read_records(conn, table, user_id, columns, start, end, watermarks)
+
+    return {
+        "weight": read("weight_records", ["date", "weight"]),
+        "blood_pressure": read("blood_pressure_records", ["date", "systolic", "diastolic"]).rename(
+            columns={"systolic": "blood_pressure_sys", "diastolic": "blood_pressure_dia"}),
+        "glucose": read("glucose_records", ["date", "glucose_level"]),
+        "food": read("food_records", ["date", "meals"]),
+    }
+
+
+def _clean(frame, value_columns):
+    """Parse dates and drop missing / non-positive readings, sorted by date."""
+    frame = frame.copy()
+    frame["date"] = pd.to_datetime(frame["date"], format="mixed", errors="coerce")
+    for column in value_columns:
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    frame = frame.dropna(subset=["date"] + value_columns)
+    positive = (frame[value_columns] > 0).all(axis=1)
+    return frame[positive].sort_values("date")
+
+
+def _bucket_labels(index, granularity):
+    return index.strftime("%Y-%m") if granularity == "month" else index.strftime("%Y-%m-%d")
+
+
+def _band_traces(fig, stats, column, name, color):
+    """Mean line with a shaded min-max band for one resampled series."""
+    x = stats.index
+    fig.add_trace(go.Scatter(x=x, y=stats[(column, "max")], mode="lines", line=dict(width=0),
+                             showlegend=False, hoverinfo="skip"))
+    fig.add_trace(go.Scatter(x=x, y=stats[(column, "min")], mode="lines", line=dict(width=0),
+                             fill="tonexty", fillcolor=color.replace("1)", "0.2)"),
+                             name=f"{name} (mín-máx)", hoverinfo="skip"))
+    fig.add_trace(go.Scatter(x=x, y=stats[(column, "mean")], mode="lines+markers",
+                             line=dict(color=color), name=name))
+
+
+def _resampled_stats(frame, columns, granularity):
+    rule = GRANULARITIES[granularity]
+    stats = frame.set_index("date")[columns].resample(rule, **RESAMPLE_BINS).agg(["mean", "min", "max"])
+    return stats.dropna(how="all")
+
+
+def build_weight_figure(weight_data, granularity="raw"):
+    weight_data = _clean(weight_data, ["weight"])
+    if weight_data.empty:
+        return None
+
+    # Raw keeps one bar per day (the day's last weighing), buckets keep their last value
+    rule = GRANULARITIES[granularity] or "D"
+    daily_weight = weight_data.set_index("date")["weight"].resample(rule, **RESAMPLE_BINS).last().dropna()
+    daily_weight = pd.DataFrame({
+        "date_only": _bucket_labels(daily_weight.index, granularity),
+        "weight": daily_weight.values,
+    })
+
+    # Calculate range
+    min_w = daily_weight['weight'].min()
+    max_w = daily_weight['weight'].max()
+    padding = max(1.0, (max_w - min_w) * 0.1)
+
+    fig_weight = px.bar(daily_weight, x='date_only', y='weight', title='Weight Over Time')
+    fig_weight.update_traces(
+        marker=dict(color='#4CAF50', line=dict(width=1, color='white'))
+    )
+    fig_weight.update_layout(
+        yaxis_title='Peso (kg)',
+        xaxis_title='Fecha',
+        yaxis=dict(range=[min_w - padding, max_w + padding]),
+        plot_bgcolor='white'
+    )
+    return fig_weight
+
+
+def build_blood_pressure_figure(bp_data, granularity="raw"):
+    bp_data = _clean(bp_data, ["blood_pressure_sys", "blood_pressure_dia"])
+    if bp_data.empty:
+        return None
+
+    fig_bp = go.Figure()
+    if granularity == "raw":
+        fig_bp.add_trace(go.Scatter(x=bp_data["date"], y=bp_data["blood_pressure_sys"], name="Sistólica", mode='lines+markers'))
+        fig_bp.add_trace(go.Scatter(x=bp_data["date"], y=bp_data["blood_pressure_dia"], name="Diastólica", mode='lines+markers'))
+    else:
+        stats = _resampled_stats(bp_data, ["blood_pressure_sys", "blood_pressure_dia"], granularity)
+        _band_traces(fig_bp, stats, "blood_pressure_sys", "Sistólica", "rgba(31, 119, 180, 1)")
+        _band_traces(fig_bp, stats, "blood_pressure_dia", "Diastólica", "rgba(255, 127, 14, 1)")
+    fig_bp.update_layout(title="Blood Pressure Over Time", yaxis_title='Presión (mmHg)')
+    return fig_bp
+
+
+def build_glucose_figure(glucose_data, granularity="raw"):
+    glucose_data = _clean(glucose_data, ["glucose_level"])
+    if glucose_data.empty:
+        return None
+
+    if granularity == "raw":
+        fig_glucose = px.line(glucose_data, x="date", y="glucose_level", title="Glucose Levels Over Time")
+        fig_glucose.update_traces(mode='lines+markers')
+    else:
+        stats = _resampled_stats(glucose_data, ["glucose_level"], granularity)
+        fig_glucose = go.Figure()
+        _band_traces(fig_glucose, stats, "glucose_level", "Glucosa", "rgba(31, 119, 180, 1)")
+        fig_glucose.update_layout(title="Glucose Levels Over Time")
+    fig_glucose.update_layout(yaxis_title='Glucosa (mg/dL)')
+    return fig_glucose
+
+
+def _parse_meals(cell):
+    if not cell:
+        return None
+    try:
+        meals = json.loads(cell) if isinstance(cell, str) else cell
+    except Exception:
+        return None
+    return meals if isinstance(meals, dict) and meals else None
+
+
+def extract_meal_macros(food_data):
+    """
+    Flatten food records into one row per (day, meal) with protein/carbs/fat grams.
+    Only the last record of each day counts, since every save stores the whole day.
+    """
+    if food_data.empty:
+        return pd.DataFrame(columns=["date", "meal"] + MACROS)
+
+    food_data = food_data.copy()
+    food_data["date_obj"] = pd.to_datetime(food_data["date"], format="mixed", errors="coerce")
+    food_data = food_data.dropna(subset=["date_obj"]).sort_values("date")
+    food_data["date_only"] = food_data["date_obj"].dt.normalize()
+    food_data = food_data.groupby("date_only", as_index=False).last()
+
+    parsed = food_data["meals"].map(_parse_meals)
+    valid = parsed.notna()
+    if not valid.any():
+        return pd.DataFrame(columns=["date", "meal"] + MACROS)
+
+    # {meal: {macro: value}} -> columns "meal<SEP>macro", one row per day
+    wide = pd.json_normalize(parsed[valid].tolist(), sep=_KEY_SEP, max_level=1)
+    wide.index = food_data.loc[valid, "date_only"].values
+    macro_columns = [column for column in wide.columns
+                     if _KEY_SEP in column and column.split(_KEY_SEP, 1)[1] in MACROS]
+    if not macro_columns:
+        return pd.DataFrame(columns=["date", "meal"] + MACROS)
+
+    long = wide[macro_columns].rename_axis("date").reset_index().melt(id_vars="date", var_name="key", value_name="value")
+    long = long.dropna(subset=["value"])
+    long[["meal", "macro"]] = long["key"].str.split(_KEY_SEP, n=1, expand=True)
+    long["value"] = pd.to_numeric(long["value"], errors="coerce").fillna(0)
+
+    macros = long.pivot_table(index=["date", "meal"], columns="macro", values="value", aggfunc="sum", fill_value=0, sort=False)
+    macros = macros.reindex(columns=MACROS, fill_value=0).reset_index()
+    macros.columns.name = None
+    return macros
+
+
+def build_food_figures(food_data, granularity="raw"):
+    """Return (meals_by_day, macros_by_day) figures, either may be None."""
+    macros = extract_meal_macros(food_data)
+    if macros.empty:
+        return None, None
+
+    rule = GRANULARITIES[granularity]
+    if rule and granularity != "day":
+        # Sum each meal's macros over the bucket
+        macros = (macros.set_index("date").groupby("meal")[MACROS].resample(rule, **RESAMPLE_BINS).sum()
+                  .reset_index())
+        macros = macros[(macros[MACROS] > 0).any(axis=1)]
+    macros["date"] = _bucket_labels(pd.DatetimeIndex(macros["date"]), granularity)
+    macros["grams"] = macros[MACROS].sum(axis=1)
+
+    meals_df = macros[["date", "meal", "grams"]]
+    fig_meals = px.bar(meals_df, x='date', y='grams', color='meal', title='Por día / Comida (g totales)')
+
+    macro_df = macros.groupby("date", as_index=False)[MACROS].sum().sort_values('date')
+    fig_macros = go.Figure()
+    fig_macros.add_trace(go.Bar(x=macro_df['date'], y=macro_df['protein'], name='Proteínas (g)'))
+    fig_macros.add_trace(go.Bar(x=macro_df['date'], y=macro_df['carbs'], name='Carbohidratos (g)'))
+    fig_macros.add_trace(go.Bar(x=macro_df['date'], y=macro_df['fat'], name='Grasas (g)'))
+    fig_macros.update_layout(barmode='stack', title='Macronutrientes por día (g)')
+    return fig_meals, fig_macros
+
+
+def build_plots(frames, granularity="raw"):
+    """Build every chart and serialize it; charts without data are omitted."""
+    plots = {}
+    figures = {
+        "weight": build_weight_figure(frames["weight"], granularity),
+        "blood_pressure": build_blood_pressure_figure(frames["blood_pressure"], granularity),
+        "glucose": build_glucose_figure(frames["glucose"], granularity),
+    }
+    figures["meals_by_day"], figures["macros_by_day"] = build_food_figures(frames["food"], granularity)
+
+    for name, figure in figures.items():
+        if figure is not None:
+            plots[name] = figure.to_json()
+    return plots
+
+
+# --- Process pool execution ----------------------------------------------------
+
+CHART_EXECUTOR = os.getenv("CHART_EXECUTOR", "inline")
+CHART_POOL_WORKERS = int(os.getenv("CHART_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+CHART_POOL_MAX_PENDING = int(os.getenv("CHART_POOL_MAX_PENDING", str(2 * CHART_POOL_WORKERS)))
+CHART_POOL_TIMEOUT = float(os.getenv("CHART_POOL_TIMEOUT", "20"))
+
+
+class ChartTimeout(Exception):
+    """The chart pool was saturated or a job did not finish within CHART_POOL_TIMEOUT."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(CHART_POOL_MAX_PENDING)
+
+
+def to_compact(frames):
+    """Reduce the loaded frames to plain column arrays, cheap to pickle to a worker."""
+    return {name: {column: frame[column].to_numpy() for column in frame.columns} for name, frame in frames.items()}
+
+
+def build_plots_compact(compact, granularity="raw"):
+    """Worker entry point: rebuild the frames and run build_plots."""
+    frames = {name: pd.DataFrame(columns) for name, columns in compact.items()}
+    return build_plots(frames, granularity)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: never fork a multi-threaded web worker. Each child re-imports the main
+            # script as __mp_main__ (all of app.py under `python app.py`, which skips its
+            # startup side effects there, see IS_CHART_WORKER) before unpickling the task
+            _pool = ProcessPoolExecutor(max_workers=CHART_POOL_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def render_plots(frames, granularity="raw"):
+    """Build the serialized figures, in the process pool when CHART_EXECUTOR=process."""
+    if CHART_EXECUTOR != "process":
+        return build_plots(frames, granularity)
+
+    if not _pool_slots.acquire(timeout=CHART_POOL_TIMEOUT):
+        raise ChartTimeout("Chart workers are busy")
+    try:
+        pool = _get_pool()
+        future = pool.submit(build_plots_compact, to_compact(frames), granularity)
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        _pool_slots.release()
+        print(f"Chart pool unavailable, building inline: {e}")
+        return build_plots(frames, granularity)
+    # The slot is held until the job really ends: a timed-out job keeps its worker busy,
+    # since cancel() cannot stop one that has started
+    future.add_done_callback(lambda _: _pool_slots.release())
+
+    try:
+        return future.result(timeout=CHART_POOL_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise ChartTimeout("Chart generation timed out")
+    except BrokenProcessPool as e:
+        print(f"Chart worker died, rebuilding pool and building inline: {e}")
+        _discard_pool(pool)
+        return build_plots(frames, granularity)
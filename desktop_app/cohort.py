@@ -0,0 +1,262 @@
+"""
+Population (cohort) analytics across all users, for clinic-level reporting.
+
+Each record table is read once, in chunks (archived readings, see archive.py, one
+user at a time), and reduced with a vectorized groupby into per-user partial sums
+(count, sum, sum of squares, threshold counts). Partials from every chunk are added
+together, then the per-user means / CVs are summarized into distributions across users:
+
+  - weight, systolic, diastolic and glucose: percentiles of the per-user means
+  - blood pressure: share of users whose mean is in stage 1 (>=130/80) or stage 2
+    (>=140/90) hypertension, and the share of readings above each threshold
+  - glucose: percentiles of per-user coefficient of variation, share of users with
+    CV above 36% (unstable), share of readings below 70 / above 180 mg/dL
+
+With --workers N the user-id space is split into N ranges computed in parallel
+processes; ranges are disjoint so their per-user partials simply concatenate.
+
+Usage, from desktop_app/:
+
+    python cohort.py                      # single process
+    python cohort.py --workers 4 --chunk-size 200000 --json
+"""
+import argparse
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from archive import ROW_KEY, archived_user_ids, read_archive, without_hot_copies
+
+CHUNK_SIZE = 100000
+PERCENTILES = [10, 25, 50, 75, 90]
+BP_STAGE1 = (130, 80)
+BP_STAGE2 = (140, 90)
+GLUCOSE_LOW = 70
+GLUCOSE_HIGH = 180
+GLUCOSE_CV_UNSTABLE = 0.36
+
+TABLE_QUERIES = {
+    "weight": "SELECT user_id, weight FROM weight_records WHERE weight > 0",
+    "blood_pressure": "SELECT user_id, systolic, diastolic FROM blood_pressure_records WHERE systolic > 0 AND diastolic > 0",
+    "glucose": "SELECT user_id, glucose_level FROM glucose_records WHERE glucose_level > 0",
+}
+
+# Archive tier counterpart of each query: record table and value columns (kept when > 0)
+ARCHIVE_SOURCES = {
+    "weight": ("weight_records", ["weight"]),
+    "blood_pressure": ("blood_pressure_records", ["systolic", "diastolic"]),
+    "glucose": ("glucose_records", ["glucose_level"]),
+}
+
+
+def _chunk_partials(table, chunk):
+    """Per-user partial sums for one chunk of rows (vectorized groupby)."""
+    if table == "weight":
+        w = pd.to_numeric(chunk["weight"], errors="coerce")
+        frame = pd.DataFrame({"user_id": chunk["user_id"], "n": 1, "sum": w, "sumsq": w * w})
+    elif table == "blood_pressure":
+        sys_ = pd.to_numeric(chunk["systolic"], errors="coerce")
+        dia = pd.to_numeric(chunk["diastolic"], errors="coerce")
+        frame = pd.DataFrame({
+            "user_id": chunk["user_id"], "n": 1,
+            "sys_sum": sys_, "dia_sum": dia,
+            "stage1": ((sys_ >= BP_STAGE1[0]) | (dia >= BP_STAGE1[1])).astype(np.int64),
+            "stage2": ((sys_ >= BP_STAGE2[0]) | (dia >= BP_STAGE2[1])).astype(np.int64),
+        })
+    else:
+        g = pd.to_numeric(chunk["glucose_level"], errors="coerce")
+        frame = pd.DataFrame({
+            "user_id": chunk["user_id"], "n": 1, "sum": g, "sumsq": g * g,
+            "low": (g < GLUCOSE_LOW).astype(np.int64),
+            "high": (g > GLUCOSE_HIGH).astype(np.int64),
+        })
+    return frame.dropna().groupby("user_id").sum()
+
+
+def _archive_chunks(conn, table, user_range=None):
+    """
+    Archived readings of a table, one DataFrame per user, filtered like TABLE_QUERIES.
+    Rows still in the hot table (an interrupted archive run) are left to the hot chunks.
+    """
+    archive_table, value_columns = ARCHIVE_SOURCES[table]
+    for user_id in archived_user_ids(archive_table):
+        if user_range is not None and not (user_range[0] <= user_id < user_range[1]):
+            continue
+        frame = read_archive(archive_table, user_id, ["user_id"] + ROW_KEY + value_columns)
+        frame = without_hot_copies(conn, archive_table, user_id, frame)
+        values = frame[value_columns].apply(pd.to_numeric, errors="coerce")
+        yield frame[(values > 0).all(axis=1)]
+
+
+def table_partials(conn, table, user_range=None, chunk_size=CHUNK_SIZE):
+    """Stream one table (hot rows in chunks, then archived ones) and return its per-user partial sums."""
+    query = TABLE_QUERIES[table]
+    params = {}
+    if user_range is not None:
+        query += " AND user_id >= :lo AND user_id < :hi"
+        params = {"lo": user_range[0], "hi": user_range[1]}
+
+    partials = [_chunk_partials(table, chunk)
+                for chunk in pd.read_sql_query(text(query), conn, params=params, chunksize=chunk_size)]
+    partials += [_chunk_partials(table, chunk) for chunk in _archive_chunks(conn, table, user_range) if not chunk.empty]
+    if not partials:
+        return pd.DataFrame()
+    # A user's rows may span chunks: add their partials together
+    return pd.concat(partials).groupby(level=0).sum()
+
+
+def _range_partials(database_url, user_range, chunk_size):
+    """Worker entry point: all tables' partials for one user-id range."""
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            return {table: table_partials(conn, table, user_range, chunk_size) for table in TABLE_QUERIES}
+    finally:
+        engine.dispose()
+
+
+def _user_id_ranges(conn, workers):
+    row = conn.execute(text("SELECT MIN(id), MAX(id) FROM users")).first()
+    if row[0] is None:
+        return []
+    edges = np.linspace(row[0], row[1] + 1, num=workers + 1).astype(np.int64)
+    return [(int(lo), int(hi)) for lo, hi in zip(edges[:-1], edges[1:]) if hi > lo]
+
+
+def _percentiles(values):
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return None
+    return {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def _share(mask):
+    return float(np.mean(mask)) if len(mask) else None
+
+
+def summarize(partials):
+    """Turn per-user partial sums into the population report."""
+    report = {}
+
+    weight = partials.get("weight", pd.DataFrame())
+    if not weight.empty:
+        report["weight"] = {
+            "users": int(len(weight)),
+            "readings": int(weight["n"].sum()),
+            "user_mean_percentiles": _percentiles(weight["sum"] / weight["n"]),
+        }
+
+    bp = partials.get("blood_pressure", pd.DataFrame())
+    if not bp.empty:
+        sys_mean = bp["sys_sum"] / bp["n"]
+        dia_mean = bp["dia_sum"] / bp["n"]
+        readings = bp["n"].sum()
+        report["blood_pressure"] = {
+            "users": int(len(bp)),
+            "readings": int(readings),
+            "systolic_user_mean_percentiles": _percentiles(sys_mean),
+            "diastolic_user_mean_percentiles": _percentiles(dia_mean),
+            "share_users_mean_stage1": _share((sys_mean >= BP_STAGE1[0]) | (dia_mean >= BP_STAGE1[1])),
+            "share_users_mean_stage2": _share((sys_mean >= BP_STAGE2[0]) | (dia_mean >= BP_STAGE2[1])),
+            "share_readings_stage1": float(bp["stage1"].sum() / readings),
+            "share_readings_stage2": float(bp["stage2"].sum() / readings),
+        }
+
+    glucose = partials.get("glucose", pd.DataFrame())
+    if not glucose.empty:
+        n = glucose["n"]
+        mean = glucose["sum"] / n
+        # Sample variance from running sums; users with a single reading have no CV
+        variance = ((glucose["sumsq"] - glucose["sum"] ** 2 / n) / (n - 1)).where(n > 1).clip(lower=0)
+        cv = np.sqrt(variance) / mean
+        readings = n.sum()
+        report["glucose"] = {
+            "users": int(len(glucose)),
+            "readings": int(readings),
+            "user_mean_percentiles": _percentiles(mean),
+            "cv_percentiles": _percentiles(cv),
+            "share_users_cv_unstable": _share(cv.dropna() > GLUCOSE_CV_UNSTABLE),
+            "share_readings_below_range": float(glucose["low"].sum() / readings),
+            "share_readings_above_range": float(glucose["high"].sum() / readings),
+        }
+
+    return report
+
+
+def compute_cohort_report(engine, workers=1, chunk_size=CHUNK_SIZE):
+    """Population statistics across all users, optionally split over worker processes."""
+    if workers <= 1:
+        with engine.connect() as conn:
+            partials = {table: table_partials(conn, table, chunk_size=chunk_size) for table in TABLE_QUERIES}
+        return summarize(partials)
+
+    with engine.connect() as conn:
+        ranges = _user_id_ranges(conn, workers)
+    database_url = engine.url.render_as_string(hide_password=False)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_range_partials, database_url, user_range, chunk_size) for user_range in ranges]
+        results = [future.result() for future in futures]
+
+    partials = {}
+    for table in TABLE_QUERIES:
+        frames = [result[table] for result in results if not result[table].empty]
+        partials[table] = pd.concat(frames) if frames else pd.DataFrame()
+    return summarize(partials)
+
+
+def _print_report(report):
+    def fmt_pct(p):
+        return "  ".join(f"{key}={value:.1f}" for key, value in p.items()) if p else "--"
+
+    if not report:
+        print("No readings found.")
+        return
+    if "weight" in report:
+        w = report["weight"]
+        print(f"Peso: {w['users']} usuarios, {w['readings']} lecturas")
+        print(f"  media por usuario (kg): {fmt_pct(w['user_mean_percentiles'])}")
+    if "blood_pressure" in report:
+        bp = report["blood_pressure"]
+        print(f"Presión arterial: {bp['users']} usuarios, {bp['readings']} lecturas")
+        print(f"  sistólica media por usuario: {fmt_pct(bp['systolic_user_mean_percentiles'])}")
+        print(f"  diastólica media por usuario: {fmt_pct(bp['diastolic_user_mean_percentiles'])}")
+        print(f"  usuarios con media >= {BP_STAGE1[0]}/{BP_STAGE1[1]}: {bp['share_users_mean_stage1']:.1%}"
+              f"   >= {BP_STAGE2[0]}/{BP_STAGE2[1]}: {bp['share_users_mean_stage2']:.1%}")
+        print(f"  lecturas >= {BP_STAGE1[0]}/{BP_STAGE1[1]}: {bp['share_readings_stage1']:.1%}"
+              f"   >= {BP_STAGE2[0]}/{BP_STAGE2[1]}: {bp['share_readings_stage2']:.1%}")
+    if "glucose" in report:
+        g = report["glucose"]
+        cv = {key: value * 100 for key, value in g["cv_percentiles"].items()} if g["cv_percentiles"] else None
+        print(f"Glucosa: {g['users']} usuarios, {g['readings']} lecturas")
+        print(f"  media por usuario (mg/dL): {fmt_pct(g['user_mean_percentiles'])}")
+        print(f"  coeficiente de variación (%): {fmt_pct(cv)}")
+        if g["share_users_cv_unstable"] is not None:
+            print(f"  usuarios con CV > {GLUCOSE_CV_UNSTABLE:.0%}: {g['share_users_cv_unstable']:.1%}")
+        print(f"  lecturas < {GLUCOSE_LOW}: {g['share_readings_below_range']:.1%}"
+              f"   > {GLUCOSE_HIGH}: {g['share_readings_above_range']:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Population statistics across all users.")
+    parser.add_argument("--workers", type=int, default=1, help="processes, each handling a user-id range")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows read per chunk")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    from database import engine
+    report = compute_cohort_report(engine, workers=args.workers, chunk_size=args.chunk_size)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
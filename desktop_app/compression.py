@@ -0,0 +1,167 @@
+"""
+Content-negotiated response compression (brotli / gzip) for the Flask app.
+
+Plotly figure JSON and the full /health_data history compress 5-10x, which matters
+for mobile clients. Brotli is used when the optional `brotli` package is installed
+and the client accepts it; otherwise gzip.
+
+Tunables (environment variables):
+    COMPRESS_MIN_SIZE        - smallest body (bytes) worth compressing, default 1024
+    COMPRESS_LEVEL           - gzip level 1-9, default 6
+    COMPRESS_BROTLI_QUALITY  - brotli quality 0-11, default 5
+    COMPRESS_CACHE_SIZE      - number of precompressed bodies kept per process, default 128
+"""
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+COMPRESS_CACHE_SIZE = int(os.getenv("COMPRESS_CACHE_SIZE", "128"))
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "image/svg+xml",
+}
+
+SUPPORTED_ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def etag_variants(etag):
+    """
+    All tags a client may hold for a representation: the identity tag plus one per
+    content-coding, since compressed bodies get their own strong ETag.
+    """
+    return [etag] + [f"{etag}-{encoding}" for encoding in SUPPORTED_ENCODINGS]
+
+
+class _CompressedCache:
+    """
+    Small thread-safe LRU of compressed bodies keyed by (digest of the uncompressed body,
+    encoding). Keying on the body rather than the ETag keeps a view that answers
+    differently under one tag (e.g. a failed then recovered AI step) from being served
+    a stale compressed copy.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = _CompressedCache(COMPRESS_CACHE_SIZE)
+
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compress_stream(chunks, encoding):
+    """Compress a generator body chunk by chunk, flushing so clients get data progressively."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            out = compressor.process(chunk) + compressor.flush()
+            if out:
+                yield out
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            out = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if out:
+                yield out
+        yield compressor.flush()
+
+
+def _compress_response(response, request):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(SUPPORTED_ENCODINGS)
+    etag, _ = response.get_etag()
+
+    if response.status_code == 304:
+        # Echo back the tag of the representation the client actually holds
+        if encoding and etag and request.if_none_match.contains(f"{etag}-{encoding}"):
+            response.set_etag(f"{etag}-{encoding}")
+        return response
+
+    if (
+        not encoding
+        or response.status_code < 200
+        or response.status_code in (204, 206)
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+
+        # Hashing is ~20x cheaper than compressing, so only ETagged bodies are worth caching
+        cache_key = (hashlib.blake2b(data, digest_size=16).digest(), encoding) if etag else None
+        body = _cache.get(cache_key) if cache_key else None
+        if body is None:
+            body = _compress(data, encoding)
+            if cache_key:
+                _cache.put(cache_key, body)
+        response.set_data(body)
+
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def init_compression(app):
+    """Register the compression middleware on a Flask app."""
+    from flask import request
+
+    @app.after_request
+    def compress_response(response):
+        return _compress_response(response, request)
+
+    return app
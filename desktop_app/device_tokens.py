@@ -0,0 +1,215 @@
+"""
+Per-device API tokens for /sync_data and /sync_cursor.
+
+A token looks like  sc_<prefix>_<secret>.  Only the SHA-256 of the whole token is
+stored, next to the public prefix, which is unique and indexed so a lookup reads
+one row. Verified tokens are kept in a per-process TTL cache, so steady-state syncs
+resolve the user without touching the token table.
+
+Revoking a token bumps a single version stamp in the database. Every process reads
+the stamp at most once per DEVICE_TOKEN_STAMP_CHECK seconds and drops its cached
+tokens when the stamp moved, so a revocation takes effect everywhere within that
+interval (immediately in the process that revoked it).
+
+Tunables (environment variables):
+    DEVICE_TOKEN_CACHE_TTL    - seconds a verified token stays cached, default 300
+    DEVICE_TOKEN_CACHE_SIZE   - tokens cached per process, default 1024
+    DEVICE_TOKEN_STAMP_CHECK  - seconds between revocation-stamp reads, default 5
+    SYNC_ALLOW_EMAIL          - 0 (default) requires a token; 1 re-enables the deprecated
+                                unauthenticated email sync (logged per device)
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from models import DeviceToken, DeviceTokenStamp
+
+DEVICE_TOKEN_CACHE_TTL = float(os.getenv("DEVICE_TOKEN_CACHE_TTL", "300"))
+DEVICE_TOKEN_CACHE_SIZE = int(os.getenv("DEVICE_TOKEN_CACHE_SIZE", "1024"))
+DEVICE_TOKEN_STAMP_CHECK = float(os.getenv("DEVICE_TOKEN_STAMP_CHECK", "5"))
+SYNC_ALLOW_EMAIL = os.getenv("SYNC_ALLOW_EMAIL", "0") == "1"
+if SYNC_ALLOW_EMAIL:
+    print("WARNING: SYNC_ALLOW_EMAIL=1 accepts unauthenticated email syncs; this is deprecated, "
+          "move devices to tokens (POST /device_tokens)")
+
+TOKEN_SCHEME = "sc"
+
+DeviceIdentity = namedtuple("DeviceIdentity", ["user_id", "device_id", "token_id"])
+
+
+class InvalidToken(Exception):
+    """The token is malformed, unknown or revoked."""
+
+
+def _hash(token):
+    # Tokens carry 256 random bits, so a fast hash is enough (no password stretching)
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _now():
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class _TokenCache:
+    """Thread-safe LRU of verified tokens, keyed by prefix, with a TTL and the revocation stamp."""
+
+    def __init__(self, max_entries, ttl, stamp_interval):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stamp_interval = stamp_interval
+        self._entries = OrderedDict()  # prefix -> (expires_at, token_hash, DeviceIdentity)
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._stamp_checked_at = 0.0
+
+    def get(self, prefix):
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[prefix]
+                return None
+            self._entries.move_to_end(prefix)
+            return entry
+
+    def put(self, prefix, token_hash, identity):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[prefix] = (time.monotonic() + self.ttl, token_hash, identity)
+            self._entries.move_to_end(prefix)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def check_stamp(self, db: Session):
+        """Re-read the revocation stamp if it is due; drop every entry when it moved."""
+        if time.monotonic() - self._stamp_checked_at < self.stamp_interval:
+            return
+        stamp = _read_stamp(db)
+        with self._lock:
+            if stamp != self._stamp:
+                self._entries.clear()
+                self._stamp = stamp
+            self._stamp_checked_at = time.monotonic()
+
+
+_cache = _TokenCache(DEVICE_TOKEN_CACHE_SIZE, DEVICE_TOKEN_CACHE_TTL, DEVICE_TOKEN_STAMP_CHECK)
+
+
+def _read_stamp(db: Session):
+    return db.query(DeviceTokenStamp.version).filter(DeviceTokenStamp.id == 1).scalar() or 0
+
+
+def _bump_stamp(db: Session):
+    updated = db.query(DeviceTokenStamp).filter(DeviceTokenStamp.id == 1).update(
+        {DeviceTokenStamp.version: DeviceTokenStamp.version + 1, DeviceTokenStamp.updated_at: _now()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.add(DeviceTokenStamp(id=1, version=1, updated_at=_now()))
+
+
+def bearer_token(request):
+    """The token from an `Authorization: Bearer ...` header, or None."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+_legacy_devices = set()
+
+
+def warn_legacy_sync(email, device_id):
+    """Log (once per device and process) a sync that used the deprecated email path."""
+    key = (email, device_id)
+    if key not in _legacy_devices:
+        _legacy_devices.add(key)
+        print(f"WARNING: deprecated email sync from device '{device_id}' of {email}; issue it a device token")
+
+
+def issue_token(db: Session, user_id: int, device_id: str, name: str = None):
+    """Create a token for one of the user's devices. Returns (DeviceToken, token); the token is shown only once."""
+    prefix = secrets.token_hex(6)
+    token = f"{TOKEN_SCHEME}_{prefix}_{secrets.token_urlsafe(32)}"
+    device_token = DeviceToken(
+        user_id=user_id,
+        device_id=device_id,
+        name=name,
+        prefix=prefix,
+        token_hash=_hash(token),
+        created_at=_now(),
+    )
+    db.add(device_token)
+    db.commit()
+    db.refresh(device_token)
+    return device_token, token
+
+
+def token_to_dict(device_token: DeviceToken) -> dict:
+    return {
+        "id": device_token.id,
+        "device_id": device_token.device_id,
+        "name": device_token.name,
+        "prefix": f"{TOKEN_SCHEME}_{device_token.prefix}",
+        "created_at": device_token.created_at,
+        "revoked_at": device_token.revoked_at,
+    }
+
+
+def list_tokens(db: Session, user_id: int) -> list:
+    tokens = db.query(DeviceToken).filter(DeviceToken.user_id == user_id).order_by(DeviceToken.id)
+    return [token_to_dict(device_token) for device_token in tokens]
+
+
+def revoke_token(db: Session, user_id: int, token_id: int) -> bool:
+    """Revoke one of the user's tokens. Returns False when the user has no such token."""
+    device_token = db.query(DeviceToken).filter(
+        DeviceToken.id == token_id, DeviceToken.user_id == user_id
+    ).first()
+    if device_token is None:
+        return False
+    if device_token.revoked_at is None:
+        device_token.revoked_at = _now()
+        _bump_stamp(db)
+        db.commit()
+        _cache.clear()
+    return True
+
+
+def authenticate_token(db: Session, token: str) -> DeviceIdentity:
+    """Resolve a token to its user and device; raises InvalidToken."""
+    scheme, _, rest = token.partition("_")
+    prefix, _, secret = rest.partition("_")
+    if scheme != TOKEN_SCHEME or not prefix or not secret:
+        raise InvalidToken("malformed token")
+
+    digest = _hash(token)
+    _cache.check_stamp(db)
+    cached = _cache.get(prefix)
+    if cached is not None:
+        _, token_hash, identity = cached
+    else:
+        device_token = db.query(DeviceToken).filter(DeviceToken.prefix == prefix).first()
+        if device_token is None or device_token.revoked_at is not None:
+            raise InvalidToken("unknown or revoked token")
+        token_hash = device_token.token_hash
+        identity = DeviceIdentity(device_token.user_id, device_token.device_id, device_token.id)
+
+    if not hmac.compare_digest(token_hash, digest):
+        raise InvalidToken("unknown or revoked token")
+    if cached is None:
+        _cache.put(prefix, token_hash, identity)
+    return identity
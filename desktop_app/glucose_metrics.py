@@ -0,0 +1,365 @@
+"""
+Glucose variability metrics over a date window, sized for continuous-monitor data
+(288 readings per day) behind /glucose_metrics.
+
+Readings are streamed in chunks of contiguous NumPy arrays (ranges that reach into
+the archive tier are read through archive.read_records) and reduced per day into
+a GlucoseDailyMetrics row (count, sums, min/max, readings below/above range, MAGE,
+per-hour sums). The window report is then combined from the daily rows:
+
+  - time in / below / above range (70-180 mg/dL), as a share of readings
+  - coefficient of variation (sample std / mean)
+  - GMI, the glucose management indicator: 3.31 + 0.02392 * mean (mg/dL)
+  - MAGE: mean of the daily MAGE values
+  - daily profile with a 7-day rolling mean and time in range, and the mean per hour of day
+
+Daily rows are cached: services.py deletes the row for a day whenever a glucose reading
+dated that day is written, so a request only recomputes days it has not seen yet.
+"""
+import json
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from archive import get_watermarks, read_records
+from models import DataVersion, GlucoseDailyMetrics, GlucoseRecord
+
+RANGE_LOW = 70
+RANGE_HIGH = 180
+CHUNK_SIZE = 50000
+DEFAULT_WINDOW_DAYS = 14
+MAX_WINDOW_DAYS = 366
+ROLLING_DAYS = 7
+
+
+def parse_window(args, today=None):
+    """
+    Read `from` and `to` (YYYY-MM-DD, inclusive) from request args; both default to
+    the last DEFAULT_WINDOW_DAYS days. Returns (start, end) dates; raises ValueError.
+    """
+    def parse_date(name):
+        value = args.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format")
+
+    start, end = parse_date("from"), parse_date("to")
+    if end is None:
+        end = max(today or date.today(), start) if start else (today or date.today())
+    if start is None:
+        start = end - timedelta(days=DEFAULT_WINDOW_DAYS - 1)
+    if end < start:
+        raise ValueError("'to' must not be before 'from'")
+    if (end - start).days + 1 > MAX_WINDOW_DAYS:
+        raise ValueError(f"the window may span at most {MAX_WINDOW_DAYS} days")
+    return start, end
+
+
+def mage(values):
+    """
+    Mean amplitude of glycemic excursions for one day of readings in time order:
+    the mean height of the peak-to-nadir swings larger than one standard deviation
+    of the day's readings. Smaller wiggles (sensor noise) do not split a swing.
+    None when the day has no such swing.
+    """
+    if values.size < 3:
+        return None
+    sd = values.std(ddof=1)
+    # Candidate extremes: the interior turning points, flat stretches removed. The first
+    # and last readings are not extremes, only where the day's record happens to cut off.
+    values = values[np.r_[True, np.diff(values) != 0]]
+    if values.size < 3:
+        return None
+    steps = np.diff(values)
+    turning = np.flatnonzero(np.sign(steps[1:]) != np.sign(steps[:-1])) + 1
+    if turning.size == 0:
+        return None
+    points = values[turning]
+
+    # Keep an extreme only once the glucose has moved more than one SD away from it
+    extremes, rising = [], None
+    low = high = candidate = points[0]
+    for value in points[1:]:
+        if rising is None:
+            low, high = min(low, value), max(high, value)
+            if value - low > sd:
+                extremes, rising, candidate = [low], True, value
+            elif high - value > sd:
+                extremes, rising, candidate = [high], False, value
+        elif rising:
+            if value > candidate:
+                candidate = value
+            elif candidate - value > sd:
+                extremes.append(candidate)
+                rising, candidate = False, value
+        else:
+            if value < candidate:
+                candidate = value
+            elif value - candidate > sd:
+                extremes.append(candidate)
+                rising, candidate = True, value
+    # The last turning point counts if the day's remaining readings move away from it by
+    # more than one SD; an unfinished swing at the end of the day is not an excursion
+    last = values[-1]
+    if rising is not None and (candidate - last if rising else last - candidate) > sd:
+        extremes.append(candidate)
+    if len(extremes) < 2:
+        return None
+    return float(np.abs(np.diff(extremes)).mean())
+
+
+def _reading_hours(dates):
+    """Hour of day of each 'YYYY-MM-DD HH:MM...' string, -1 when the date has no time."""
+    chars = dates.astype("U13").view("U1").reshape(len(dates), 13)
+    hour = np.char.add(chars[:, 11], chars[:, 12])
+    valid = np.char.isdigit(hour)
+    hours = np.full(len(dates), -1, dtype=np.int64)
+    hours[valid] = hour[valid].astype(np.int64)
+    hours[hours > 23] = -1
+    return hours
+
+
+def day_metrics(user_id, day, values, hours, now):
+    """Aggregate one day of readings (NumPy arrays in time order) into a cache row."""
+    hourly = hours >= 0
+    return GlucoseDailyMetrics(
+        user_id=user_id,
+        day=day,
+        n=int(values.size),
+        total=float(values.sum()),
+        total_sq=float(np.dot(values, values)),
+        min_level=float(values.min()) if values.size else None,
+        max_level=float(values.max()) if values.size else None,
+        below=int(np.count_nonzero(values < RANGE_LOW)),
+        above=int(np.count_nonzero(values > RANGE_HIGH)),
+        mage=mage(values),
+        hourly_sum=json.dumps(np.bincount(hours[hourly], weights=values[hourly], minlength=24).tolist()),
+        hourly_count=json.dumps(np.bincount(hours[hourly], minlength=24).tolist()),
+        computed_at=now,
+    )
+
+
+def _contiguous_runs(days):
+    """Group sorted dates into (first, last) runs of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def _reduce_chunks(chunks, finish):
+    """
+    Feed (dates, values) chunks in date order to finish(day, values, hours), once per day.
+    Readings of the last day in a chunk may continue in the next one, so it is carried over.
+    """
+    pending_days = np.array([], dtype="U10")
+    pending_values = np.array([], dtype=np.float64)
+    pending_hours = np.array([], dtype=np.int64)
+    for dates, chunk_values in chunks:
+        day_keys = np.concatenate([pending_days, dates.astype("U10")])
+        values = np.concatenate([pending_values, chunk_values])
+        hours = np.concatenate([pending_hours, _reading_hours(dates)])
+
+        bounds = np.r_[0, np.flatnonzero(day_keys[1:] != day_keys[:-1]) + 1, day_keys.size]
+        for lo, hi in zip(bounds[:-2], bounds[1:-1]):
+            finish(str(day_keys[lo]), values[lo:hi], hours[lo:hi])
+        tail = bounds[-2]
+        pending_days, pending_values, pending_hours = day_keys[tail:], values[tail:], hours[tail:]
+    if pending_days.size:
+        finish(str(pending_days[0]), pending_values, pending_hours)
+
+
+def _hot_chunks(conn, params, chunk_size):
+    query = text(
+        "SELECT date, glucose_level FROM glucose_records "
+        "WHERE user_id = :user_id AND date >= :start AND date < :end AND glucose_level > 0 "
+        "ORDER BY date, id")
+    result = conn.execution_options(stream_results=True).execute(query, params)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield (np.array([row[0] for row in rows], dtype=str),
+               np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)))
+
+
+def _merged_chunks(conn, user_id, params, watermarks):
+    """Hot and archived readings of a range reaching before the archive watermark, as one chunk."""
+    frame = read_records(conn, "glucose_records", user_id, ["date", "glucose_level"],
+                         params["start"], params["end"], watermarks)
+    values = pd.to_numeric(frame["glucose_level"], errors="coerce").to_numpy(dtype=np.float64)
+    keep = values > 0
+    if keep.any():
+        yield frame["date"].astype(str).to_numpy(dtype=str)[keep], values[keep]
+
+
+def compute_days(conn, user_id, days, chunk_size=CHUNK_SIZE):
+    """
+    Compute GlucoseDailyMetrics rows (unsaved) for the given dates, one range query per
+    run of days; ranges before the archive watermark also read the archive files.
+    """
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    computed = {}
+
+    def finish(day, values, hours):
+        computed[day] = day_metrics(user_id, day, values, hours, now)
+
+    watermarks = get_watermarks(conn, user_id)
+    archived_before = watermarks.get("glucose_records")
+    for first, last in _contiguous_runs(sorted(days)):
+        params = {"user_id": user_id, "start": first.isoformat(),
+                  "end": (last + timedelta(days=1)).isoformat()}
+        if archived_before is not None and params["start"] < archived_before:
+            _reduce_chunks(_merged_chunks(conn, user_id, params, watermarks), finish)
+        else:
+            _reduce_chunks(_hot_chunks(conn, params, chunk_size), finish)
+
+    # Days without readings are cached too, as empty rows
+    empty = np.array([], dtype=np.float64)
+    for day in days:
+        if day.isoformat() not in computed:
+            finish(day.isoformat(), empty, np.array([], dtype=np.int64))
+    return [computed[day.isoformat()] for day in days]
+
+
+def _data_version(db: Session, user_id, for_update=False):
+    query = db.query(DataVersion.version).filter(DataVersion.user_id == user_id)
+    return (query.with_for_update() if for_update else query).scalar()
+
+
+def get_daily_metrics(db: Session, user_id, start, end):
+    """
+    Daily rows for [start, end], the freshly computed ones among them and the data
+    version they were computed from; the caller caches the fresh rows with
+    cache_daily_metrics once it is done reading them.
+    """
+    version = _data_version(db, user_id)
+    cached = {
+        row.day: row for row in db.query(GlucoseDailyMetrics).filter(
+            GlucoseDailyMetrics.user_id == user_id,
+            GlucoseDailyMetrics.day >= start.isoformat(),
+            GlucoseDailyMetrics.day <= end.isoformat())
+    }
+    all_days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    missing = [day for day in all_days if day.isoformat() not in cached]
+    fresh = compute_days(db.connection(), user_id, missing) if missing else []
+    cached.update((row.day, row) for row in fresh)
+    return [cached[day.isoformat()] for day in all_days], fresh, version
+
+
+def cache_daily_metrics(db: Session, user_id, rows: list, version) -> None:
+    """
+    Store rows computed from data `version`, unless a write has bumped the version since:
+    that write may have landed after its day was read and before this insert, and its
+    invalidation had nothing to delete yet.
+    """
+    if not rows:
+        return
+    try:
+        db.add_all(rows)
+        # Check the version in the inserting transaction, right before commit. The flush
+        # holds SQLite's write lock, so no write can commit in between; on PostgreSQL the
+        # row lock waits for a write that has already bumped the version.
+        db.flush()
+        if _data_version(db, user_id, for_update=True) != version:
+            db.rollback()
+            return
+        db.commit()
+    except IntegrityError:
+        # Another request cached the same days first
+        db.rollback()
+
+
+def summarize_window(rows):
+    """Window report from daily rows in date order."""
+    n = np.array([row.n for row in rows], dtype=np.float64)
+    total = np.array([row.total for row in rows], dtype=np.float64)
+    total_sq = np.array([row.total_sq for row in rows], dtype=np.float64)
+    below = np.array([row.below for row in rows], dtype=np.float64)
+    above = np.array([row.above for row in rows], dtype=np.float64)
+
+    count = n.sum()
+    report = {
+        "from": rows[0].day if rows else None,
+        "to": rows[-1].day if rows else None,
+        "readings": int(count),
+        "days_with_data": int(np.count_nonzero(n)),
+        "range": {"low": RANGE_LOW, "high": RANGE_HIGH},
+        "mean": None, "sd": None, "cv": None, "gmi": None, "mage": None,
+        "time_in_range": None, "time_below_range": None, "time_above_range": None,
+        "daily": [], "hourly_profile": [None] * 24,
+    }
+    if not count:
+        return report
+
+    mean = total.sum() / count
+    if count > 1:
+        sd = float(np.sqrt(max(0.0, (total_sq.sum() - total.sum() ** 2 / count) / (count - 1))))
+        report["sd"] = sd
+        report["cv"] = sd / mean
+    daily_mage = [row.mage for row in rows if row.mage is not None]
+    report.update({
+        "mean": float(mean),
+        "gmi": 3.31 + 0.02392 * float(mean),
+        "mage": float(np.mean(daily_mage)) if daily_mage else None,
+        "time_in_range": float((count - below.sum() - above.sum()) / count),
+        "time_below_range": float(below.sum() / count),
+        "time_above_range": float(above.sum() / count),
+    })
+
+    # Rolling sums over calendar days (days without readings count as empty)
+    kernel = np.ones(ROLLING_DAYS)
+    rolling_n = np.convolve(n, kernel)[:n.size]
+    rolling_total = np.convolve(total, kernel)[:n.size]
+    rolling_in_range = np.convolve(n - below - above, kernel)[:n.size]
+    for index, row in enumerate(rows):
+        if not row.n:
+            continue
+        report["daily"].append({
+            "date": row.day,
+            "readings": row.n,
+            "mean": row.total / row.n,
+            "min": row.min_level,
+            "max": row.max_level,
+            "time_in_range": (row.n - row.below - row.above) / row.n,
+            "mage": row.mage,
+            "rolling_mean": float(rolling_total[index] / rolling_n[index]),
+            "rolling_time_in_range": float(rolling_in_range[index] / rolling_n[index]),
+        })
+
+    hourly_sum = np.sum([json.loads(row.hourly_sum) for row in rows if row.n], axis=0)
+    hourly_count = np.sum([json.loads(row.hourly_count) for row in rows if row.n], axis=0)
+    report["hourly_profile"] = [
+        float(hourly_sum[hour] / hourly_count[hour]) if hourly_count[hour] else None for hour in range(24)
+    ]
+    return report
+
+
+def compute_glucose_metrics(db: Session, user_id, start, end):
+    rows, fresh, version = get_daily_metrics(db, user_id, start, end)
+    report = summarize_window(rows)
+    cache_daily_metrics(db, user_id, fresh, version)
+    return report
+
+
+def invalidate_glucose_days(db: Session, records: list) -> None:
+    """Drop cached daily rows for the days of newly written glucose readings (caller commits)."""
+    days_by_user = {}
+    for record in records:
+        if isinstance(record, GlucoseRecord) and record.date:
+            days_by_user.setdefault(record.user_id, set()).add(str(record.date)[:10])
+    for user_id, days in days_by_user.items():
+        db.query(GlucoseDailyMetrics).filter(
+            GlucoseDailyMetrics.user_id == user_id,
+            GlucoseDailyMetrics.day.in_(days)
+        ).delete(synchronize_session=False)
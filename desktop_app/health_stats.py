@@ -0,0 +1,156 @@
+"""
+Per-user health statistics behind /analyze and the AI summary batch job.
+
+compute_stats() computes mean / trend / std for one user or for many users at once
+with grouped SQL, so the nightly batch does one pass per table instead of one
+DataFrame per user. The weight trend is the sign of the mean day-to-day difference,
+which for readings ordered by date is (last - first) / (n - 1).
+"""
+import math
+from sqlalchemy import bindparam, text
+
+from archive import archived_aggregates
+
+
+def empty_stats():
+    return {
+        "weight": {"mean": 0, "trend": "insufficient data"},
+        "blood_pressure": {"sys_mean": 0, "dia_mean": 0},
+        "glucose": {"mean": 0, "std": 0}
+    }
+
+
+def _user_filter(user_ids):
+    return " AND user_id IN :user_ids" if user_ids is not None else ""
+
+
+def _bind(query, user_ids):
+    query = text(query)
+    if user_ids is not None:
+        query = query.bindparams(bindparam("user_ids", expanding=True))
+    return query
+
+
+def compute_stats(conn, user_ids=None):
+    """
+    Statistics keyed by user id, for the given users (or every user with data).
+    Users without any readings are omitted for the bulk case; listed user_ids always get an entry.
+    Archived readings are included through their watermark aggregates (see archive.py).
+    """
+    params = {"user_ids": list(user_ids)} if user_ids is not None else {}
+    stats = {user_id: empty_stats() for user_id in (user_ids or [])}
+
+    # Weight: count and sum plus first/last reading in (date, id) order for the trend
+    weight_query = _bind(f"""
+        SELECT user_id, SUM(weight) AS total, COUNT(*) AS n,
+               MAX(CASE WHEN rn_first = 1 THEN weight END) AS first_weight,
+               MAX(CASE WHEN rn_first = 1 THEN date END) AS first_date,
+               MAX(CASE WHEN rn_first = 1 THEN id END) AS first_id,
+               MAX(CASE WHEN rn_last = 1 THEN weight END) AS last_weight,
+               MAX(CASE WHEN rn_last = 1 THEN date END) AS last_date,
+               MAX(CASE WHEN rn_last = 1 THEN id END) AS last_id
+        FROM (
+            SELECT user_id, weight, date, id,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY date ASC, id ASC) AS rn_first,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY date DESC, id DESC) AS rn_last
+            FROM weight_records
+            WHERE weight > 0{_user_filter(user_ids)}
+        ) ranked
+        GROUP BY user_id
+    """, user_ids)
+    weight = {
+        row.user_id: {
+            "n": row.n, "total": float(row.total),
+            "first": (str(row.first_date), row.first_id, float(row.first_weight)),
+            "last": (str(row.last_date), row.last_id, float(row.last_weight)),
+        }
+        for row in conn.execute(weight_query, params)
+    }
+    for user_id, archived in archived_aggregates(conn, "weight_records", user_ids).items():
+        if not archived.value_count:
+            continue
+        first = (archived.first_date, archived.first_id, archived.first_value)
+        last = (archived.last_date, archived.last_id, archived.last_value)
+        hot = weight.get(user_id)
+        if hot is None:
+            weight[user_id] = {"n": archived.value_count, "total": archived.value_sum, "first": first, "last": last}
+        else:
+            hot["n"] += archived.value_count
+            hot["total"] += archived.value_sum
+            hot["first"] = min(hot["first"], first, key=lambda reading: reading[:2])
+            hot["last"] = max(hot["last"], last, key=lambda reading: reading[:2])
+    for user_id, w in weight.items():
+        user_stats = stats.setdefault(user_id, empty_stats())
+        user_stats["weight"]["mean"] = w["total"] / w["n"]
+        if w["n"] > 1:
+            slope = (w["last"][2] - w["first"][2]) / (w["n"] - 1)
+            user_stats["weight"]["trend"] = "increasing" if slope > 0 else "decreasing"
+
+    bp_query = _bind(f"""
+        SELECT user_id, COUNT(*) AS n, SUM(systolic) AS sys_total, SUM(diastolic) AS dia_total
+        FROM blood_pressure_records
+        WHERE systolic > 0 AND diastolic > 0{_user_filter(user_ids)}
+        GROUP BY user_id
+    """, user_ids)
+    bp = {row.user_id: [row.n, float(row.sys_total), float(row.dia_total)] for row in conn.execute(bp_query, params)}
+    for user_id, archived in archived_aggregates(conn, "blood_pressure_records", user_ids).items():
+        totals = bp.setdefault(user_id, [0, 0.0, 0.0])
+        totals[0] += archived.value_count
+        totals[1] += archived.value_sum
+        totals[2] += archived.value2_sum
+    for user_id, (n, sys_total, dia_total) in bp.items():
+        if not n:
+            continue
+        user_stats = stats.setdefault(user_id, empty_stats())
+        user_stats["blood_pressure"]["sys_mean"] = sys_total / n
+        user_stats["blood_pressure"]["dia_mean"] = dia_total / n
+
+    # Sample standard deviation from running sums, as pandas' std() (ddof=1)
+    glucose_query = _bind(f"""
+        SELECT user_id, COUNT(*) AS n, SUM(glucose_level) AS total,
+               SUM(glucose_level * glucose_level) AS total_sq
+        FROM glucose_records
+        WHERE glucose_level > 0{_user_filter(user_ids)}
+        GROUP BY user_id
+    """, user_ids)
+    glucose = {row.user_id: [row.n, float(row.total), float(row.total_sq)] for row in conn.execute(glucose_query, params)}
+    for user_id, archived in archived_aggregates(conn, "glucose_records", user_ids).items():
+        totals = glucose.setdefault(user_id, [0, 0.0, 0.0])
+        totals[0] += archived.value_count
+        totals[1] += archived.value_sum
+        totals[2] += archived.value_sumsq
+    for user_id, (n, total, total_sq) in glucose.items():
+        if not n:
+            continue
+        user_stats = stats.setdefault(user_id, empty_stats())
+        user_stats["glucose"]["mean"] = total / n
+        if n > 1:
+            variance = max(0.0, (total_sq - total * total / n) / (n - 1))
+            user_stats["glucose"]["std"] = math.sqrt(variance)
+
+    return stats
+
+
+def compute_user_stats(conn, user_id):
+    return compute_stats(conn, [user_id])[user_id]
+
+
+def format_basic_analysis(stats):
+    return f"""
+        Análisis básico de salud:
+        - Peso promedio: {stats['weight']['mean']:.1f}kg (Tendencia: {stats['weight']['trend']})
+        - Presión arterial promedio: {stats['blood_pressure']['sys_mean']:.0f}/{stats['blood_pressure']['dia_mean']:.0f}
+        - Glucosa promedio: {stats['glucose']['mean']:.1f} (Desviación estándar: {stats['glucose']['std']:.1f})
+        """
+
+
+def build_analysis_prompt(stats):
+    return f"""
+                Analiza las siguientes metricas de salud:
+                Peso: Media {stats['weight']['mean']:.1f}kg, Tendencia: {stats['weight']['trend']}
+                Presión arterial: Media {stats['blood_pressure']['sys_mean']:.0f}/{stats['blood_pressure']['dia_mean']:.0f}
+                Glucosa: Media {stats['glucose']['mean']:.1f}, Desviación estándar {stats['glucose']['std']:.1f}
+
+                Provee un breve análisis de salud y recomendaciones.
+                No presentes cuadros o tablas, realiza el análisis en un solo párrafo.
+                """
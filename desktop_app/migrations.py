@@ -0,0 +1,232 @@
+"""
+Versioned schema migrations.
+
+The database records the migrations applied to it in `schema_version`. At startup the
+app only runs check_schema(): one `SELECT MAX(version)` instead of reflecting every
+table, and it refuses to start against an outdated schema. Pending migrations are
+applied explicitly:
+
+    python migrations.py status
+    python migrations.py upgrade
+
+Writing migrations:
+  - append to MIGRATIONS with the next version number; never edit an applied one
+  - migration 1 creates a fresh database from the current models, so later migrations
+    must tolerate their change being there already (use the *_if_missing helpers)
+  - transactional migrations get a connection inside the transaction that also records
+    their version; non-transactional ones (online index builds) get the engine
+  - SQLite cannot ALTER constraints or key definitions: use rebuild_sqlite_table
+"""
+import argparse
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateTable
+
+from models import Base
+
+_version_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", String, nullable=False),  # UTC, '%Y-%m-%d %H:%M:%S'
+)
+
+Migration = namedtuple("Migration", ["version", "name", "apply", "transactional"])
+
+RECORD_TABLES = ["weight_records", "blood_pressure_records", "glucose_records", "food_records", "exercise_records"]
+REBUILD_BATCH = 5000
+
+
+class SchemaOutdated(RuntimeError):
+    """The database is behind the code; run `python migrations.py upgrade`."""
+
+
+def add_column_if_missing(conn, table, column):
+    """ALTER TABLE ... ADD COLUMN for a model column the table lacks (nullable columns only)."""
+    if column.name in {existing["name"] for existing in inspect(conn).get_columns(table.name)}:
+        return
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def create_index_online(engine, index):
+    """
+    Create a model index if it does not exist, without blocking writers for long:
+    PostgreSQL builds it CONCURRENTLY (outside a transaction). SQLite has no online
+    build; the index is created in its own short transaction so readers keep going
+    (writers wait for it) instead of holding a lock across a whole migration.
+    """
+    if engine.dialect.name == "postgresql":
+        columns = ", ".join(column.name for column in index.columns)
+        unique = "UNIQUE " if index.unique else ""
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(
+                f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table.name} ({columns})"))
+    else:
+        with engine.begin() as conn:
+            index.create(bind=conn, checkfirst=True)
+
+
+def rebuild_sqlite_table(conn, table, batch_size=REBUILD_BATCH):
+    """
+    Recreate `table` from its model definition, for changes SQLite cannot ALTER (keys,
+    constraints, AUTOINCREMENT). Follows SQLite's create-copy-drop-rename procedure inside
+    the caller's transaction: rows are copied in primary-key batches so no single statement
+    holds the whole table, and any failure rolls back to the untouched original.
+    """
+    new_name = f"_{table.name}_rebuild"
+    # Copy the whole metadata so the new table's foreign keys still resolve
+    scratch = MetaData()
+    for other in table.metadata.sorted_tables:
+        other.to_metadata(scratch)
+    conn.execute(text(f"DROP TABLE IF EXISTS {new_name}"))
+    conn.execute(CreateTable(table.to_metadata(scratch, name=new_name)))
+
+    old_columns = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+    key = list(table.primary_key.columns)
+    if len(key) == 1 and key[0].name in old_columns:
+        key = key[0].name
+        last = None
+        while True:
+            where = f"WHERE {key} > :last " if last is not None else ""
+            conn.execute(text(
+                f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name} "
+                f"{where}ORDER BY {key} LIMIT :limit"), {"last": last, "limit": batch_size})
+            copied_up_to = conn.execute(text(f"SELECT MAX({key}) FROM {new_name}")).scalar()
+            if copied_up_to is None or copied_up_to == last:
+                break
+            last = copied_up_to
+    else:
+        conn.execute(text(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}"))
+
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+def _baseline(conn):
+    """
+    Every model table, plus the columns and indexes added to existing tables before
+    migrations existed. Indexes that later migrations build online are left to them.
+    """
+    later_indexes = {f"ix_{name}_user_date" for name in RECORD_TABLES}
+    existing_tables = set(inspect(conn).get_table_names())
+    Base.metadata.create_all(bind=conn)
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        for column in table.columns:
+            if column.nullable:
+                add_column_if_missing(conn, table, column)
+        for index in table.indexes:
+            if index.name not in later_indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
+def _record_user_date_indexes(engine):
+    """(user_id, date) indexes behind every per-user date-range read."""
+    for name in RECORD_TABLES:
+        table = Base.metadata.tables[name]
+        create_index_online(engine, next(index for index in table.indexes if index.name == f"ix_{name}_user_date"))
+
+
+def _record_autoincrement_ids(conn):
+    """
+    SQLite reuses the highest rowid after that row is deleted. Since archived readings keep
+    their ids, record tables switch to AUTOINCREMENT (a table rebuild on SQLite; PostgreSQL
+    sequences never reuse ids).
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    for name in RECORD_TABLES:
+        sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           {"name": name}).scalar()
+        if sql and "AUTOINCREMENT" not in sql.upper():
+            rebuild_sqlite_table(conn, Base.metadata.tables[name])
+
+
+MIGRATIONS = [
+    Migration(1, "baseline", _baseline, True),
+    Migration(2, "record_user_date_indexes", _record_user_date_indexes, False),
+    Migration(3, "record_autoincrement_ids", _record_autoincrement_ids, True),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(engine):
+    """The applied schema version (0 for a database that predates migrations). One query."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return 0
+
+
+def check_schema(engine):
+    """Startup check: raise SchemaOutdated unless every migration has been applied."""
+    version = current_version(engine)
+    if version < LATEST_VERSION:
+        raise SchemaOutdated(
+            f"database schema is at version {version}, this code needs {LATEST_VERSION}: "
+            f"run `python migrations.py upgrade` in desktop_app/")
+
+
+def pending_migrations(engine):
+    version = current_version(engine)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+def _record(conn, migration):
+    conn.execute(schema_version.insert().values(
+        version=migration.version, name=migration.name,
+        applied_at=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def upgrade(engine, log=print):
+    """Apply pending migrations in order. Returns the versions applied."""
+    _version_metadata.create_all(bind=engine)
+    applied = []
+    for migration in pending_migrations(engine):
+        log(f"Applying {migration.version:03d} {migration.name}...")
+        if migration.transactional:
+            with engine.begin() as conn:
+                migration.apply(conn)
+                _record(conn, migration)
+        else:
+            migration.apply(engine)
+            with engine.begin() as conn:
+                _record(conn, migration)
+        applied.append(migration.version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Versioned database schema migrations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="show the applied and pending migrations")
+    subparsers.add_parser("upgrade", help="apply pending migrations")
+    args = parser.parse_args()
+
+    from database import engine
+
+    if args.command == "status":
+        version = current_version(engine)
+        print(f"Schema version {version} (latest {LATEST_VERSION})")
+        for migration in MIGRATIONS:
+            state = "applied" if migration.version <= version else "pending"
+            print(f"  {migration.version:03d} {migration.name}: {state}")
+        return
+
+    applied = upgrade(engine)
+    print(f"Applied {len(applied)} migration(s); schema is at version {LATEST_VERSION}." if applied
+          else "Schema is up to date.")
+
+
+if __name__ == "__main__":
+    main()
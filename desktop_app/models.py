@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from flask_login import UserMixin
@@ -50,6 +50,14 @@ class HealthRecord(Base):
 # New separate tables
 class WeightRecord(Base):
     __tablename__ = "weight_records"
+    __table_args__ = (
+        # Idempotent device sync: a client record id is accepted once per user and source
+        Index("ux_weight_records_client", "user_id", "source", "client_id", unique=True),
+        # Per-user date-range reads (charts, history, archive); see migrations.py
+        Index("ix_weight_records_user_date", "user_id", "date"),
+        # Ids are never reused once rows are deleted (archived readings keep theirs)
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -58,11 +66,17 @@ class WeightRecord(Base):
     notes = Column(String)
     source = Column(String)
     sync_date = Column(String)
+    client_id = Column(String)  # Optional id assigned by the device / PWA
     
     user = relationship("User", back_populates="weight_records")
 
 class BloodPressureRecord(Base):
     __tablename__ = "blood_pressure_records"
+    __table_args__ = (
+        Index("ux_blood_pressure_records_client", "user_id", "source", "client_id", unique=True),
+        Index("ix_blood_pressure_records_user_date", "user_id", "date"),
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -72,11 +86,17 @@ class BloodPressureRecord(Base):
     notes = Column(String)
     source = Column(String)
     sync_date = Column(String)
+    client_id = Column(String)  # Optional id assigned by the device / PWA
     
     user = relationship("User", back_populates="blood_pressure_records")
 
 class GlucoseRecord(Base):
     __tablename__ = "glucose_records"
+    __table_args__ = (
+        Index("ux_glucose_records_client", "user_id", "source", "client_id", unique=True),
+        Index("ix_glucose_records_user_date", "user_id", "date"),
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -85,11 +105,17 @@ class GlucoseRecord(Base):
     notes = Column(String)
     source = Column(String)
     sync_date = Column(String)
+    client_id = Column(String)  # Optional id assigned by the device / PWA
     
     user = relationship("User", back_populates="glucose_records")
 
 class FoodRecord(Base):
     __tablename__ = "food_records"
+    __table_args__ = (
+        Index("ux_food_records_client", "user_id", "source", "client_id", unique=True),
+        Index("ix_food_records_user_date", "user_id", "date"),
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -98,11 +124,17 @@ class FoodRecord(Base):
     notes = Column(String)
     source = Column(String)
     sync_date = Column(String)
+    client_id = Column(String)  # Optional id assigned by the device / PWA
     
     user = relationship("User", back_populates="food_records")
 
 class ExerciseRecord(Base):
     __tablename__ = "exercise_records"
+    __table_args__ = (
+        Index("ux_exercise_records_client", "user_id", "source", "client_id", unique=True),
+        Index("ix_exercise_records_user_date", "user_id", "date"),
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -114,5 +146,125 @@ class ExerciseRecord(Base):
     notes = Column(String)
     source = Column(String)
     sync_date = Column(String)
+    client_id = Column(String)  # Optional id assigned by the device / PWA
     
-    user = relationship("User", back_populates="exercise_records")
\ No newline at end of file
+    user = relationship("User", back_populates="exercise_records")
+
+class SyncCursor(Base):
+    __tablename__ = "sync_cursors"
+
+    # Last acknowledged upload per user and device, so devices only send the delta
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    source = Column(String, primary_key=True)
+    last_record_date = Column(String)
+    records_acknowledged = Column(Integer, nullable=False, default=0)
+    updated_at = Column(String)
+
+class UserSummary(Base):
+    __tablename__ = "user_summaries"
+
+    # Latest values and running aggregates for the dashboard stat cards, kept up to
+    # date on every write (see summaries.py) so /summary is a single-row read.
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_weight = Column(Float)
+    last_weight_date = Column(String)
+    last_systolic = Column(Integer)
+    last_diastolic = Column(Integer)
+    last_bp_date = Column(String)
+    last_glucose = Column(Float)
+    last_glucose_date = Column(String)
+    weight_sum = Column(Float, nullable=False, default=0)
+    weight_count = Column(Integer, nullable=False, default=0)
+    systolic_sum = Column(Float, nullable=False, default=0)
+    diastolic_sum = Column(Float, nullable=False, default=0)
+    bp_count = Column(Integer, nullable=False, default=0)
+    glucose_sum = Column(Float, nullable=False, default=0)
+    glucose_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(String)
+
+class AISummary(Base):
+    __tablename__ = "ai_summaries"
+
+    # Precomputed AI health summary per user (see ai_summaries.py); /analyze serves it as is
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    summary = Column(String, nullable=False)
+    stats_json = Column(String)  # statistics the summary was generated from
+    input_hash = Column(String)
+    model = Column(String)
+    generated_at = Column(String)  # UTC, '%Y-%m-%d %H:%M:%S'
+
+class DataVersion(Base):
+    __tablename__ = "user_data_versions"
+
+    # One row per user, bumped by every write path in services.py.
+    # Read endpoints derive their ETag / Last-Modified headers from it.
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(String)  # UTC, '%Y-%m-%d %H:%M:%S'
+
+class GlucoseDailyMetrics(Base):
+    __tablename__ = "glucose_daily_metrics"
+
+    # Per-day glucose aggregates for /glucose_metrics (see glucose_metrics.py). A glucose
+    # write deletes the row for its day, so only new or changed days are recomputed.
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(String, primary_key=True)  # YYYY-MM-DD
+    n = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0)
+    total_sq = Column(Float, nullable=False, default=0)
+    min_level = Column(Float)
+    max_level = Column(Float)
+    below = Column(Integer, nullable=False, default=0)  # readings < 70 mg/dL
+    above = Column(Integer, nullable=False, default=0)  # readings > 180 mg/dL
+    mage = Column(Float)
+    hourly_sum = Column(String)  # JSON list of 24 per-hour sums
+    hourly_count = Column(String)  # JSON list of 24 per-hour counts
+    computed_at = Column(String)  # UTC, '%Y-%m-%d %H:%M:%S'
+
+class DeviceToken(Base):
+    __tablename__ = "device_tokens"
+
+    # Per-device API token for /sync_data (see device_tokens.py). Only a hash of the
+    # secret is stored; the public prefix finds the row without scanning.
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    device_id = Column(String, nullable=False)
+    name = Column(String)
+    prefix = Column(String, nullable=False, unique=True, index=True)
+    token_hash = Column(String, nullable=False)
+    created_at = Column(String)  # UTC, '%Y-%m-%d %H:%M:%S'
+    revoked_at = Column(String)
+
+class DeviceTokenStamp(Base):
+    __tablename__ = "device_token_stamps"
+
+    # Single row bumped on every revocation; each worker drops its cached token
+    # lookups when it sees a new version.
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(String)
+
+class ArchiveWatermark(Base):
+    __tablename__ = "archive_watermarks"
+
+    # Per user and record table: readings dated before archived_before may live in the
+    # archive files (see archive.py), plus running aggregates of the archived readings so
+    # summaries and statistics stay whole without reading the files.
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    table_name = Column(String, primary_key=True)
+    archived_before = Column(String, nullable=False)  # YYYY-MM-DD
+    row_count = Column(Integer, nullable=False, default=0)
+    # Aggregates over the archived readings with positive values (as the dashboard counts them);
+    # value2 is the diastolic reading for blood pressure
+    value_count = Column(Integer, nullable=False, default=0)
+    value_sum = Column(Float, nullable=False, default=0)
+    value_sumsq = Column(Float, nullable=False, default=0)
+    value2_sum = Column(Float, nullable=False, default=0)
+    first_id = Column(Integer)
+    first_date = Column(String)
+    first_value = Column(Float)
+    last_id = Column(Integer)
+    last_date = Column(String)
+    last_value = Column(Float)
+    last_value2 = Column(Float)
+    updated_at = Column(String)  # UTC, '%Y-%m-%d %H:%M:%S'
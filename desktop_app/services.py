@@ -1,7 +1,52 @@
 import json
 from datetime import datetime
-from models import User, HealthRecord, WeightRecord, BloodPressureRecord, GlucoseRecord, FoodRecord, ExerciseRecord
+from models import User, HealthRecord, WeightRecord, BloodPressureRecord, GlucoseRecord, FoodRecord, ExerciseRecord, DataVersion, SyncCursor
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from summaries import apply_to_summaries
+from glucose_metrics import invalidate_glucose_days
+
+DATA_VERSION_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def touch_user_data(db: Session, user_id: int) -> None:
+    """
+    Bump the user's data version. Must be called in the same transaction as the write
+    so cached reads (ETag / Last-Modified) are invalidated exactly when the data changes.
+    """
+    now = datetime.utcnow().strftime(DATA_VERSION_FORMAT)
+    bump = db.query(DataVersion).filter(DataVersion.user_id == user_id)
+    values = {DataVersion.version: DataVersion.version + 1, DataVersion.updated_at: now}
+    if bump.update(values, synchronize_session=False):
+        return
+    if not _insert_data_version(db, {"user_id": user_id, "version": 1, "updated_at": now}):
+        # A concurrent first write created the row since the UPDATE above
+        bump.update(values, synchronize_session=False)
+
+def _insert_data_version(db: Session, values: dict) -> bool:
+    """INSERT a data version row unless the user already has one. Returns whether it did."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        try:
+            with db.begin_nested():
+                db.execute(insert(DataVersion).values(values))
+            return True
+        except IntegrityError:
+            return False
+    statement = dialect_insert(DataVersion).values(values).on_conflict_do_nothing(index_elements=["user_id"])
+    return db.execute(statement).rowcount == 1
+
+def get_data_version(db: Session, user_id: int):
+    """Return (version, last_modified datetime or None) for the user's health data."""
+    row = db.query(DataVersion.version, DataVersion.updated_at).filter(DataVersion.user_id == user_id).first()
+    if not row:
+        return 0, None
+    last_modified = datetime.strptime(row.updated_at, DATA_VERSION_FORMAT) if row.updated_at else None
+    return row.version, last_modified
 
 def get_or_create_user(db: Session, email: str, name: str, phone: str = None) -> User:
     """Get an existing user by email or create a new one."""
@@ -13,62 +58,155 @@ def get_or_create_user(db: Session, email: str, name: str, phone: str = None) ->
         db.refresh(user)
     return user
 
-def create_weight_record(db: Session, user_id: int, record_data: dict, source: str) -> WeightRecord:
-    """Create and save a new weight record."""
+def _client_id(record_data: dict):
+    """Client-assigned record id used for idempotent inserts, if any."""
+    client_id = record_data.get("client_id")
+    return str(client_id) if client_id not in (None, "") else None
+
+def _insert_ignore(db: Session, model):
+    """INSERT that silently skips rows violating the (user_id, source, client_id) unique index."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        # No portable ON CONFLICT; the pre-filter in stage_records covers the common case
+        return insert(model)
+    return dialect_insert(model).on_conflict_do_nothing(index_elements=["user_id", "source", "client_id"])
+
+def _insert_returning_keys(db: Session, model, records: list) -> set:
+    """
+    Insert-or-ignore `records` and return the (user_id, source, client_id) keys that were
+    really inserted: from RETURNING where the dialect supports it for executemany (SQLite
+    >= 3.35, PostgreSQL), otherwise from the rowcount of one INSERT per record.
+    """
+    columns = [column for column in model.__table__.columns if column.key != "id"]
+    rows = [{column.key: getattr(record, column.key) for column in columns} for record in records]
+    statement = _insert_ignore(db, model)
+    if db.get_bind().dialect.insert_executemany_returning:
+        result = db.execute(statement.returning(model.user_id, model.source, model.client_id), rows)
+        return {tuple(row) for row in result}
+    return {
+        (row["user_id"], row["source"], row["client_id"])
+        for row in rows if db.execute(statement, row).rowcount == 1
+    }
+
+def stage_records(db: Session, records: list):
+    """
+    Stage records in the current transaction with insert-or-ignore semantics for
+    records carrying a client_id. The caller commits. Returns (inserted, duplicates).
+    """
+    inserted_records = [record for record in records if record.client_id is None]
+    db.add_all(inserted_records)
+    duplicates = 0
+
+    by_model = {}
+    for record in records:
+        if record.client_id is not None:
+            by_model.setdefault(type(record), []).append(record)
+
+    for model, model_records in by_model.items():
+        # One query per table finds ids already stored (e.g. a retried sync)
+        keys = {(r.user_id, r.source, r.client_id) for r in model_records}
+        existing = set(
+            db.query(model.user_id, model.source, model.client_id).filter(
+                model.user_id.in_({key[0] for key in keys}),
+                model.client_id.in_({key[2] for key in keys})
+            ).all()
+        )
+        candidates = {}
+        for record in model_records:
+            key = (record.user_id, record.source, record.client_id)
+            if key in existing or key in candidates:
+                duplicates += 1
+                continue
+            candidates[key] = record
+        if not candidates:
+            continue
+
+        # A concurrent retry can commit between the pre-filter and the insert: only the
+        # rows the INSERT actually wrote count as inserted (and reach the snapshot)
+        stored = _insert_returning_keys(db, model, list(candidates.values()))
+        duplicates += len(candidates) - len(stored)
+        inserted_records.extend(record for key, record in candidates.items() if key in stored)
+
+    apply_to_summaries(db, inserted_records)
+    invalidate_glucose_days(db, inserted_records)
+    return len(inserted_records), duplicates
+
+def _save_record(db: Session, user_id: int, new_record):
+    """
+    Save a single record, update the user's snapshot and data version, and commit.
+    A record whose client_id is already stored (a re-sent request) is ignored.
+    """
+    inserted, _ = stage_records(db, [new_record])
+    if inserted:
+        touch_user_data(db, user_id)
+    db.commit()
+    if new_record in db:
+        db.refresh(new_record)
+    return new_record
+
+def build_weight_record(user_id: int, record_data: dict, source: str) -> WeightRecord:
+    """Build (without saving) a weight record."""
     sync_date = record_data.get('sync_date') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    new_record = WeightRecord(
+
+    return WeightRecord(
         user_id=user_id,
         date=record_data.get("date"),
         weight=record_data.get("weight"),
         notes=record_data.get("notes", ""),
         source=source,
-        sync_date=sync_date
+        sync_date=sync_date,
+        client_id=_client_id(record_data)
     )
-    db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
-    return new_record
 
-def create_blood_pressure_record(db: Session, user_id: int, record_data: dict, source: str) -> BloodPressureRecord:
-    """Create and save a new blood pressure record."""
+def create_weight_record(db: Session, user_id: int, record_data: dict, source: str) -> WeightRecord:
+    """Create and save a new weight record."""
+    return _save_record(db, user_id, build_weight_record(user_id, record_data, source))
+
+def build_blood_pressure_record(user_id: int, record_data: dict, source: str) -> BloodPressureRecord:
+    """Build (without saving) a blood pressure record."""
     sync_date = record_data.get('sync_date') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    new_record = BloodPressureRecord(
+
+    return BloodPressureRecord(
         user_id=user_id,
         date=record_data.get("date"),
         systolic=record_data.get("blood_pressure_sys"),
         diastolic=record_data.get("blood_pressure_dia"),
         notes=record_data.get("notes", ""),
         source=source,
-        sync_date=sync_date
+        sync_date=sync_date,
+        client_id=_client_id(record_data)
     )
-    db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
-    return new_record
 
-def create_glucose_record(db: Session, user_id: int, record_data: dict, source: str) -> GlucoseRecord:
-    """Create and save a new glucose record."""
+def create_blood_pressure_record(db: Session, user_id: int, record_data: dict, source: str) -> BloodPressureRecord:
+    """Create and save a new blood pressure record."""
+    return _save_record(db, user_id, build_blood_pressure_record(user_id, record_data, source))
+
+def build_glucose_record(user_id: int, record_data: dict, source: str) -> GlucoseRecord:
+    """Build (without saving) a glucose record."""
     sync_date = record_data.get('sync_date') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    new_record = GlucoseRecord(
+
+    return GlucoseRecord(
         user_id=user_id,
         date=record_data.get("date"),
         glucose_level=record_data.get("glucose_level"),
         notes=record_data.get("notes", ""),
         source=source,
-        sync_date=sync_date
+        sync_date=sync_date,
+        client_id=_client_id(record_data)
     )
-    db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
-    return new_record
 
-def create_food_record(db: Session, user_id: int, record_data: dict, source: str) -> FoodRecord:
-    """Create and save a new food record."""
+def create_glucose_record(db: Session, user_id: int, record_data: dict, source: str) -> GlucoseRecord:
+    """Create and save a new glucose record."""
+    return _save_record(db, user_id, build_glucose_record(user_id, record_data, source))
+
+def build_food_record(user_id: int, record_data: dict, source: str) -> FoodRecord:
+    """Build (without saving) a food record."""
     sync_date = record_data.get('sync_date') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
+
     # Normalize meals field
     meals = record_data.get('meals') or record_data.get('meals_data') or record_data.get('meals_data_json')
     try:
@@ -76,25 +214,26 @@ def create_food_record(db: Session, user_id: int, record_data: dict, source: str
     except Exception:
         # If meals already a JSON string, keep as is
         meals_json = meals if isinstance(meals, str) else None
-    
-    new_record = FoodRecord(
+
+    return FoodRecord(
         user_id=user_id,
         date=record_data.get("date"),
         meals=meals_json,
         notes=record_data.get("notes", ""),
         source=source,
-        sync_date=sync_date
+        sync_date=sync_date,
+        client_id=_client_id(record_data)
     )
-    db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
-    return new_record
 
-def create_exercise_record(db: Session, user_id: int, record_data: dict, source: str) -> ExerciseRecord:
-    """Create and save a new exercise record."""
+def create_food_record(db: Session, user_id: int, record_data: dict, source: str) -> FoodRecord:
+    """Create and save a new food record."""
+    return _save_record(db, user_id, build_food_record(user_id, record_data, source))
+
+def build_exercise_record(user_id: int, record_data: dict, source: str) -> ExerciseRecord:
+    """Build (without saving) an exercise record."""
     sync_date = record_data.get('sync_date') or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    new_record = ExerciseRecord(
+
+    return ExerciseRecord(
         user_id=user_id,
         date=record_data.get("date"),
         exercise_type=record_data.get("exercise_type"),
@@ -103,50 +242,143 @@ def create_exercise_record(db: Session, user_id: int, record_data: dict, source:
         intensity=record_data.get("intensity"),
         notes=record_data.get("notes", ""),
         source=source,
-        sync_date=sync_date
+        sync_date=sync_date,
+        client_id=_client_id(record_data)
     )
-    db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
-    return new_record
 
-def create_health_record(db: Session, user_id: int, record_data: dict, source: str):
+def create_exercise_record(db: Session, user_id: int, record_data: dict, source: str) -> ExerciseRecord:
+    """Create and save a new exercise record."""
+    return _save_record(db, user_id, build_exercise_record(user_id, record_data, source))
+
+def build_health_records(user_id: int, record_data: dict, source: str) -> list:
     """
-    Create health record(s) based on the data provided.
-    This function intelligently detects which types of data are present and creates the appropriate records.
-    Maintains backward compatibility with old code.
+    Build (without saving) the record(s) present in a combined record payload.
+    Returns a list of (record_type, record) tuples.
     """
-    created_records = []
-    
+    built_records = []
+
     # Check and create weight record if weight data is present
     if record_data.get("weight") is not None and record_data.get("weight") != 0:
-        weight_record = create_weight_record(db, user_id, record_data, source)
-        created_records.append(("weight", weight_record))
-    
+        built_records.append(("weight", build_weight_record(user_id, record_data, source)))
+
     # Check and create blood pressure record if pressure data is present
     if (record_data.get("blood_pressure_sys") is not None and record_data.get("blood_pressure_sys") != 0) or \
        (record_data.get("blood_pressure_dia") is not None and record_data.get("blood_pressure_dia") != 0):
-        bp_record = create_blood_pressure_record(db, user_id, record_data, source)
-        created_records.append(("blood_pressure", bp_record))
-    
+        built_records.append(("blood_pressure", build_blood_pressure_record(user_id, record_data, source)))
+
     # Check and create glucose record if glucose data is present
     if record_data.get("glucose_level") is not None and record_data.get("glucose_level") != 0:
-        glucose_record = create_glucose_record(db, user_id, record_data, source)
-        created_records.append(("glucose", glucose_record))
-    
+        built_records.append(("glucose", build_glucose_record(user_id, record_data, source)))
+
     # Check and create food record if meals data is present
     meals = record_data.get('meals') or record_data.get('meals_data') or record_data.get('meals_data_json')
     if meals is not None:
-        food_record = create_food_record(db, user_id, record_data, source)
-        created_records.append(("food", food_record))
+        built_records.append(("food", build_food_record(user_id, record_data, source)))
 
     # Check and create exercise record if exercise data is present
     if record_data.get("exercise_type") is not None:
-        exercise_record = create_exercise_record(db, user_id, record_data, source)
-        created_records.append(("exercise", exercise_record))
-    
-    # Return the first record for backward compatibility, or all records info
-    if created_records:
-        return created_records[0][1]  # Return first record for backward compatibility
-    
-    return None
+        built_records.append(("exercise", build_exercise_record(user_id, record_data, source)))
+
+    return built_records
+
+def create_health_record(db: Session, user_id: int, record_data: dict, source: str):
+    """
+    Create health record(s) based on the data provided.
+    This function intelligently detects which types of data are present and creates the appropriate records.
+    Maintains backward compatibility with old code.
+    """
+    created_records = build_health_records(user_id, record_data, source)
+    if not created_records:
+        return None
+
+    inserted, _ = stage_records(db, [record for _, record in created_records])
+    if inserted:
+        touch_user_data(db, user_id)
+    db.commit()
+
+    # Return the first record for backward compatibility
+    first_record = created_records[0][1]
+    if first_record in db:
+        db.refresh(first_record)
+    return first_record
+
+# Record types accepted by create_records_batch, keyed like the /add/<type> endpoints
+RECORD_BUILDERS = {
+    "weight": build_weight_record,
+    "pressure": build_blood_pressure_record,
+    "glucose": build_glucose_record,
+    "food": build_food_record,
+    "exercise": build_exercise_record,
+}
+
+def create_records_batch(db: Session, user_id: int, entries: list, source: str) -> int:
+    """
+    Save many records for one user in a single transaction.
+    Each entry is {"type": <RECORD_BUILDERS key or "record">, "data": {...}}; "record"
+    entries use the combined-payload detection of create_health_record.
+    Either every entry is committed or none is. Returns the number of rows inserted.
+    """
+    new_records = build_batch_records(user_id, entries, source)
+    if not new_records:
+        return 0
+
+    inserted, _ = stage_records(db, new_records)
+    if inserted:
+        touch_user_data(db, user_id)
+    db.commit()
+    return inserted
+
+def build_batch_records(user_id: int, entries: list, source: str) -> list:
+    """Build (without saving) the records for a list of {"type", "data"} entries."""
+    new_records = []
+    for index, entry in enumerate(entries):
+        record_type = entry.get("type")
+        record_data = entry.get("data") or {}
+        if record_type == "record":
+            new_records.extend(record for _, record in build_health_records(user_id, record_data, source))
+        elif record_type in RECORD_BUILDERS:
+            new_records.append(RECORD_BUILDERS[record_type](user_id, record_data, source))
+        else:
+            raise ValueError(f"Unknown record type '{record_type}' at position {index}")
+    return new_records
+
+def get_sync_cursor(db: Session, user_id: int, source: str) -> dict:
+    """Return what the server has acknowledged for a device, so it can upload only the delta."""
+    cursor = db.get(SyncCursor, (user_id, source))
+    if not cursor:
+        return {"device_id": source, "last_record_date": None, "records_acknowledged": 0, "updated_at": None}
+    return {
+        "device_id": source,
+        "last_record_date": cursor.last_record_date,
+        "records_acknowledged": cursor.records_acknowledged,
+        "updated_at": cursor.updated_at,
+    }
+
+def sync_device_records(db: Session, user_id: int, records: list, source: str) -> dict:
+    """
+    Save a device upload in one transaction. Records carrying a client_id that was
+    already stored for this user and device are skipped, so retries are harmless.
+    Advances and returns the device's sync cursor.
+    """
+    new_records = build_batch_records(user_id, [{"type": "record", "data": record} for record in records], source)
+    inserted, duplicates = stage_records(db, new_records)
+    if inserted:
+        touch_user_data(db, user_id)
+
+    # Everything in the payload is now on the server, inserted or not
+    record_dates = [record.get("date") for record in records if record.get("date")]
+    now = datetime.utcnow().strftime(DATA_VERSION_FORMAT)
+    cursor = db.get(SyncCursor, (user_id, source))
+    if not cursor:
+        cursor = SyncCursor(user_id=user_id, source=source, records_acknowledged=0)
+        db.add(cursor)
+    if record_dates:
+        latest = max(record_dates)
+        if not cursor.last_record_date or latest > cursor.last_record_date:
+            cursor.last_record_date = latest
+    cursor.records_acknowledged = (cursor.records_acknowledged or 0) + inserted
+    cursor.updated_at = now
+    db.commit()
+
+    result = get_sync_cursor(db, user_id, source)
+    return {"inserted": inserted, "duplicates": duplicates, "cursor": result}
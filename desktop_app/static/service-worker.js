@@ -1,22 +1,247 @@
-const CACHE_NAME = 'salud-control-v1';
+// Bump CACHE_VERSION whenever the precached assets or caching strategy change;
+// caches from older versions are deleted on activate.
+const CACHE_VERSION = 'v3';
+const STATIC_CACHE = `salud-control-static-${CACHE_VERSION}`;
+const API_CACHE = `salud-control-api-${CACHE_VERSION}`;
+const CURRENT_CACHES = [STATIC_CACHE, API_CACHE];
+
 const urlsToCache = [
   '/',
+  '/static/style.css',
   '/static/manifest.json',
   '/static/icon.svg',
   'https://cdn.plot.ly/plotly-latest.min.js'
 ];
 
+// Read endpoints served stale-while-revalidate
+const API_PATHS = ['/summary', '/health_data', '/generate_plots', '/analyze'];
+
+// Requests that change who is logged in; the API cache belongs to the previous user
+const SESSION_PATHS = ['/login', '/register', '/logout'];
+
+// Write endpoints that are queued while offline and flushed to /add/batch
+const WRITE_PATHS = {
+  '/add_record': 'record',
+  '/add/weight': 'weight',
+  '/add/pressure': 'pressure',
+  '/add/glucose': 'glucose',
+  '/add/food': 'food',
+  '/add/exercise': 'exercise'
+};
+
+const DB_NAME = 'salud-control-sw';
+const QUEUE_STORE = 'write-queue';
+const SYNC_TAG = 'flush-writes';
+
+// --- IndexedDB write queue -------------------------------------------------
+
+function openQueue() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(DB_NAME, 1);
+    request.onupgradeneeded = () => {
+      request.result.createObjectStore(QUEUE_STORE, { keyPath: 'id', autoIncrement: true });
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function queueTransaction(mode, fn) {
+  return openQueue().then(db => new Promise((resolve, reject) => {
+    const tx = db.transaction(QUEUE_STORE, mode);
+    const result = fn(tx.objectStore(QUEUE_STORE));
+    tx.oncomplete = () => resolve(result && 'result' in result ? result.result : undefined);
+    tx.onerror = () => reject(tx.error);
+  }));
+}
+
+function enqueueWrite(entry) {
+  return queueTransaction('readwrite', store => store.add(entry));
+}
+
+function readQueue() {
+  return queueTransaction('readonly', store => store.getAll());
+}
+
+function removeFromQueue(ids) {
+  return queueTransaction('readwrite', store => ids.forEach(id => store.delete(id)));
+}
+
+// Any successful write makes the cached dashboard data stale
+function invalidateApiCache() {
+  return caches.delete(API_CACHE);
+}
+
+// An expired session answers API calls with a redirect to the /login page (HTML)
+function isJsonResponse(response) {
+  return response.ok && !response.redirected &&
+    (response.headers.get('Content-Type') || '').includes('application/json');
+}
+
+let flushing = null;
+
+function flushQueue() {
+  if (flushing) {
+    return flushing;
+  }
+  flushing = readQueue()
+    .then(entries => {
+      if (!entries.length) {
+        return;
+      }
+      return fetch('/add/batch', {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ records: entries.map(entry => ({ type: entry.type, data: entry.data })) })
+      })
+        .then(response => {
+          if (!isJsonResponse(response)) {
+            // Keep the queue (e.g. session expired and we were redirected to /login)
+            throw new Error(`Batch write failed with status ${response.status}`);
+          }
+          return response.json();
+        })
+        .then(result => {
+          if (result.status !== 'success') {
+            throw new Error(result.message || 'Batch write rejected');
+          }
+          return removeFromQueue(entries.map(entry => entry.id)).then(invalidateApiCache);
+        });
+    })
+    .catch(err => console.log('Write queue flush postponed: ', err))
+    .finally(() => {
+      flushing = null;
+    });
+  return flushing;
+}
+
+// --- Lifecycle ---------------------------------------------------------------
+
 self.addEventListener('install', event => {
   event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
-      })
+    caches.open(STATIC_CACHE)
+      .then(cache => cache.addAll(urlsToCache))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(names => Promise.all(
+        names
+          .filter(name => !CURRENT_CACHES.includes(name))
+          .map(name => caches.delete(name))
+      ))
+      .then(() => self.clients.claim())
+      .then(flushQueue)
   );
 });
 
+self.addEventListener('sync', event => {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(flushQueue());
+  }
+});
+
+// Pages post 'flush-writes' when the browser reports it is back online
+self.addEventListener('message', event => {
+  if (event.data === SYNC_TAG) {
+    event.waitUntil(flushQueue());
+  }
+});
+
+// --- Fetch strategies --------------------------------------------------------
+
+function staleWhileRevalidate(event) {
+  return caches.open(API_CACHE).then(cache =>
+    cache.match(event.request).then(cached => {
+      const network = fetch(event.request).then(response => {
+        if (isJsonResponse(response)) {
+          cache.put(event.request, response.clone());
+        }
+        return response;
+      });
+      if (cached) {
+        // Keep the worker alive until the revalidation finishes
+        event.waitUntil(network.catch(() => undefined));
+        return cached;
+      }
+      return network;
+    })
+  );
+}
+
+function queueableWrite(event, type) {
+  const request = event.request;
+  return request.clone().text().then(body =>
+    fetch(request)
+      .then(response => {
+        if (response.ok) {
+          event.waitUntil(invalidateApiCache().then(flushQueue));
+        }
+        return response;
+      })
+      .catch(() => {
+        // Offline: keep the write in IndexedDB and acknowledge it to the page
+        let data;
+        try {
+          data = JSON.parse(body);
+        } catch (err) {
+          return Response.error();
+        }
+        // The client id makes a re-sent batch (lost response, retry) idempotent server-side
+        if (!data.client_id) {
+          data.client_id = self.crypto.randomUUID();
+        }
+        return enqueueWrite({ type: type, data: data, queued_at: new Date().toISOString() })
+          .then(() => self.registration.sync ? self.registration.sync.register(SYNC_TAG).catch(() => undefined) : undefined)
+          .then(() => new Response(JSON.stringify({ status: 'success', queued: true }), {
+            status: 202,
+            headers: { 'Content-Type': 'application/json' }
+          }));
+      })
+  );
+}
+
 self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url);
+  const sameOrigin = url.origin === self.location.origin;
+
+  if (sameOrigin && SESSION_PATHS.includes(url.pathname) &&
+      (event.request.method === 'POST' || url.pathname === '/logout')) {
+    // The next user of this device must not see the previous user's cached dashboard
+    event.respondWith(invalidateApiCache().then(() => fetch(event.request)));
+    return;
+  }
+
+  if (event.request.method === 'POST') {
+    if (sameOrigin && WRITE_PATHS[url.pathname]) {
+      event.respondWith(queueableWrite(event, WRITE_PATHS[url.pathname]));
+    }
+    return;
+  }
+
+  if (event.request.method !== 'GET') {
+    return;
+  }
+
+  if (sameOrigin && API_PATHS.includes(url.pathname)) {
+    event.respondWith(staleWhileRevalidate(event));
+    return;
+  }
+
+  if (event.request.mode === 'navigate') {
+    // Network first for pages so login/session state is fresh; cached shell offline
+    event.respondWith(
+      fetch(event.request).catch(() =>
+        caches.match(event.request).then(response => response || caches.match('/'))
+      )
+    );
+    return;
+  }
+
   event.respondWith(
     caches.match(event.request)
       .then(response => {
@@ -0,0 +1,307 @@
+"""
+Per-user "latest and aggregate" snapshot behind the dashboard stat cards.
+
+services.py applies every inserted record to the user's UserSummary row in the same
+transaction, so /summary answers with one primary-key read instead of shipping the
+whole history to the browser. rebuild_user_summary recomputes the row from the raw
+record tables (plus the aggregates of archived readings, see archive.py);
+verify_summaries uses it as a consistency check.
+
+Usage, from desktop_app/:
+
+    python summaries.py verify            # report users whose snapshot drifted
+    python summaries.py verify --fix      # ...and rewrite them from the raw tables
+    python summaries.py verify --user-id 3
+"""
+import argparse
+import math
+from datetime import datetime
+from sqlalchemy import insert, text, update, case, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from archive import archived_aggregates
+from models import User, UserSummary, WeightRecord, BloodPressureRecord, GlucoseRecord
+
+SUMMARY_FIELDS = [
+    "last_weight", "last_weight_date",
+    "last_systolic", "last_diastolic", "last_bp_date",
+    "last_glucose", "last_glucose_date",
+    "weight_sum", "weight_count",
+    "systolic_sum", "diastolic_sum", "bp_count",
+    "glucose_sum", "glucose_count",
+]
+
+def _positive(value):
+    """The dashboard ignores missing, non-numeric and non-positive readings."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+def _is_newer(date, current_date):
+    # Dates are stored as ISO-like strings; ties go to the most recent write
+    return date is not None and (current_date is None or str(date) >= str(current_date))
+
+def _empty_summary(user_id: int) -> UserSummary:
+    return UserSummary(
+        user_id=user_id,
+        weight_sum=0, weight_count=0,
+        systolic_sum=0, diastolic_sum=0, bp_count=0,
+        glucose_sum=0, glucose_count=0,
+    )
+
+def _summary_updates(records: list, now: str) -> dict:
+    """
+    Column updates folding records into a snapshot, as SQL expressions on the stored
+    row: sums are incremented and "last" values only move forward in date, so
+    concurrent writers cannot lose each other's updates.
+    """
+    totals = {"weight_sum": 0.0, "weight_count": 0, "systolic_sum": 0.0, "diastolic_sum": 0.0,
+              "bp_count": 0, "glucose_sum": 0.0, "glucose_count": 0}
+    latest = {}  # metric -> (date, {column: value})
+
+    def track(metric, date, values):
+        if _is_newer(date, latest.get(metric, (None,))[0]):
+            latest[metric] = (date, values)
+
+    for record in records:
+        if isinstance(record, WeightRecord):
+            weight = _positive(record.weight)
+            if weight is not None:
+                totals["weight_sum"] += weight
+                totals["weight_count"] += 1
+                track("weight", record.date, {"last_weight": weight})
+        elif isinstance(record, BloodPressureRecord):
+            systolic, diastolic = _positive(record.systolic), _positive(record.diastolic)
+            if systolic is not None and diastolic is not None:
+                totals["systolic_sum"] += systolic
+                totals["diastolic_sum"] += diastolic
+                totals["bp_count"] += 1
+                track("bp", record.date, {"last_systolic": int(systolic), "last_diastolic": int(diastolic)})
+        elif isinstance(record, GlucoseRecord):
+            glucose = _positive(record.glucose_level)
+            if glucose is not None:
+                totals["glucose_sum"] += glucose
+                totals["glucose_count"] += 1
+                track("glucose", record.date, {"last_glucose": glucose})
+
+    updates = {
+        getattr(UserSummary, column): getattr(UserSummary, column) + amount
+        for column, amount in totals.items() if amount
+    }
+    for metric, (date, values) in latest.items():
+        date_column = getattr(UserSummary, f"last_{metric}_date")
+        newer = or_(date_column.is_(None), date_column <= str(date))
+        updates[date_column] = case((newer, date), else_=date_column)
+        for column, value in values.items():
+            updates[getattr(UserSummary, column)] = case((newer, value), else_=getattr(UserSummary, column))
+    if updates:
+        updates[UserSummary.updated_at] = now
+    return updates
+
+def apply_to_summaries(db: Session, records: list) -> None:
+    """
+    Fold newly inserted records into their users' snapshots (caller commits).
+    A user without a snapshot yet gets one rebuilt from the raw tables instead, which
+    already includes these records once they are flushed.
+    """
+    by_user = {}
+    for record in records:
+        if isinstance(record, (WeightRecord, BloodPressureRecord, GlucoseRecord)):
+            by_user.setdefault(record.user_id, []).append(record)
+
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    for user_id, user_records in by_user.items():
+        updates = _summary_updates(user_records, now)
+        if not updates:
+            continue
+        result = db.execute(update(UserSummary).where(UserSummary.user_id == user_id).values(updates))
+        if result.rowcount == 0:
+            db.flush()
+            if not _insert_summary(db, compute_user_summary(db, user_id)):
+                # A concurrent first write created the snapshot; it cannot include these records
+                db.execute(update(UserSummary).where(UserSummary.user_id == user_id).values(updates))
+
+def _newest(hot, archived):
+    """The later of two (date, id, values...) readings; either may be None."""
+    if hot is None or archived is None:
+        return hot or archived
+    return max(hot, archived, key=lambda reading: (str(reading[0]), reading[1]))
+
+def compute_user_summary(db: Session, user_id: int) -> UserSummary:
+    """Compute (without saving) a user's snapshot from the raw record tables and the archive aggregates."""
+    summary = _empty_summary(user_id)
+    params = {"user_id": user_id}
+    conn = db.connection()
+
+    row = db.execute(text(
+        "SELECT weight, date, id FROM weight_records WHERE user_id = :user_id AND weight > 0 "
+        "ORDER BY date DESC, id DESC LIMIT 1"), params).first()
+    archived = archived_aggregates(conn, "weight_records", [user_id]).get(user_id)
+    latest = _newest((row.date, row.id, float(row.weight)) if row else None,
+                     (archived.last_date, archived.last_id, archived.last_value) if archived and archived.last_date else None)
+    if latest:
+        summary.last_weight_date, _, summary.last_weight = latest
+    row = db.execute(text(
+        "SELECT COALESCE(SUM(weight), 0) AS total, COUNT(*) AS n FROM weight_records "
+        "WHERE user_id = :user_id AND weight > 0"), params).first()
+    summary.weight_sum, summary.weight_count = float(row.total), row.n
+    if archived:
+        summary.weight_sum += archived.value_sum
+        summary.weight_count += archived.value_count
+
+    row = db.execute(text(
+        "SELECT systolic, diastolic, date, id FROM blood_pressure_records "
+        "WHERE user_id = :user_id AND systolic > 0 AND diastolic > 0 ORDER BY date DESC, id DESC LIMIT 1"), params).first()
+    archived = archived_aggregates(conn, "blood_pressure_records", [user_id]).get(user_id)
+    latest = _newest((row.date, row.id, row.systolic, row.diastolic) if row else None,
+                     (archived.last_date, archived.last_id, archived.last_value, archived.last_value2)
+                     if archived and archived.last_date else None)
+    if latest:
+        summary.last_bp_date, _, systolic, diastolic = latest
+        summary.last_systolic, summary.last_diastolic = int(systolic), int(diastolic)
+    row = db.execute(text(
+        "SELECT COALESCE(SUM(systolic), 0) AS sys_total, COALESCE(SUM(diastolic), 0) AS dia_total, COUNT(*) AS n "
+        "FROM blood_pressure_records WHERE user_id = :user_id AND systolic > 0 AND diastolic > 0"), params).first()
+    summary.systolic_sum, summary.diastolic_sum, summary.bp_count = float(row.sys_total), float(row.dia_total), row.n
+    if archived:
+        summary.systolic_sum += archived.value_sum
+        summary.diastolic_sum += archived.value2_sum
+        summary.bp_count += archived.value_count
+
+    row = db.execute(text(
+        "SELECT glucose_level, date, id FROM glucose_records WHERE user_id = :user_id AND glucose_level > 0 "
+        "ORDER BY date DESC, id DESC LIMIT 1"), params).first()
+    archived = archived_aggregates(conn, "glucose_records", [user_id]).get(user_id)
+    latest = _newest((row.date, row.id, float(row.glucose_level)) if row else None,
+                     (archived.last_date, archived.last_id, archived.last_value) if archived and archived.last_date else None)
+    if latest:
+        summary.last_glucose_date, _, summary.last_glucose = latest
+    row = db.execute(text(
+        "SELECT COALESCE(SUM(glucose_level), 0) AS total, COUNT(*) AS n FROM glucose_records "
+        "WHERE user_id = :user_id AND glucose_level > 0"), params).first()
+    summary.glucose_sum, summary.glucose_count = float(row.total), row.n
+    if archived:
+        summary.glucose_sum += archived.value_sum
+        summary.glucose_count += archived.value_count
+
+    summary.updated_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    return summary
+
+def _insert_summary(db: Session, summary: UserSummary) -> bool:
+    """INSERT a snapshot unless the user already has one (e.g. a concurrent first write). Returns whether it did."""
+    values = {column.key: getattr(summary, column.key) for column in UserSummary.__table__.columns}
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        try:
+            with db.begin_nested():
+                db.execute(insert(UserSummary).values(values))
+            return True
+        except IntegrityError:
+            return False
+    statement = dialect_insert(UserSummary).values(values).on_conflict_do_nothing(index_elements=["user_id"])
+    return db.execute(statement).rowcount == 1
+
+def rebuild_user_summary(db: Session, user_id: int) -> UserSummary:
+    """Replace the user's snapshot with one computed from the raw tables (caller commits)."""
+    fresh = compute_user_summary(db, user_id)
+    summary = db.get(UserSummary, user_id)
+    if summary is None and _insert_summary(db, fresh):
+        return db.get(UserSummary, user_id)
+    if summary is None:
+        # Created concurrently since the lookup above
+        summary = db.get(UserSummary, user_id)
+    for field in SUMMARY_FIELDS + ["updated_at"]:
+        setattr(summary, field, getattr(fresh, field))
+    return summary
+
+def _same(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+    return a == b
+
+def summary_differences(stored: UserSummary, fresh: UserSummary) -> list:
+    """Names of the fields where a stored snapshot disagrees with the raw tables."""
+    return [field for field in SUMMARY_FIELDS if not _same(getattr(stored, field), getattr(fresh, field))]
+
+def summary_to_dict(summary: UserSummary) -> dict:
+    """Stat card values, in the shape the dashboard renders."""
+    def average(total, count):
+        return total / count if count else None
+
+    return {
+        "last_weight": summary.last_weight,
+        "last_weight_date": summary.last_weight_date,
+        "last_bp": {"sys": summary.last_systolic, "dia": summary.last_diastolic} if summary.last_bp_date else None,
+        "last_bp_date": summary.last_bp_date,
+        "last_glucose": summary.last_glucose,
+        "last_glucose_date": summary.last_glucose_date,
+        "avg_weight": average(summary.weight_sum, summary.weight_count),
+        "avg_bp": {
+            "sys": average(summary.systolic_sum, summary.bp_count),
+            "dia": average(summary.diastolic_sum, summary.bp_count),
+        } if summary.bp_count else None,
+        "avg_glucose": average(summary.glucose_sum, summary.glucose_count),
+        "counts": {"weight": summary.weight_count, "blood_pressure": summary.bp_count, "glucose": summary.glucose_count},
+    }
+
+def get_user_summary(db: Session, user_id: int) -> UserSummary:
+    """Return the user's snapshot, building it on first use (e.g. data older than the table)."""
+    summary = db.get(UserSummary, user_id)
+    if summary is None:
+        summary = rebuild_user_summary(db, user_id)
+        db.commit()
+    return summary
+
+def verify_summaries(db: Session, user_ids=None, fix: bool = False) -> dict:
+    """
+    Compare stored snapshots against the raw tables. Returns {user_id: [drifted fields]}
+    for users that disagree (a missing snapshot counts as drift); rewrites them when fix=True.
+    """
+    if user_ids is None:
+        user_ids = [row[0] for row in db.query(User.id).all()]
+
+    drifted = {}
+    for user_id in user_ids:
+        stored = db.get(UserSummary, user_id)
+        fresh = compute_user_summary(db, user_id)
+        differences = ["<missing>"] if stored is None else summary_differences(stored, fresh)
+        if differences:
+            drifted[user_id] = differences
+            if fix:
+                rebuild_user_summary(db, user_id)
+    if fix:
+        db.commit()
+    return drifted
+
+def main():
+    parser = argparse.ArgumentParser(description="Check dashboard summary snapshots against the raw record tables.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    verify = subparsers.add_parser("verify", help="report (and optionally fix) drifted snapshots")
+    verify.add_argument("--user-id", type=int, action="append", help="limit to these users (repeatable)")
+    verify.add_argument("--fix", action="store_true", help="rebuild drifted snapshots from the raw tables")
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+    from migrations import check_schema
+    check_schema(engine)
+
+    db = SessionLocal()
+    try:
+        drifted = verify_summaries(db, args.user_id, fix=args.fix)
+    finally:
+        db.close()
+
+    if not drifted:
+        print("All summaries are consistent.")
+        return
+    for user_id, fields in sorted(drifted.items()):
+        print(f"user {user_id}: {', '.join(fields)}{' (fixed)' if args.fix else ''}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Shared fixtures: the app on a scratch SQLite database, migrated to the latest schema.
+
+The database module reads its URL at import time and the app checks the schema version
+at import, so both happen here before any test module imports app.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_tmp_dir = tempfile.mkdtemp(prefix="salud_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}"
+os.environ["ARCHIVE_DIR"] = os.path.join(_tmp_dir, "archive")
+os.environ.pop("GEMINI_API_KEY", None)
+os.environ.pop("WRITE_BEHIND", None)
+os.environ.pop("SYNC_ALLOW_EMAIL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal, engine  # noqa: E402
+from migrations import upgrade  # noqa: E402
+upgrade(engine, log=lambda message: None)
+
+from app import app  # noqa: E402
+from models import User  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def user(db):
+    user = User(name="Test", email=f"test-{uuid.uuid4().hex[:8]}@example.com")
+    user.set_password("secret")
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture
+def client(user):
+    """A test client logged in as `user`."""
+    app.config["TESTING"] = True
+    client = app.test_client()
+    response = client.post("/login", data={"email": user.email, "password": "secret"})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,91 @@
+from models import BloodPressureRecord, DataVersion, ExerciseRecord, FoodRecord, GlucoseRecord, WeightRecord
+
+RECORD_MODELS = [WeightRecord, BloodPressureRecord, GlucoseRecord, FoodRecord, ExerciseRecord]
+
+
+def count_rows(db, user_id):
+    db.expire_all()
+    return {model.__tablename__: db.query(model).filter(model.user_id == user_id).count() for model in RECORD_MODELS}
+
+
+def data_version(db, user_id):
+    db.expire_all()
+    return db.query(DataVersion.version).filter(DataVersion.user_id == user_id).scalar() or 0
+
+
+def test_mixed_batch_commits_every_record(client, db, user):
+    response = client.post("/add/batch", json={"records": [
+        {"type": "weight", "data": {"date": "2024-03-01 08:00:00", "weight": 71.5}},
+        {"type": "pressure", "data": {"date": "2024-03-01 08:05:00", "blood_pressure_sys": 121, "blood_pressure_dia": 79}},
+        {"type": "glucose", "data": {"date": "2024-03-01 08:10:00", "glucose_level": 98}},
+        {"type": "food", "data": {"date": "2024-03-01 13:00:00",
+                                  "meals": {"lunch": {"protein": 30, "carbs": 60, "fat": 15}}}},
+        {"type": "exercise", "data": {"date": "2024-03-01 18:00:00", "tipo_ejercicio": "Caminata",
+                                      "duracion_minutos": 30, "calorias_quemadas": 150, "intensidad": "media"}},
+        {"type": "record", "data": {"date": "2024-03-02 08:00:00", "weight": 71.2, "glucose_level": 101}},
+    ]})
+
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "success", "created": 7}
+    assert count_rows(db, user.id) == {
+        "weight_records": 2, "blood_pressure_records": 1, "glucose_records": 2, "food_records": 1,
+        "exercise_records": 1,
+    }
+    # One transaction, one data-version bump
+    assert data_version(db, user.id) == 1
+
+
+def test_invalid_entry_rolls_back_the_whole_batch(client, db, user):
+    response = client.post("/add/batch", json={"records": [
+        {"type": "weight", "data": {"date": "2024-03-01 08:00:00", "weight": 71.5}},
+        {"type": "glucose", "data": {"date": "2024-03-01 08:10:00", "glucose_level": 98}},
+        {"type": "weight", "data": {"weight": 72.0}},  # no date: violates NOT NULL
+    ]})
+
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+    assert sum(count_rows(db, user.id).values()) == 0
+    assert data_version(db, user.id) == 0
+
+
+def test_unknown_type_is_rejected(client, db, user):
+    response = client.post("/add/batch", json={"records": [
+        {"type": "weight", "data": {"date": "2024-03-01 08:00:00", "weight": 71.5}},
+        {"type": "steps", "data": {"date": "2024-03-01 08:00:00", "steps": 9000}},
+    ]})
+
+    assert response.status_code == 400
+    assert "Unknown record type 'steps' at position 1" in response.get_json()["message"]
+    assert sum(count_rows(db, user.id).values()) == 0
+
+
+
+def test_resent_client_id_is_ignored(client, db, user):
+    batch = {"records": [
+        {"type": "weight", "data": {"date": "2024-03-01 08:00:00", "weight": 71.5, "client_id": "w-1"}},
+        {"type": "glucose", "data": {"date": "2024-03-01 08:10:00", "glucose_level": 98, "client_id": "g-1"}},
+    ]}
+    assert client.post("/add/batch", json=batch).get_json() == {"status": "success", "created": 2}
+
+    # The service worker retries after a lost response, plus one new record
+    batch["records"].append(
+        {"type": "weight", "data": {"date": "2024-03-02 08:00:00", "weight": 71.0, "client_id": "w-2"}})
+    response = client.post("/add/batch", json=batch)
+
+    assert response.status_code == 200
+    assert response.get_json() == {"status": "success", "created": 1}
+    rows = count_rows(db, user.id)
+    assert rows["weight_records"] == 2
+    assert rows["glucose_records"] == 1
+
+
+def test_resent_web_add_with_client_id_is_ignored(client, db, user):
+    record = {"date": "2024-03-02 08:00:00", "weight": 72.0, "client_id": "pwa-1"}
+    combined = {"date": "2024-03-02 09:00:00", "weight": 72.4, "glucose_level": 110, "client_id": "pwa-2"}
+    for _ in range(2):
+        assert client.post("/add/weight", json=record).status_code == 200
+        assert client.post("/add_record", json=combined).status_code == 200
+
+    rows = count_rows(db, user.id)
+    assert rows["weight_records"] == 2
+    assert rows["glucose_records"] == 1
@@ -0,0 +1,78 @@
+import os
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from archive import ARCHIVE_DIR, ArchiveUnavailable, archive_user_table, read_records
+from cohort import table_partials
+from services import create_records_batch
+
+pytest.importorskip("pyarrow")
+
+COLUMNS = ["date", "glucose_level"]
+
+
+@pytest.fixture
+def archived_user(db, user):
+    """A user with six glucose readings, the four from 2023 archived."""
+    create_records_batch(db, user.id, [
+        {"type": "glucose", "data": {"date": f"{day} 08:00:00", "glucose_level": level, "client_id": f"g-{i}"}}
+        for i, (day, level) in enumerate([("2023-01-05", 90), ("2023-02-05", 110), ("2023-03-05", 130),
+                                          ("2023-04-05", 150), ("2024-05-05", 100), ("2024-06-05", 120)])
+    ], "phone")
+    assert archive_user_table(db, "glucose_records", user.id, "2024-01-01") == 4
+    return user
+
+
+def archived_frame(user_id):
+    return pd.read_parquet(os.path.join(ARCHIVE_DIR, "glucose_records", f"user_{user_id}", "2023.parquet"))
+
+
+def user_glucose_count(db, user_id):
+    with db.get_bind().connect() as conn:
+        partials = table_partials(conn, "glucose", (user_id, user_id + 1))
+    return int(partials.loc[user_id, "n"])
+
+
+def test_interrupted_run_is_read_once(db, archived_user):
+    # As if the run had written the files but not yet deleted this hot row
+    first = archived_frame(archived_user.id).iloc[0]
+    db.execute(text(
+        "INSERT INTO glucose_records (id, user_id, date, glucose_level, source, client_id) "
+        "VALUES (:id, :user_id, :date, :level, 'phone', :client_id)"),
+        {"id": int(first["id"]), "user_id": archived_user.id, "date": first["date"],
+         "level": float(first["glucose_level"]), "client_id": first["client_id"]})
+    db.commit()
+
+    with db.get_bind().connect() as conn:
+        assert len(read_records(conn, "glucose_records", archived_user.id, COLUMNS)) == 6
+    assert user_glucose_count(db, archived_user.id) == 6
+
+
+def test_reused_id_does_not_hide_an_archived_reading(db, archived_user):
+    reused_id = int(archived_frame(archived_user.id)["id"].max())
+    # What SQLite does for a table without AUTOINCREMENT after the archive deleted the top rowid
+    db.execute(text(
+        "INSERT INTO glucose_records (id, user_id, date, glucose_level, source) "
+        "VALUES (:id, :user_id, '2024-07-05 08:00:00', 95, 'web_pwa')"), {"id": reused_id, "user_id": archived_user.id})
+    db.commit()
+
+    with db.get_bind().connect() as conn:
+        frame = read_records(conn, "glucose_records", archived_user.id, COLUMNS)
+    assert list(frame["glucose_level"]) == [90, 110, 130, 150, 100, 120, 95]
+
+
+def test_run_refuses_tables_that_reuse_ids():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE glucose_records (id INTEGER PRIMARY KEY, user_id INTEGER, date VARCHAR)"))
+        conn.execute(text("INSERT INTO glucose_records (user_id, date) VALUES (1, '2020-01-01')"))
+    db = sessionmaker(bind=engine)()
+    try:
+        with pytest.raises(ArchiveUnavailable):
+            archive_user_table(db, "glucose_records", 1, "2024-01-01")
+        assert archive_user_table(db, "glucose_records", 1, "2024-01-01", dry_run=True) == 1
+    finally:
+        db.close()
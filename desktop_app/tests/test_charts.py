@@ -0,0 +1,44 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import charts
+from charts import ChartTimeout, _resampled_stats
+
+
+def test_weekly_buckets_run_monday_to_sunday_labeled_by_monday():
+    frame = pd.DataFrame({
+        "date": pd.to_datetime(["2024-03-04 08:00", "2024-03-10 20:00", "2024-03-11 08:00"]),  # Mon, Sun, Mon
+        "glucose_level": [100.0, 140.0, 90.0],
+    })
+
+    stats = _resampled_stats(frame, ["glucose_level"], "week")
+
+    assert list(stats.index) == list(pd.to_datetime(["2024-03-04", "2024-03-11"]))
+    assert list(stats[("glucose_level", "mean")]) == [120.0, 90.0]
+
+
+def test_timed_out_job_keeps_its_pool_slot_until_it_ends(monkeypatch):
+    finish = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(charts, "CHART_EXECUTOR", "process")
+    monkeypatch.setattr(charts, "CHART_POOL_TIMEOUT", 0.05)
+    monkeypatch.setattr(charts, "_pool_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(charts, "_get_pool", lambda: pool)
+    monkeypatch.setattr(charts, "build_plots_compact", lambda compact, granularity: finish.wait() and {})
+    try:
+        with pytest.raises(ChartTimeout, match="timed out"):
+            charts.render_plots({})
+        # The job is still running in its worker, so no new one is admitted
+        with pytest.raises(ChartTimeout, match="busy"):
+            charts.render_plots({})
+
+        finish.set()
+        assert charts._pool_slots.acquire(timeout=1)
+        charts._pool_slots.release()
+        assert charts.render_plots({}) == {}
+    finally:
+        finish.set()
+        pool.shutdown()
@@ -0,0 +1,123 @@
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from archive import archive_user_table
+from cohort import TABLE_QUERIES, _chunk_partials, _range_partials, _user_id_ranges, summarize, table_partials
+from models import User
+from services import create_records_batch
+
+pytest.importorskip("pyarrow")
+
+# (date, weight, systolic, diastolic, glucose) per reading; the first user's 2023 rows get archived
+READINGS = [
+    [("2023-01-05", 80.0, 142, 92, 60), ("2023-06-05", 81.5, 138, 85, 190), ("2024-02-05", 79.0, 125, 78, 110),
+     ("2024-03-05", 78.5, 131, 79, 240)],
+    [("2024-01-10", 65.0, 118, 76, 95), ("2024-01-11", 64.0, 121, 74, 102), ("2024-01-12", 64.5, 119, 81, 99)],
+    [("2024-02-01", 92.0, 150, 95, 150)],
+    [("2024-03-01", 70.0, 128, 82, 65), ("2024-03-02", 71.0, 133, 84, 210), ("2024-03-03", 70.5, 127, 79, 180),
+     ("2024-03-04", 69.5, 129, 90, 70), ("2024-03-05", 70.2, 140, 88, 300)],
+]
+
+
+@pytest.fixture
+def cohort(db):
+    """Users with known readings (the first partly archived) and the same rows as one DataFrame."""
+    rows = []
+    for index, readings in enumerate(READINGS):
+        user = User(name=f"Cohort {index}", email=f"cohort-{uuid.uuid4().hex[:8]}@example.com")
+        db.add(user)
+        db.commit()
+        create_records_batch(db, user.id, [
+            {"type": "record", "data": {"date": f"{day} 08:00:00", "weight": weight, "blood_pressure_sys": sys_,
+                                        "blood_pressure_dia": dia, "glucose_level": glucose, "client_id": f"c-{i}"}}
+            for i, (day, weight, sys_, dia, glucose) in enumerate(readings)
+        ], "phone")
+        rows += [(user.id, weight, sys_, dia, glucose) for _, weight, sys_, dia, glucose in readings]
+        if index == 0:
+            for table in ("weight_records", "blood_pressure_records", "glucose_records"):
+                assert archive_user_table(db, table, user.id, "2024-01-01") == 2
+    frame = pd.DataFrame(rows, columns=["user_id", "weight", "systolic", "diastolic", "glucose_level"])
+    return frame, (int(frame["user_id"].min()), int(frame["user_id"].max()) + 1)
+
+
+def _expected_partials(frame):
+    """The per-user sums cohort.py computes, straight from a groupby over all rows."""
+    g = frame["glucose_level"]
+    return {
+        "weight": frame.assign(n=1, sum=frame["weight"], sumsq=frame["weight"] ** 2)
+                       .groupby("user_id")[["n", "sum", "sumsq"]].sum(),
+        "glucose": frame.assign(n=1, sum=g, sumsq=g ** 2, low=(g < 70).astype(int), high=(g > 180).astype(int))
+                        .groupby("user_id")[["n", "sum", "sumsq", "low", "high"]].sum(),
+    }
+
+
+def test_chunk_partials_match_a_groupby(cohort):
+    frame, _ = cohort
+    expected = _expected_partials(frame)
+
+    partials = _chunk_partials("glucose", frame[["user_id", "glucose_level"]])
+    pd.testing.assert_frame_equal(partials[expected["glucose"].columns], expected["glucose"],
+                                  check_dtype=False)
+    bp = _chunk_partials("blood_pressure", frame[["user_id", "systolic", "diastolic"]])
+    assert bp["stage1"].to_dict() == frame.assign(
+        s=(frame["systolic"] >= 130) | (frame["diastolic"] >= 80)).groupby("user_id")["s"].sum().to_dict()
+
+
+def test_table_partials_read_hot_chunks_and_archive(db, cohort):
+    frame, user_range = cohort
+    expected = _expected_partials(frame)
+    with db.get_bind().connect() as conn:
+        for table in ("weight", "glucose"):
+            partials = table_partials(conn, table, user_range, chunk_size=2)
+            pd.testing.assert_frame_equal(partials[expected[table].columns], expected[table],
+                                          check_dtype=False, check_names=False)
+
+
+def test_summarize_matches_a_direct_groupby(db, cohort):
+    frame, user_range = cohort
+    with db.get_bind().connect() as conn:
+        report = summarize({table: table_partials(conn, table, user_range, chunk_size=3) for table in TABLE_QUERIES})
+
+    by_user = frame.groupby("user_id")
+    glucose_mean = by_user["glucose_level"].mean()
+    cv = (by_user["glucose_level"].std(ddof=1) / glucose_mean).dropna()
+    sys_mean, dia_mean = by_user["systolic"].mean(), by_user["diastolic"].mean()
+
+    assert report["weight"]["users"] == len(READINGS)
+    assert report["weight"]["readings"] == len(frame)
+    assert report["weight"]["user_mean_percentiles"]["p50"] == pytest.approx(
+        np.percentile(by_user["weight"].mean(), 50))
+    assert report["glucose"]["user_mean_percentiles"] == pytest.approx(
+        {f"p{p}": np.percentile(glucose_mean, p) for p in (10, 25, 50, 75, 90)})
+    assert report["glucose"]["cv_percentiles"] == pytest.approx(
+        {f"p{p}": np.percentile(cv, p) for p in (10, 25, 50, 75, 90)})
+    assert report["glucose"]["share_users_cv_unstable"] == pytest.approx((cv > 0.36).mean())
+    assert report["glucose"]["share_readings_below_range"] == pytest.approx((frame["glucose_level"] < 70).mean())
+    assert report["glucose"]["share_readings_above_range"] == pytest.approx((frame["glucose_level"] > 180).mean())
+    assert report["blood_pressure"]["share_users_mean_stage1"] == pytest.approx(
+        ((sys_mean >= 130) | (dia_mean >= 80)).mean())
+    assert report["blood_pressure"]["share_readings_stage2"] == pytest.approx(
+        ((frame["systolic"] >= 140) | (frame["diastolic"] >= 90)).mean())
+
+
+def test_user_id_ranges_split_the_cohort_without_overlap(db, cohort):
+    frame, user_range = cohort
+    with db.get_bind().connect() as conn:
+        whole = {table: table_partials(conn, table, user_range) for table in TABLE_QUERIES}
+        # As many workers as user ids, so the cohort's users land in different ranges
+        ranges = _user_id_ranges(conn, conn.execute(text("SELECT MAX(id) - MIN(id) + 1 FROM users")).scalar())
+    database_url = db.get_bind().url.render_as_string(hide_password=False)
+
+    assert ranges[0][0] <= user_range[0] and ranges[-1][1] >= user_range[1]
+    assert sum(lo < user_range[1] and hi > user_range[0] for lo, hi in ranges) == len(READINGS)
+    assert all(hi == next_lo for (_, hi), (next_lo, _) in zip(ranges, ranges[1:]))
+    results = [_range_partials(database_url, user_range_, 2) for user_range_ in ranges]
+    for table in TABLE_QUERIES:
+        split = pd.concat([result[table] for result in results if not result[table].empty])
+        split = split[(split.index >= user_range[0]) & (split.index < user_range[1])]
+        assert split.index.is_unique
+        pd.testing.assert_frame_equal(split.sort_index(), whole[table].sort_index(), check_dtype=False)
@@ -0,0 +1,46 @@
+import gzip
+
+from flask import Response, request
+
+import app as app_module
+import compression
+
+
+def test_compressed_cache_is_keyed_on_the_body(monkeypatch):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 0)
+    with app_module.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        bodies = []
+        for text in ("first body", "second body"):
+            response = Response(text, mimetype="application/json")
+            response.set_etag("u1-v1-00000000")
+            bodies.append(gzip.decompress(compression._compress_response(response, request).get_data()))
+    assert bodies == [b"first body", b"second body"]
+
+
+def test_failed_ai_step_is_not_cached(client, user, monkeypatch):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 0)
+    monkeypatch.setattr(app_module, "gemini_api_key", "test")
+    monkeypatch.setattr(app_module.genai, "GenerativeModel", lambda name: None)
+    outcomes = iter([RuntimeError("boom"), "OK SUMMARY"])
+
+    def generate_summary(model, stats):
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(app_module, "generate_summary", generate_summary)
+    gzip_headers = {"Accept-Encoding": "gzip"}
+
+    failed = client.get("/analyze", headers=gzip_headers)
+    assert "boom" in gzip.decompress(failed.get_data()).decode()
+    assert failed.headers.get("ETag") is None
+    assert "no-store" in failed.headers["Cache-Control"]
+
+    # Gemini recovered, no new data: the retry must not be served the stored failure
+    recovered = client.get("/analyze", headers=gzip_headers)
+    assert "OK SUMMARY" in gzip.decompress(recovered.get_data()).decode()
+    # ...and the stored summary is served with the same body under the same tag afterwards
+    again = client.get("/analyze", headers=gzip_headers)
+    assert again.headers["ETag"] == recovered.headers["ETag"]
+    assert gzip.decompress(again.get_data()) == gzip.decompress(recovered.get_data())
@@ -0,0 +1,26 @@
+from sqlalchemy import event
+
+from database import engine
+from models import DataVersion
+from services import touch_user_data
+
+
+def test_concurrent_first_write_still_bumps_the_data_version(db, user):
+    competing = {"fired": False}
+
+    def create_row_first(conn, cursor, statement, parameters, context, executemany):
+        # Another first write creates the row between the UPDATE that found none and this INSERT
+        if statement.startswith("INSERT INTO user_data_versions") and not competing["fired"]:
+            competing["fired"] = True
+            conn.connection.cursor().execute(
+                "INSERT INTO user_data_versions (user_id, version, updated_at) VALUES (?, 1, NULL)", (user.id,))
+
+    event.listen(engine, "before_cursor_execute", create_row_first)
+    try:
+        touch_user_data(db, user.id)
+        db.commit()
+    finally:
+        event.remove(engine, "before_cursor_execute", create_row_first)
+
+    assert competing["fired"]
+    assert db.query(DataVersion.version).filter(DataVersion.user_id == user.id).scalar() == 2
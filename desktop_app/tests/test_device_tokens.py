@@ -0,0 +1,29 @@
+from app import app
+from models import User, WeightRecord
+
+RECORDS = [{"date": "2024-03-01 08:00:00", "weight": 71.5, "client_id": "w-1"}]
+
+
+def test_sync_without_token_is_rejected_by_default(db):
+    client = app.test_client()
+
+    response = client.post("/sync_data", json={"email": "nobody@example.com", "name": "Nobody", "records": RECORDS})
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"].startswith("Bearer")
+    assert db.query(User).filter(User.email == "nobody@example.com").count() == 0
+
+    response = client.get("/sync_cursor?email=nobody@example.com&device_id=phone")
+    assert response.status_code == 401
+
+
+def test_sync_with_device_token(client, db, user):
+    response = client.post("/device_tokens", json={"device_id": "phone", "name": "Phone"})
+    assert response.status_code == 201
+    headers = {"Authorization": f"Bearer {response.get_json()['token']}"}
+
+    device = app.test_client()
+    response = device.post("/sync_data", json={"records": RECORDS}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["user_id"] == user.id
+    assert device.get("/sync_cursor", headers=headers).get_json()["cursor"]["records_acknowledged"] == 1
+    assert db.query(WeightRecord).filter(WeightRecord.user_id == user.id, WeightRecord.source == "phone").count() == 1
@@ -0,0 +1,119 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+import glucose_metrics
+from database import SessionLocal
+from glucose_metrics import compute_glucose_metrics, mage
+from models import GlucoseDailyMetrics
+from services import create_glucose_record
+
+
+class _FakeDate(date):
+    current = date(2026, 10, 19)
+
+    @classmethod
+    def today(cls):
+        return cls.current
+
+
+def test_default_window_moves_the_etag_with_the_date(client, monkeypatch):
+    monkeypatch.setattr(glucose_metrics, "date", _FakeDate)
+    client.post("/add/glucose", json={"date": "2026-10-18 08:00:00", "glucose_level": 120})
+
+    first = client.get("/glucose_metrics")
+    assert first.status_code == 200
+    assert first.get_json()["metrics"]["readings"] == 1
+    assert client.get("/glucose_metrics", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    # 20 days later, no new writes: the default window no longer covers the reading
+    monkeypatch.setattr(_FakeDate, "current", date(2026, 11, 8))
+    later = client.get("/glucose_metrics", headers={"If-None-Match": first.headers["ETag"]})
+    assert later.status_code == 200
+    assert later.get_json()["metrics"]["readings"] == 0
+    assert later.headers["ETag"] != first.headers["ETag"]
+
+
+def _sine_day(swing, cycles=3, points=288):
+    """One day of 5-minute readings oscillating around 150 with the given peak-to-nadir swing."""
+    return 150 + swing / 2 * np.sin(2 * np.pi * cycles * np.arange(points) / points)
+
+
+def test_mage_measures_peak_to_nadir_swings():
+    assert mage(_sine_day(100)) == pytest.approx(100)
+    assert mage(_sine_day(60, cycles=4)) == pytest.approx(60)
+
+
+def test_mage_ignores_the_ends_of_the_day():
+    # A steady rise has no turning point, so no excursion
+    assert mage(np.linspace(80, 195, 288)) is None
+    # Only the interior peak is an extreme; the start and end of the day are not nadirs
+    assert mage(np.r_[np.linspace(80, 195, 144), np.linspace(195, 80, 144)]) is None
+
+
+def test_mage_skips_swings_within_one_sd():
+    # Small wiggles on a large swing do not split it
+    day = _sine_day(100) + np.tile([0.0, 1.5], 144)
+    assert mage(day) == pytest.approx(100, abs=2)
+
+
+def _add_readings(db, user, day, levels):
+    for minute, level in enumerate(levels):
+        create_glucose_record(db, user.id, {"date": f"{day} 08:{minute:02d}:00", "glucose_level": level}, "web")
+
+
+def test_window_metrics_for_known_readings(db, user):
+    _add_readings(db, user, "2026-10-01", [60, 100, 150, 200])
+    _add_readings(db, user, "2026-10-03", [120, 140])
+
+    report = compute_glucose_metrics(db, user.id, date(2026, 10, 1), date(2026, 10, 3))
+    levels = np.array([60, 100, 150, 200, 120, 140], dtype=float)
+    assert report["readings"] == 6
+    assert report["days_with_data"] == 2
+    assert report["mean"] == pytest.approx(levels.mean())
+    assert report["sd"] == pytest.approx(levels.std(ddof=1))
+    assert report["cv"] == pytest.approx(levels.std(ddof=1) / levels.mean())
+    assert report["gmi"] == pytest.approx(3.31 + 0.02392 * levels.mean())
+    assert report["time_in_range"] == pytest.approx(4 / 6)
+    assert report["time_below_range"] == pytest.approx(1 / 6)
+    assert report["time_above_range"] == pytest.approx(1 / 6)
+    assert [day["date"] for day in report["daily"]] == ["2026-10-01", "2026-10-03"]
+    assert report["daily"][1]["rolling_mean"] == pytest.approx(levels.mean())
+    assert report["hourly_profile"][8] == pytest.approx(levels.mean())
+
+
+def test_daily_rows_are_cached_and_invalidated_by_writes(db, user):
+    _add_readings(db, user, "2026-10-01", [100, 110])
+    _add_readings(db, user, "2026-10-02", [200])
+
+    first = compute_glucose_metrics(db, user.id, date(2026, 10, 1), date(2026, 10, 2))
+    cached = {row.day: row.computed_at for row in
+              db.query(GlucoseDailyMetrics).filter(GlucoseDailyMetrics.user_id == user.id)}
+    assert sorted(cached) == ["2026-10-01", "2026-10-02"]
+    assert compute_glucose_metrics(db, user.id, date(2026, 10, 1), date(2026, 10, 2)) == first
+
+    # A new reading drops only its own day's row, and the report picks it up
+    _add_readings(db, user, "2026-10-02", [60])
+    days = {row.day for row in db.query(GlucoseDailyMetrics).filter(GlucoseDailyMetrics.user_id == user.id)}
+    assert days == {"2026-10-01"}
+    report = compute_glucose_metrics(db, user.id, date(2026, 10, 1), date(2026, 10, 2))
+    assert report["readings"] == 4
+    assert report["time_below_range"] == pytest.approx(1 / 4)
+
+
+def test_rows_computed_before_a_write_are_not_cached(db, user):
+    _add_readings(db, user, "2026-10-01", [100])
+    rows, fresh, version = glucose_metrics.get_daily_metrics(db, user.id, date(2026, 10, 1), date(2026, 10, 1))
+    assert rows[0].n == 1
+
+    # A reading for the same day commits between the computation and the cache insert
+    writer = SessionLocal()
+    try:
+        _add_readings(writer, user, "2026-10-01", [300])
+    finally:
+        writer.close()
+
+    glucose_metrics.cache_daily_metrics(db, user.id, fresh, version)
+    assert db.query(GlucoseDailyMetrics).filter(GlucoseDailyMetrics.user_id == user.id).count() == 0
+    assert compute_glucose_metrics(db, user.id, date(2026, 10, 1), date(2026, 10, 1))["readings"] == 2
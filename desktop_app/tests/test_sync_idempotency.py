@@ -0,0 +1,34 @@
+from sqlalchemy import event
+
+from database import SessionLocal, engine
+from models import WeightRecord
+from services import sync_device_records
+from summaries import verify_summaries
+
+
+def test_retry_committed_between_prefilter_and_insert_is_not_counted(db, user):
+    record = {"date": "2024-03-01 08:00:00", "weight": 71.5, "client_id": "w-1"}
+    competing = {"fired": False}
+
+    def commit_competing_sync(conn, cursor, statement, parameters, context, executemany):
+        # The pre-filter SELECT has already run; a retry of the same upload commits first
+        if statement.startswith("INSERT INTO weight_records") and not competing["fired"]:
+            competing["fired"] = True
+            other = SessionLocal()
+            try:
+                sync_device_records(other, user.id, [record], "phone")
+            finally:
+                other.close()
+
+    event.listen(engine, "before_cursor_execute", commit_competing_sync)
+    try:
+        result = sync_device_records(db, user.id, [record], "phone")
+    finally:
+        event.remove(engine, "before_cursor_execute", commit_competing_sync)
+
+    assert competing["fired"]
+    assert result["inserted"] == 0
+    assert result["duplicates"] == 1
+    assert result["cursor"]["records_acknowledged"] == 1
+    assert db.query(WeightRecord).filter(WeightRecord.user_id == user.id).count() == 1
+    assert verify_summaries(db, [user.id]) == {}
@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+from database import SessionLocal
+from models import WeightRecord
+from write_behind import WriteBehindWriter, WriterOverloaded
+
+RECORD = {"date": "2024-03-01 08:00:00", "weight": 71.5}
+
+
+def weight_rows(db, user_id):
+    db.expire_all()
+    return db.query(WeightRecord).filter(WeightRecord.user_id == user_id).count()
+
+
+def test_write_still_queued_at_ack_timeout_is_cancelled(db, user):
+    writer = WriteBehindWriter(SessionLocal, ack_timeout=0.05)  # not started: the write stays queued
+
+    with pytest.raises(WriterOverloaded):
+        writer.submit(user.id, "weight", RECORD, "web_pwa")
+
+    writer.start()
+    writer.shutdown()
+    # The client was told to retry, so the cancelled write must never land
+    assert weight_rows(db, user.id) == 0
+
+
+def test_write_already_committing_at_ack_timeout_is_waited_for(db, user):
+    def slow_session():
+        time.sleep(0.3)
+        return SessionLocal()
+
+    writer = WriteBehindWriter(slow_session, window_ms=0, ack_timeout=0.05).start()
+    try:
+        assert writer.submit(user.id, "weight", RECORD, "web_pwa") is True
+    finally:
+        writer.shutdown()
+    assert weight_rows(db, user.id) == 1
+
+
+def test_shutdown_does_not_hang_on_a_full_queue(user):
+    release = threading.Event()
+
+    def blocked_session():
+        release.wait(5)
+        return SessionLocal()
+
+    writer = WriteBehindWriter(blocked_session, window_ms=0, max_queue=1, submit_timeout=2).start()
+    submitters = [threading.Thread(target=writer.submit, args=(user.id, "weight", RECORD, "web_pwa"))
+                  for _ in range(2)]
+    for thread in submitters:
+        thread.start()
+        time.sleep(0.1)  # the first write is taken by the (blocked) writer, the second fills the queue
+
+    started = time.monotonic()
+    writer.shutdown(timeout=0.2)
+    assert time.monotonic() - started < 1
+
+    release.set()
+    for thread in submitters:
+        thread.join(5)
@@ -0,0 +1,200 @@
+"""
+Optional write-behind mode for single-record writes (group commit).
+
+Under a burst of /add/weight, /add/pressure, ... requests SQLite serializes every
+commit, so requests queue behind each other's fsync. With write-behind enabled one
+writer thread per process collects the records submitted by many requests during a
+short window, commits them as ONE transaction, then acknowledges each request.
+
+Enable with WRITE_BEHIND=1. Tunables (environment variables):
+    WRITE_BEHIND_WINDOW_MS       - how long the writer waits to fill a group, default 5
+    WRITE_BEHIND_MAX_BATCH       - max records per commit, default 200
+    WRITE_BEHIND_MAX_QUEUE       - max pending records before backpressure, default 1000
+    WRITE_BEHIND_SUBMIT_TIMEOUT  - seconds a request waits for queue space, default 0.5
+    WRITE_BEHIND_ACK_TIMEOUT     - seconds a request waits for its commit, default 10
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from services import build_batch_records, stage_records, touch_user_data
+
+_STOP = object()
+
+
+class WriterOverloaded(Exception):
+    """Raised when the write queue is full; the caller should ask the client to retry."""
+
+
+class WriteBehindWriter:
+    def __init__(self, session_factory, window_ms=5, max_batch=200, max_queue=1000,
+                 submit_timeout=0.5, ack_timeout=10.0):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.submit_timeout = submit_timeout
+        self.ack_timeout = ack_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.commits = 0
+        self.records_written = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, user_id, record_type, record_data, source):
+        """
+        Queue one write and block until the group containing it is committed.
+        Raises WriterOverloaded on backpressure, or the write's own error if it failed.
+
+        A write still queued after ack_timeout is cancelled and reported as WriterOverloaded,
+        so the client's retry cannot duplicate it (form writes carry no client_id). A write
+        the writer already picked up is waited for: its commit is underway and its outcome
+        must reach the client.
+        """
+        future = Future()
+        try:
+            self._queue.put((user_id, record_type, record_data, source, future), timeout=self.submit_timeout)
+        except queue.Full:
+            raise WriterOverloaded("Write queue is full, retry later")
+        try:
+            return future.result(timeout=self.ack_timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise WriterOverloaded("Write was not committed in time, retry later")
+            return future.result()
+
+    def shutdown(self, timeout=10.0):
+        """Flush everything queued so far and stop the writer thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print(f"Write-behind: queue still full after {timeout:.0f}s, {self._queue.qsize()} writes not flushed")
+            return
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            group = [item]
+            stop = False
+            deadline = time.monotonic() + self.window
+            while len(group) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                group.append(item)
+
+            self._commit_group(group)
+            if stop:
+                # Drain whatever arrived before the stop marker
+                pending = []
+                while True:
+                    try:
+                        pending.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if pending:
+                    self._commit_group(pending)
+                return
+
+    def _build(self, group):
+        """Build records per item; cancelled items are dropped, items that fail validation are answered immediately."""
+        built = []
+        for user_id, record_type, record_data, source, future in group:
+            if not future.set_running_or_notify_cancel():
+                continue  # the request gave up waiting before the writer got to it
+            try:
+                records = build_batch_records(user_id, [{"type": record_type, "data": record_data}], source)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            built.append((user_id, records, future))
+        return built
+
+    def _commit_group(self, group):
+        built = self._build(group)
+        if not built:
+            return
+
+        db = self.session_factory()
+        try:
+            inserted, _ = stage_records(db, [record for _, records, _ in built for record in records])
+            for user_id in {user_id for user_id, _, _ in built}:
+                touch_user_data(db, user_id)
+            db.commit()
+            self.commits += 1
+            self.records_written += inserted
+            for _, _, future in built:
+                future.set_result(True)
+            return
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+
+        # One bad record must not fail its neighbours: retry each write on its own
+        for user_id, records, future in built:
+            db = self.session_factory()
+            try:
+                inserted, _ = stage_records(db, records)
+                touch_user_data(db, user_id)
+                db.commit()
+                self.commits += 1
+                self.records_written += inserted
+                future.set_result(True)
+            except Exception as e:
+                db.rollback()
+                future.set_exception(e)
+            finally:
+                db.close()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Return the process-wide writer when WRITE_BEHIND=1, otherwise None."""
+    global _writer
+    if os.getenv("WRITE_BEHIND", "0") != "1":
+        return None
+    if _writer is not None:
+        return _writer
+    with _writer_lock:
+        if _writer is not None:
+            return _writer
+        from database import SessionLocal
+        writer = WriteBehindWriter(
+            SessionLocal,
+            window_ms=float(os.getenv("WRITE_BEHIND_WINDOW_MS", "5")),
+            max_batch=int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200")),
+            max_queue=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "1000")),
+            submit_timeout=float(os.getenv("WRITE_BEHIND_SUBMIT_TIMEOUT", "0.5")),
+            ack_timeout=float(os.getenv("WRITE_BEHIND_ACK_TIMEOUT", "10")),
+        ).start()
+        atexit.register(writer.shutdown)
+        _writer = writer
+    return _writer
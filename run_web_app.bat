@@ -16,5 +16,6 @@ echo [3] Iniciando servidor...
 echo    (Si Windows pide permiso del Firewall, dale a "Permitir")
 echo.
 cd desktop_app
+python migrations.py upgrade
 python app.py
 pause